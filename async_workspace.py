@@ -0,0 +1,411 @@
+# async_workspace.py
+"""
+asyncio counterparts of the workspace_actions helpers, for callers (like a
+webhook bot) that fan out hundreds of operations from one event loop.
+
+All calls share one httpx.AsyncClient (one connection pool) and go
+straight to the Directory and Gmail REST endpoints; no googleapiclient
+objects or per-call threads are involved. Each API has a semaphore capping
+its calls in flight (CONCURRENCY), the per-API and per-user quota buckets
+of rate_limit.QUOTAS are awaited rather than slept on, and throttled calls
+and dropped or timed-out connections are retried with the same backoff as
+rate_limit. HTTP errors are raised as googleapiclient HttpError, so
+existing `e.resp.status` checks still work; a connection error that
+outlasts the retries is raised as the httpx.TransportError it is.
+
+    async with AsyncWorkspace() as ws:
+        users = await ws.list_users(200)
+        await asyncio.gather(*(
+            ws.create_filter_from_address(u["primaryEmail"], "billing@vendor.com", "Billing")
+            for u in users
+        ))
+
+The module-level functions (list_users, add_member_to_group, ...) use one
+workspace per event loop (get_async_workspace). Under
+google_clients.set_transport, the transport's async_transport() is used
+instead of the network (fake_workspace.FakeWorkspace has one).
+"""
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+import google_auth_httplib2
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+
+import instrumentation
+from brand_aliases import ALIASES, get_display_name_for_alias, plan_alias_changes
+from google_clients import (
+    ADMIN_EMAIL,
+    DIRECTORY_SCOPES,
+    GMAIL_SCOPES,
+    current_transport,
+    delegated_credentials,
+    load_discovery_document,
+)
+from rate_limit import MAX_RETRIES, METHOD_COSTS, QUOTAS, backoff_delay, is_retryable
+from workspace_actions import MAILBOX_INDEX_MAX_AGE, canonical_filter, filter_body, label_body, member_body
+
+# Calls in flight per API, across all users.
+CONCURRENCY = {"directory": 10, "gmail": 50}
+REQUEST_TIMEOUT = 60.0  # seconds
+# Delegated credentials (and their tokens) kept; a fan-out over more users
+# than this would mint a new token for every call.
+CREDENTIALS_CACHE_SIZE = 10000
+
+_APIS = {
+    "directory": ("admin", "directory_v1", DIRECTORY_SCOPES),
+    "gmail": ("gmail", "v1", GMAIL_SCOPES),
+}
+
+
+class AsyncTokenBucket:
+    """rate_limit.TokenBucket for one event loop: waits with asyncio.sleep."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, cost: float = 1):
+        needed = min(cost, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= needed:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+class _Mailbox:
+    """Labels (casefolded name -> id) and filters (canonical -> filter) of one mailbox."""
+
+    def __init__(self):
+        self.labels: Optional[Dict[str, str]] = None
+        self.filters: Optional[Dict[str, dict]] = None
+        self.created_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+class AsyncWorkspace:
+    def __init__(self, concurrency: Optional[Dict[str, int]] = None, admin_email: str = ADMIN_EMAIL):
+        self.admin_email = admin_email
+        concurrency = {**CONCURRENCY, **(concurrency or {})}
+        self.semaphores = {api: asyncio.Semaphore(n) for api, n in concurrency.items()}
+        self.api_buckets = {api: AsyncTokenBucket(QUOTAS[api][0]) for api in _APIS}
+        self.user_buckets: Dict[Tuple[str, str], AsyncTokenBucket] = {}
+        self.creds: "OrderedDict[Tuple[str, str], Tuple[object, asyncio.Lock]]" = OrderedDict()
+        self.mailboxes: Dict[str, _Mailbox] = {}
+        self.base_urls = {}
+        for api, (name, version, _) in _APIS.items():
+            doc = load_discovery_document(name, version)
+            self.base_urls[api] = doc["rootUrl"] + doc["servicePath"]
+
+        transport = current_transport()
+        options = {}
+        if transport is not None:
+            options["transport"] = transport.async_transport()
+        self.client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=sum(concurrency.values())),
+            event_hooks=instrumentation.httpx_event_hooks(asynchronous=True),
+            **options,
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    # ---------- REQUESTS ----------
+
+    async def _auth_headers(self, api: str, subject: str) -> dict:
+        key = (api, subject.lower())
+        if key not in self.creds:
+            self.creds[key] = (delegated_credentials(_APIS[api][2], subject), asyncio.Lock())
+            while len(self.creds) > CREDENTIALS_CACHE_SIZE:
+                self.creds.popitem(last=False)
+        self.creds.move_to_end(key)
+        creds, lock = self.creds[key]
+        async with lock:
+            if not creds.valid:
+                # google-auth refreshes synchronously; keep it off the event loop.
+                await asyncio.to_thread(creds.refresh, google_auth_httplib2.Request(httplib2.Http()))
+        headers = {}
+        creds.apply(headers)
+        return headers
+
+    def _user_bucket(self, api: str, subject: str) -> AsyncTokenBucket:
+        key = (api, subject.lower())
+        if key not in self.user_buckets:
+            self.user_buckets[key] = AsyncTokenBucket(QUOTAS[api][1])
+        return self.user_buckets[key]
+
+    async def request(self, api: str, method_id: str, subject: str, http_method: str, path: str,
+                      params: Optional[dict] = None, body: Optional[dict] = None) -> dict:
+        """One REST call as subject, under the quotas and with retries; returns the JSON body."""
+        url = self.base_urls[api] + path
+        cost = METHOD_COSTS.get(method_id, 1)
+        attempt = 0
+        with instrumentation.span("api.call", api=api, method=method_id, subject=subject,
+                                  retries=0, quota_wait=0.0) as attributes:
+            while True:
+                waiting = time.perf_counter()
+                await self.api_buckets[api].acquire(cost)
+                await self._user_bucket(api, subject).acquire(cost)
+                attributes["quota_wait"] += time.perf_counter() - waiting
+                try:
+                    async with self.semaphores[api]:
+                        headers = await self._auth_headers(api, subject)
+                        response = await self.client.request(http_method, url, params=params, json=body,
+                                                             headers=headers)
+                except httpx.TransportError as e:  # dropped connection, timeout (like rate_limit)
+                    error = e
+                else:
+                    if response.status_code < 300:
+                        return response.json() if response.content else {}
+                    error = HttpError(
+                        httplib2.Response({"status": response.status_code, **response.headers}),
+                        response.content,
+                        uri=str(response.url),
+                    )
+                    if not is_retryable(error):
+                        raise error
+                if attempt >= MAX_RETRIES:
+                    raise error
+                delay = backoff_delay(attempt, error)
+                attempt += 1
+                attributes["retries"] = attempt
+                await asyncio.sleep(delay)
+
+    # ---------- DIRECTORY ----------
+
+    async def iter_users(self, domain: Optional[str] = None, query: Optional[str] = None,
+                         page_size: int = 500, fields: Optional[str] = None) -> AsyncIterator[dict]:
+        """Every user (optionally in a domain / matching query), page by page."""
+        params = {"maxResults": min(page_size, 500), "orderBy": "email"}
+        if domain:
+            params["domain"] = domain
+        else:
+            params["customer"] = "my_customer"
+        if query:
+            params["query"] = query
+        if fields:
+            params["fields"] = f"nextPageToken,{fields}"
+        while True:
+            page = await self.request("directory", "directory.users.list", self.admin_email,
+                                      "GET", "admin/directory/v1/users", params)
+            for user in page.get("users", []):
+                yield user
+            if not page.get("nextPageToken"):
+                return
+            params["pageToken"] = page["nextPageToken"]
+
+    async def list_users(self, max_results: int = 20) -> List[dict]:
+        """First max_results users by email."""
+        users = []
+        async for user in self.iter_users(page_size=min(max_results, 500)):
+            users.append(user)
+            if len(users) >= max_results:
+                break
+        return users
+
+    async def create_group(self, email: str, name: str, description: str = "") -> dict:
+        return await self.request("directory", "directory.groups.insert", self.admin_email, "POST",
+                                  "admin/directory/v1/groups",
+                                  body={"email": email, "name": name, "description": description})
+
+    async def add_member_to_group(self, group_email: str, member_email: str, role: str = "MEMBER") -> dict:
+        return await self.request("directory", "directory.members.insert", self.admin_email, "POST",
+                                  f"admin/directory/v1/groups/{quote(group_email, safe='')}/members",
+                                  body=member_body(member_email, role))
+
+    # ---------- GMAIL: LABELS & FILTERS ----------
+
+    async def list_labels(self, user_email: str) -> List[dict]:
+        result = await self.request("gmail", "gmail.users.labels.list", user_email,
+                                    "GET", "gmail/v1/users/me/labels")
+        return result.get("labels", [])
+
+    async def create_label(self, user_email: str, label_name: str) -> dict:
+        label = await self.request("gmail", "gmail.users.labels.create", user_email,
+                                   "POST", "gmail/v1/users/me/labels", body=label_body(label_name))
+        mailbox = self.mailboxes.get(user_email.lower())
+        if mailbox is not None and mailbox.labels is not None:
+            mailbox.labels[label["name"].casefold()] = label["id"]
+        return label
+
+    async def _load_labels(self, user_email: str, mailbox: _Mailbox):
+        mailbox.labels = {l["name"].casefold(): l["id"] for l in await self.list_labels(user_email)}
+
+    async def _load_filters(self, user_email: str, mailbox: _Mailbox):
+        result = await self.request("gmail", "gmail.users.settings.filters.list", user_email,
+                                    "GET", "gmail/v1/users/me/settings/filters")
+        mailbox.filters = {canonical_filter(f): f for f in result.get("filter", [])}
+
+    def _mailbox(self, user_email: str) -> _Mailbox:
+        key = user_email.lower()
+        mailbox = self.mailboxes.get(key)
+        if mailbox is None or time.monotonic() - mailbox.created_at > MAILBOX_INDEX_MAX_AGE:
+            mailbox = self.mailboxes[key] = _Mailbox()
+        return mailbox
+
+    async def _label_id(self, user_email: str, mailbox: _Mailbox, label_name: str) -> str:
+        label_id = mailbox.labels.get(label_name.casefold())
+        if label_id is None:
+            await self._load_labels(user_email, mailbox)  # maybe created elsewhere since
+            label_id = mailbox.labels.get(label_name.casefold())
+        if label_id is None:
+            try:
+                label_id = (await self.create_label(user_email, label_name))["id"]
+            except HttpError as e:
+                if e.resp.status != 409:
+                    raise
+                await self._load_labels(user_email, mailbox)
+                label_id = mailbox.labels[label_name.casefold()]
+            mailbox.labels[label_name.casefold()] = label_id
+        return label_id
+
+    async def create_filter_from_address(self, user_email: str, from_address: str, label_name: str) -> dict:
+        """
+        Label mail from from_address with label_name (created if missing).
+        Like the sync helper, an identical existing filter is returned instead
+        of creating a duplicate. Calls for one mailbox run one at a time.
+        """
+        mailbox = self._mailbox(user_email)
+        async with mailbox.lock:
+            if mailbox.labels is None:
+                await asyncio.gather(self._load_labels(user_email, mailbox),
+                                     self._load_filters(user_email, mailbox))
+            body = filter_body(from_address, await self._label_id(user_email, mailbox, label_name))
+            key = canonical_filter(body)
+            if key in mailbox.filters:
+                return mailbox.filters[key]
+            try:
+                created = await self.request("gmail", "gmail.users.settings.filters.create", user_email,
+                                             "POST", "gmail/v1/users/me/settings/filters", body=body)
+            except HttpError as e:
+                if e.resp.status != 400 or b"exists" not in (e.content or b""):
+                    raise
+                await self._load_filters(user_email, mailbox)
+                if key not in mailbox.filters:
+                    raise
+                return mailbox.filters[key]
+            mailbox.filters[key] = created
+            return created
+
+    # ---------- GMAIL: SEND-AS ----------
+
+    async def list_send_as(self, user_email: str) -> Dict[str, dict]:
+        """The user's send-as entries, keyed by lowercased address."""
+        result = await self.request("gmail", "gmail.users.settings.sendAs.list", user_email,
+                                    "GET", "gmail/v1/users/me/settings/sendAs")
+        return {entry["sendAsEmail"].lower(): entry for entry in result.get("sendAs", [])}
+
+    async def create_send_as(self, user_email: str, alias_email: str, display_name: Optional[str] = None) -> dict:
+        """Add alias_email as a send-as alias (an existing one is returned as is)."""
+        body = {
+            "sendAsEmail": alias_email,
+            "displayName": display_name or get_display_name_for_alias(alias_email),
+            "treatAsAlias": True,
+        }
+        try:
+            return await self.request("gmail", "gmail.users.settings.sendAs.create", user_email,
+                                      "POST", "gmail/v1/users/me/settings/sendAs", body=body)
+        except HttpError as e:
+            if e.resp.status != 409:
+                raise
+            return (await self.list_send_as(user_email))[alias_email.lower()]
+
+    async def delete_send_as(self, user_email: str, alias_email: str) -> bool:
+        """Remove a send-as alias; False if it didn't exist."""
+        try:
+            await self.request("gmail", "gmail.users.settings.sendAs.delete", user_email,
+                               "DELETE", f"gmail/v1/users/me/settings/sendAs/{quote(alias_email, safe='')}")
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            return False
+        return True
+
+    async def sync_user_aliases(self, user_email: str, index: Dict[str, Set[str]],
+                                aliases=ALIASES, dry_run: bool = False) -> Dict[str, List[str]]:
+        """
+        auto_reply_as_v3.sync_user_aliases without the printing: plan from
+        the membership index, then apply the adds and removes concurrently.
+        Returns the plan.
+        """
+        plan = plan_alias_changes(user_email, await self.list_send_as(user_email), index, aliases)
+        if not dry_run:
+            await asyncio.gather(
+                *(self.create_send_as(user_email, a) for a in plan["add"]),
+                *(self.delete_send_as(user_email, a) for a in plan["remove"]),
+            )
+        return plan
+
+
+# ---------- PER-LOOP DEFAULT ---------- #
+
+_workspaces: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncWorkspace]" = weakref.WeakKeyDictionary()
+
+
+def get_async_workspace() -> AsyncWorkspace:
+    """The running event loop's shared AsyncWorkspace."""
+    loop = asyncio.get_running_loop()
+    if loop not in _workspaces:
+        _workspaces[loop] = AsyncWorkspace()
+    return _workspaces[loop]
+
+
+async def close_async_workspace():
+    """Close the running loop's shared workspace (e.g. on bot shutdown)."""
+    workspace = _workspaces.pop(asyncio.get_running_loop(), None)
+    if workspace is not None:
+        await workspace.aclose()
+
+
+async def list_users(max_results: int = 20) -> List[dict]:
+    return await get_async_workspace().list_users(max_results)
+
+
+async def create_group(email: str, name: str, description: str = "") -> dict:
+    return await get_async_workspace().create_group(email, name, description)
+
+
+async def add_member_to_group(group_email: str, member_email: str, role: str = "MEMBER") -> dict:
+    return await get_async_workspace().add_member_to_group(group_email, member_email, role)
+
+
+async def list_labels(user_email: str) -> List[dict]:
+    return await get_async_workspace().list_labels(user_email)
+
+
+async def create_label(user_email: str, label_name: str) -> dict:
+    return await get_async_workspace().create_label(user_email, label_name)
+
+
+async def create_filter_from_address(user_email: str, from_address: str, label_name: str) -> dict:
+    return await get_async_workspace().create_filter_from_address(user_email, from_address, label_name)
+
+
+async def list_send_as(user_email: str) -> Dict[str, dict]:
+    return await get_async_workspace().list_send_as(user_email)
+
+
+async def create_send_as(user_email: str, alias_email: str, display_name: Optional[str] = None) -> dict:
+    return await get_async_workspace().create_send_as(user_email, alias_email, display_name)
+
+
+async def delete_send_as(user_email: str, alias_email: str) -> bool:
+    return await get_async_workspace().delete_send_as(user_email, alias_email)
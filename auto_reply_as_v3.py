@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Sync Gmail 'Send mail as' aliases for one user (dcall@utahmmc.com),
+Sync Gmail 'Send mail as' aliases for one or many users,
 based on Google Group membership across three brands:
 
 - tntdump.com
@@ -13,17 +13,38 @@ For each alias address (e.g. accounts@tntdump.com):
     -> ensure a Gmail "Send mail as" alias exists.
 - If user is NOT a member:
     -> delete the Gmail "Send mail as" alias if it exists.
+
+Usage:
+    python auto_reply_as_v3.py                       # USER_EMAIL only
+    python auto_reply_as_v3.py --user a@x --user b@x
+    python auto_reply_as_v3.py --ou /Staff           # everyone in an org unit
+    python auto_reply_as_v3.py --brand-members       # every active user in any alias group
+    python auto_reply_as_v3.py --dry-run ...         # print the plan, change nothing
+    python auto_reply_as_v3.py --metrics ...         # per-method timings at the end
 """
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Set
+
 from googleapiclient.errors import HttpError
 
+import instrumentation
+from batching import GMAIL_BATCH_SIZE, execute_batch
+from brand_aliases import ALIASES, alias_body, is_member, plan_alias_changes
+from directory_mirror import get_mirror
+from google_clients import get_service
+from rate_limit import execute
+from workspace_actions import iter_users
+
 # ---------- CONFIG ---------- #
 
-SERVICE_ACCOUNT_FILE = r"C:\Users\DCALL\Desktop\utahmmc\google-cloud-console\workspace-automation-sa.json"  # path to your SA JSON key
+# The service account key file is configured in google_clients.py (SERVICE_ACCOUNT_FILE).
 USER_EMAIL = "EMAIL ADDRESS----------"                  # user whose aliases we manage
 ADMIN_SUBJECT = "dcall@utahmmc.com"               # super admin for Directory API
+MAX_WORKERS = 8                                   # users synced in parallel
 
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.settings.sharing",
@@ -31,217 +52,305 @@ SCOPES = [
     "https://www.googleapis.com/auth/admin.directory.group.member.readonly",
 ]
 
-# All potential aliases for this user across TNT, Icon, and UWG.
-ALIASES = [
-    # ---------- tntdump.com ----------
-    "inbox@tntdump.com",
-    "accounts@tntdump.com",
-    "ap@tntdump.com",
-    "ar@tntdump.com",
-    "billing@tntdump.com",
-    "contact@tntdump.com",
-    "dev@tntdump.com",
-    "estimates@tntdump.com",
-    "hr@tntdump.com",
-    "info@tntdump.com",
-    "it@tntdump.com",
-    "jobs@tntdump.com",
-    "legal@tntdump.com",
-    "marketing@tntdump.com",
-    "media@tntdump.com",
-    "noreply@tntdump.com",
-    "payroll@tntdump.com",
-    "projects@tntdump.com",
-    "security@tntdump.com",
-    "service@tntdump.com",
-    "support@tntdump.com",
-    "vendors@tntdump.com",
-
-    # ---------- icondumpsters.com ----------
-    "inbox@icondumpsters.com",
-    "icon-dev@icondumpsters.com",
-    "accounts@icondumpsters.com",
-    "ap@icondumpsters.com",
-    "ar@icondumpsters.com",
-    "billing@icondumpsters.com",
-    "contact@icondumpsters.com",
-    "dev@icondumpsters.com",
-    "estimates@icondumpsters.com",
-    "hr@icondumpsters.com",
-    "info@icondumpsters.com",
-    "it@icondumpsters.com",
-    "jobs@icondumpsters.com",
-    "legal@icondumpsters.com",
-    "marketing@icondumpsters.com",
-    "noreply@icondumpsters.com",
-    "payroll@icondumpsters.com",
-    "projects@icondumpsters.com",
-    "sales@icondumpsters.com",
-    "security@icondumpsters.com",
-    "service@icondumpsters.com",
-    "support@icondumpsters.com",
-    "vendors@icondumpsters.com",
-
-    # ---------- utahwatergardens.com ----------
-    "inbox@utahwatergardens.com",
-    "uwg-dev@utahwatergardens.com",
-    "accounts@utahwatergardens.com",
-    "ap@utahwatergardens.com",
-    "ar@utahwatergardens.com",
-    "billing@utahwatergardens.com",
-    "contact@utahwatergardens.com",
-    "dev@utahwatergardens.com",
-    "estimates@utahwatergardens.com",
-    "hr@utahwatergardens.com",
-    "info@utahwatergardens.com",
-    "it@utahwatergardens.com",
-    "jobs@utahwatergardens.com",
-    "legal@utahwatergardens.com",
-    "marketing@utahwatergardens.com",
-    "noreply@utahwatergardens.com",
-    "payroll@utahwatergardens.com",
-    "projects@utahwatergardens.com",
-    "sales@utahwatergardens.com",
-    "security@utahwatergardens.com",
-    "service@utahwatergardens.com",
-    "support@utahwatergardens.com",
-    "vendors@utahwatergardens.com",
-]
-
-# Brand display names per domain
-DOMAIN_DISPLAY_NAME = {
-    "tntdump.com": "TNT Dumpsters",
-    "icondumpsters.com": "Icon Dumpsters",
-    "utahwatergardens.com": "Utah Water Gardens",
-}
-
 
 # ---------- AUTH HELPERS ---------- #
 
-def get_base_credentials():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE,
-        scopes=SCOPES,
-    )
-    # Debug
-    print(f"Using service account: {creds.service_account_email}")
-    return creds
-
+# Clients come from the shared cache in google_clients, so repeated runs in
+# one process reuse the same client (and token) per subject.
 
 def get_directory_service():
-    base_creds = get_base_credentials()
-    delegated = base_creds.with_subject(ADMIN_SUBJECT)
     print(f"Directory API delegated to: {ADMIN_SUBJECT}")
-    return build("admin", "directory_v1", credentials=delegated)
+    return get_service("admin", "directory_v1", SCOPES, ADMIN_SUBJECT)
 
 
 def get_gmail_service_for_user(user_email: str):
-    base_creds = get_base_credentials()
-    delegated = base_creds.with_subject(user_email)
     print(f"Gmail API delegated to: {user_email}")
-    return build("gmail", "v1", credentials=delegated)
+    return get_service("gmail", "v1", SCOPES, user_email)
 
 
 # ---------- DIRECTORY HELPERS ---------- #
 
-def is_user_member_of_group(directory, group_email: str, user_email: str) -> bool:
+def list_group_members(directory, group_email: str) -> Set[str]:
     """
-    Uses Admin SDK Directory members.hasMember to check if user is in group.
-    If the group doesn't exist or can't be checked, returns False.
+    Lowercased emails of the users in group_email, nested groups expanded
+    (the same membership hasMember reports). A group that doesn't exist has
+    no members; any other error is raised rather than read as "not a member".
     """
+    members = directory.members()
+    request = members.list(
+        groupKey=group_email,
+        includeDerivedMembership=True,
+        maxResults=200,
+        fields="nextPageToken,members(email,type)",
+    )
+    emails = set()
     try:
-        resp = directory.members().hasMember(
-            groupKey=group_email,
-            memberKey=user_email,
-        ).execute()
-        is_member = bool(resp.get("isMember"))
-        print(f"[CHECK] {user_email} in {group_email}: {is_member}")
-        return is_member
+        while request is not None:
+            resp = execute(request)
+            emails.update(
+                m["email"].lower()
+                for m in resp.get("members", [])
+                if "email" in m and m.get("type", "USER") == "USER"
+            )
+            request = members.list_next(request, resp)
     except HttpError as e:
-        status = getattr(e.resp, "status", None)
-        print(
-            f"[WARN] could not check membership for {user_email} in {group_email}: "
-            f"HTTP {status} {e}"
-        )
-        return False
+        if getattr(e.resp, "status", None) != 404:
+            raise
+        print(f"[WARN] group {group_email} not found, treating it as empty.")
+    return emails
 
 
-# ---------- GMAIL HELPERS ---------- #
+def build_membership_index(
+    directory,
+    group_emails: Iterable[str] = ALIASES,
+    max_age: Optional[float] = None,
+) -> Dict[str, Set[str]]:
+    """
+    Map each group (lowercased) to its member set with one list pass per
+    group. Build it once per run and pass it to sync_user_aliases for every
+    user; membership checks are then set lookups instead of API calls.
 
-def list_existing_send_as(gmail):
-    resp = gmail.users().settings().sendAs().list(userId="me").execute()
-    send_as = resp.get("sendAs", [])
-    return {entry["sendAsEmail"].lower(): entry for entry in send_as}
+    With max_age (seconds) the index is read from the local directory
+    mirror, which is only refreshed if it is older than that.
+    """
+    if max_age is not None:
+        mirror = get_mirror().ensure_fresh(max_age, ["groups", "members"])
+        index = {g.lower(): mirror.expanded_members(g) for g in group_emails}
+        print(f"Indexed membership of {len(index)} groups from the directory mirror.")
+        return index
+
+    index = {}
+    for group_email in group_emails:
+        index[group_email.lower()] = list_group_members(directory, group_email)
+    print(f"Indexed membership of {len(index)} groups.")
+    return index
+
+
+def suspended_users(max_age: Optional[float] = None) -> Set[str]:
+    """Lowercased emails of every suspended user (from the mirror with max_age)."""
+    if max_age is not None:
+        mirror = get_mirror().ensure_fresh(max_age, ["users"])
+        return {u["primaryEmail"].lower() for u in mirror.users(include_suspended=True) if u.get("suspended")}
+    return {
+        u["primaryEmail"].lower()
+        for u in iter_users(query="isSuspended=true", fields="users(primaryEmail)")
+    }
 
 
-def get_display_name_for_alias(alias_email: str) -> str:
+def brand_group_members(index: Dict[str, Set[str]], max_age: Optional[float] = None) -> List[str]:
     """
-    Choose a reasonable From: display name based on the alias domain.
-    E.g., "TNT Dumpsters" for any @tntdump.com alias.
+    Every active user that belongs to at least one alias group. Suspended
+    members are left out, as users_in_org_unit does.
     """
-    domain = alias_email.split("@")[-1].lower()
-    return DOMAIN_DISPLAY_NAME.get(domain, alias_email)
+    members = set().union(*index.values()) if index else set()
+    if not members:
+        return []
+    return sorted(members - suspended_users(max_age))
+
+
+def users_in_org_unit(org_unit_path: str, max_age: Optional[float] = None) -> List[str]:
+    """Active users in an org unit (and its children)."""
+    if max_age is not None:
+        mirror = get_mirror().ensure_fresh(max_age, ["users"])
+        return [u["primaryEmail"] for u in mirror.users(org_unit_path=org_unit_path)]
+    return [
+        u["primaryEmail"]
+        for u in iter_users(
+            query=f"orgUnitPath='{org_unit_path}'",
+            fields="users(primaryEmail,suspended)",
+        )
+        if not u.get("suspended")
+    ]
 
 
-def create_alias(gmail, user_email: str, alias_email: str):
-    display_name = get_display_name_for_alias(alias_email)
-    body = {
-        "sendAsEmail": alias_email,
-        "displayName": display_name,
-        "treatAsAlias": True,
-    }
-    print(f"[ADD]   Creating send-as alias {alias_email} for {user_email} "
-          f"(displayName='{display_name}')")
-    created = gmail.users().settings().sendAs().create(
-        userId="me",
-        body=body,
-    ).execute()
-    print(f"       -> verificationStatus={created.get('verificationStatus')}")
+# ---------- GMAIL HELPERS ---------- #
 
+def list_existing_send_as(gmail):
+    resp = execute(gmail.users().settings().sendAs().list(userId="me"))
+    send_as = resp.get("sendAs", [])
+    return {entry["sendAsEmail"].lower(): entry for entry in send_as}
 
-def delete_alias(gmail, user_email: str, alias_email: str):
-    print(f"[REMOVE] Deleting send-as alias {alias_email} for {user_email}")
-    gmail.users().settings().sendAs().delete(
-        userId="me",
-        sendAsEmail=alias_email,
-    ).execute()
+
+def create_aliases(gmail, user_email: str, alias_emails):
+    """Create several send-as aliases for one user in batched requests."""
+    send_as = gmail.users().settings().sendAs()
+    calls = [
+        (alias, send_as.create(userId="me", body=alias_body(alias)))
+        for alias in alias_emails
+    ]
+    results = execute_batch(gmail, calls, GMAIL_BATCH_SIZE)
+    for r in results:
+        if r.ok:
+            print(f"[ADD]   {r.key} for {user_email} "
+                  f"-> verificationStatus={r.response.get('verificationStatus')}")
+        else:
+            print(f"[ERROR] could not create {r.key} for {user_email}: {r.error}")
+    return results
+
+
+def delete_aliases(gmail, user_email: str, alias_emails):
+    """Delete several send-as aliases for one user in batched requests."""
+    send_as = gmail.users().settings().sendAs()
+    calls = [
+        (alias, send_as.delete(userId="me", sendAsEmail=alias))
+        for alias in alias_emails
+    ]
+    results = execute_batch(gmail, calls, GMAIL_BATCH_SIZE)
+    for r in results:
+        if r.ok:
+            print(f"[REMOVE] {r.key} for {user_email}")
+        else:
+            print(f"[ERROR] could not delete {r.key} for {user_email}: {r.error}")
+    return results
 
 
 # ---------- MAIN SYNC LOGIC ---------- #
 
-def sync_user_aliases(user_email: str):
-    directory = get_directory_service()
+def print_plan(user_email: str, plan: Dict[str, List[str]]):
+    for alias in plan["add"]:
+        print(f"[ADD]   {user_email} is member of {alias}, alias missing.")
+    for alias in plan["remove"]:
+        print(f"[REMOVE] {user_email} is NOT member of {alias}, alias configured.")
+    print(f"[PLAN]  {user_email}: {len(plan['add'])} to add, {len(plan['remove'])} to remove, "
+          f"{len(plan['keep'])} kept, {len(plan['skip'])} skipped.")
+
+
+def apply_alias_plan(gmail, user_email: str, plan: Dict[str, List[str]], existing: Dict[str, dict]) -> Counter:
+    """
+    Run only the adds and removes of plan, in batches, and update existing
+    in place from the API responses (no second list call).
+    """
+    counts = Counter()
+    if plan["add"]:
+        for r in create_aliases(gmail, user_email, plan["add"]):
+            if r.ok:
+                existing[r.key.lower()] = r.response
+                counts["added"] += 1
+            else:
+                counts["failed"] += 1
+    if plan["remove"]:
+        for r in delete_aliases(gmail, user_email, plan["remove"]):
+            if r.ok:
+                existing.pop(r.key.lower(), None)
+                counts["removed"] += 1
+            else:
+                counts["failed"] += 1
+    return counts
+
+
+def sync_user_aliases(user_email: str, index: Dict[str, Set[str]] = None, dry_run: bool = False) -> Counter:
+    """
+    Sync one user's aliases; returns counts of added/kept/removed/skipped
+    (and failed). With dry_run=True only the plan is printed. A user whose
+    aliases are already in sync costs one read and no writes.
+    """
+    if index is None:
+        index = build_membership_index(get_directory_service())
     gmail = get_gmail_service_for_user(user_email)
 
     existing = list_existing_send_as(gmail)
-    print("Existing send-as before sync:")
-    for addr in sorted(existing.keys()):
-        print(f"  - {addr}")
-
-    print("\nSyncing aliases based on group membership...\n")
-
-    for alias in ALIASES:
-        alias_lc = alias.lower()
-        member = is_user_member_of_group(directory, alias, user_email)
-        has_alias = alias_lc in existing
-
-        if member and not has_alias:
-            create_alias(gmail, user_email, alias)
-        elif member and has_alias:
-            print(f"[KEEP]  {user_email} is member of {alias}, alias already exists.")
-        elif not member and has_alias:
-            delete_alias(gmail, user_email, alias)
+    plan = plan_alias_changes(user_email, existing, index)
+    print_plan(user_email, plan)
+
+    counts = Counter(kept=len(plan["keep"]), skipped=len(plan["skip"]))
+    if dry_run:
+        counts["would_add"] = len(plan["add"])
+        counts["would_remove"] = len(plan["remove"])
+        return counts
+
+    if plan["add"] or plan["remove"]:
+        counts.update(apply_alias_plan(gmail, user_email, plan, existing))
+        print(f"Send-as list for {user_email} after sync:")
+        for addr in sorted(existing.keys()):
+            print(f"  - {addr}")
+    return counts
+
+
+# ---------- MULTI-USER ENGINE ---------- #
+
+def sync_many_users(
+    user_emails: Iterable[str],
+    index: Dict[str, Set[str]] = None,
+    max_workers: int = MAX_WORKERS,
+    dry_run: bool = False,
+) -> Dict[str, object]:
+    """
+    Sync aliases for many users. The membership index is built once and
+    shared; each user's Gmail work runs on a bounded thread pool (every
+    worker uses that user's own Gmail client). Returns user -> Counter, or
+    the exception that stopped that user.
+    """
+    if index is None:
+        index = build_membership_index(get_directory_service())
+    user_emails = list(dict.fromkeys(u.lower() for u in user_emails))
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(sync_user_aliases, u, index, dry_run): u for u in user_emails}
+        for future in as_completed(futures):
+            user_email = futures[future]
+            try:
+                results[user_email] = future.result()
+            except Exception as e:  # one bad mailbox shouldn't stop the run
+                print(f"[ERROR] sync failed for {user_email}: {e}")
+                results[user_email] = e
+    return results
+
+
+def print_summary(results: Dict[str, object], elapsed: float):
+    totals = Counter()
+    failed = []
+    for user_email, outcome in sorted(results.items()):
+        if isinstance(outcome, Exception):
+            failed.append(user_email)
         else:
-            print(f"[SKIP]  {user_email} is NOT member of {alias}, and alias not configured.")
-
-    print("\nFinal send-as list after sync:")
-    updated = list_existing_send_as(gmail)
-    for addr in sorted(updated.keys()):
-        print(f"  - {addr}")
+            totals.update(outcome)
+
+    print("\n========== SUMMARY ==========")
+    print(f"Users synced: {len(results) - len(failed)} / {len(results)} in {elapsed:.1f}s")
+    if totals["would_add"] or totals["would_remove"]:
+        print(f"Dry run: would add {totals['would_add']}, would remove {totals['would_remove']}")
+    print(f"Aliases added: {totals['added']}, kept: {totals['kept']}, removed: {totals['removed']}, "
+          f"failed: {totals['failed']}")
+    for user_email in failed:
+        print(f"  FAILED: {user_email} ({results[user_email]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync Gmail send-as aliases from group membership.")
+    parser.add_argument("--user", action="append", default=[], help="user to sync (repeatable)")
+    parser.add_argument("--ou", help="sync every active user in this org unit path, e.g. /Staff")
+    parser.add_argument("--brand-members", action="store_true",
+                        help="sync every active user that belongs to any alias group")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--dry-run", action="store_true", help="print the plan, change nothing")
+    parser.add_argument("--max-age", type=float,
+                        help="read membership/users from the local directory mirror if it is "
+                             "at most this many seconds old (refreshing it otherwise)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="print per-method latency, retries, bytes and token refreshes at the end")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    directory = get_directory_service() if args.max_age is None else None
+    index = build_membership_index(directory, max_age=args.max_age)
+
+    users = list(args.user)
+    if args.ou:
+        users += users_in_org_unit(args.ou, max_age=args.max_age)
+    if args.brand_members:
+        users += brand_group_members(index, max_age=args.max_age)
+    if not users:
+        users = [USER_EMAIL]
+
+    print(f"Syncing send-as aliases for {len(users)} user(s)")
+    results = sync_many_users(users, index, max_workers=args.workers, dry_run=args.dry_run)
+    print_summary(results, time.monotonic() - started)
+    if args.metrics:
+        print("\n" + instrumentation.summary())
+    print("\nDone. In Gmail UI for each user, make sure:")
+    print('  Settings → Accounts → "Reply from the same address the message was sent to" is selected.')
 
 
 if __name__ == "__main__":
-    print(f"Syncing send-as aliases for {USER_EMAIL}")
-    sync_user_aliases(USER_EMAIL)
-    print("\nDone. In Gmail UI for this user, make sure:")
-    print('  Settings → Accounts → "Reply from the same address the message was sent to" is selected.')
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Export a dated snapshot of the tenant into _backups/<MM-DD-YY>/.
+
+Each collection is streamed page by page to JSON Lines (optionally gzipped),
+so the tenant is never held in memory:
+
+    users.jsonl              one user per line
+    groups.jsonl             one group per line
+    group_memberships.jsonl  {"group": ..., "member": {...}} per line
+    org_units.jsonl          one org unit per line
+    <mailbox>.json           Gmail settings (labels, filters, send-as, ...)
+    manifest.json            record counts and sha256 of every file
+
+Collections are named .jsonl, not .json, because each file is a stream of
+JSON Lines rather than one JSON document. This replaces the empty
+users.json / groups.json / group_memberships.json / org_units.json
+placeholders that _backups/12-03-25/ had before this exporter existed.
+Mailbox files keep the <mailbox>.json name, since each holds one object.
+
+Group members and per-mailbox Gmail settings are fetched concurrently.
+
+Usage:
+    python backup.py                                  # admin mailbox only
+    python backup.py --mailbox a@x --mailbox b@x --gzip
+    python backup.py --all-mailboxes --workers 16
+    python backup.py --incremental                    # see snapshots.py
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List
+
+from google_clients import ADMIN_EMAIL, get_directory_service, get_gmail_service, thread_http
+from rate_limit import execute
+from snapshots import DATE_FORMAT, ObjectStore, write_manifest
+from workspace_actions import iter_group_members, iter_groups, iter_org_units, iter_users
+
+BACKUP_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_backups")
+MAX_WORKERS = 8
+
+
+# ---------- FILE HELPERS ---------- #
+
+def _open_out(path: str, compress: bool):
+    if compress:
+        return gzip.open(path + ".gz", "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_jsonl(path: str, records: Iterable[dict], compress: bool = False) -> dict:
+    """Stream records to path (one JSON object per line); returns its manifest entry."""
+    count = 0
+    with _open_out(path, compress) as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True))
+            f.write("\n")
+            count += 1
+    final = path + ".gz" if compress else path
+    return {"file": os.path.basename(final), "count": count, "sha256": _sha256(final)}
+
+
+def bounded_map(fn: Callable, items: Iterable, workers: int) -> Iterator:
+    """Like pool.map, in input order, but with at most 2 * workers tasks queued."""
+    window = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            window.append(pool.submit(fn, item))
+            if len(window) >= 2 * workers:
+                yield window.pop(0).result()
+        for future in window:
+            yield future.result()
+
+
+# ---------- FETCHERS ---------- #
+
+def _group_members(group_email: str) -> List[dict]:
+    http = thread_http(get_directory_service())
+    return [
+        {"group": group_email, "member": m}
+        for m in iter_group_members(group_email, http=http)
+    ]
+
+
+def mailbox_settings(user_email: str) -> dict:
+    """The Gmail settings we can restore for one mailbox."""
+    gmail = get_gmail_service(user_email)
+    users = gmail.users()
+    settings = users.settings()
+    return {
+        "user": user_email,
+        "labels": execute(users.labels().list(userId="me")).get("labels", []),
+        "filters": execute(settings.filters().list(userId="me")).get("filter", []),
+        "sendAs": execute(settings.sendAs().list(userId="me")).get("sendAs", []),
+        "forwardingAddresses": execute(
+            settings.forwardingAddresses().list(userId="me")
+        ).get("forwardingAddresses", []),
+        "autoForwarding": execute(settings.getAutoForwarding(userId="me")),
+        "vacation": execute(settings.getVacation(userId="me")),
+    }
+
+
+# ---------- SNAPSHOT ---------- #
+
+def snapshot_streams(mailboxes: Iterable[str], workers: int = MAX_WORKERS):
+    """
+    (collection, records) for every collection in a snapshot, each a lazy
+    stream. Consume them in order: memberships are listed for the groups
+    seen while the groups stream was consumed.
+    """
+    group_emails = []
+
+    def groups():
+        for g in iter_groups(prefetch=True):
+            group_emails.append(g["email"])
+            yield g
+
+    def memberships():
+        for rows in bounded_map(_group_members, group_emails, workers):
+            yield from rows
+
+    mailboxes = list(dict.fromkeys(m.lower() for m in mailboxes))
+    return [
+        ("users", iter_users(prefetch=True)),
+        ("groups", groups()),
+        ("group_memberships", memberships()),
+        ("org_units", iter_org_units()),
+        ("mailboxes", bounded_map(mailbox_settings, mailboxes, workers)),
+    ]
+
+
+def _write_manifest_json(out_dir: str, started: float, files: dict, **extra) -> dict:
+    manifest = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        **extra,
+        "elapsed_seconds": round(time.monotonic() - started, 1),
+        "files": files,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def export_snapshot(
+    out_dir: str,
+    mailboxes: Iterable[str] = (ADMIN_EMAIL,),
+    compress: bool = False,
+    workers: int = MAX_WORKERS,
+) -> dict:
+    """Full snapshot: every collection written out as JSON Lines."""
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.monotonic()
+    files = {}
+
+    for collection, records in snapshot_streams(mailboxes, workers):
+        if collection == "mailboxes":
+            for settings in records:
+                path = os.path.join(out_dir, f"{settings['user']}.json")
+                entry = write_jsonl(path, [settings], compress)
+                entry["count"] = sum(
+                    len(settings[k]) for k in ("labels", "filters", "sendAs", "forwardingAddresses")
+                )
+                files[f"mailbox:{settings['user']}"] = entry
+            print(f"[BACKUP] mailboxes: {sum(k.startswith('mailbox:') for k in files)}")
+            continue
+        files[collection] = write_jsonl(os.path.join(out_dir, f"{collection}.jsonl"), records, compress)
+        print(f"[BACKUP] {collection}: {files[collection]['count']}")
+
+    return _write_manifest_json(out_dir, started, files, compressed=compress)
+
+
+def export_incremental_snapshot(
+    out_dir: str,
+    mailboxes: Iterable[str] = (ADMIN_EMAIL,),
+    workers: int = MAX_WORKERS,
+    root: str = BACKUP_ROOT,
+) -> dict:
+    """
+    Incremental snapshot: records go to the shared content-addressed store
+    (root/objects) and out_dir only gets sorted per-collection manifests.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.monotonic()
+    store = ObjectStore(root)
+    files = {}
+
+    for collection, records in snapshot_streams(mailboxes, workers):
+        stats = write_manifest(out_dir, collection, records, store)
+        stats["sha256"] = _sha256(os.path.join(out_dir, stats["file"]))
+        files[collection] = stats
+        print(f"[BACKUP] {collection}: {stats['count']} ({stats['new_objects']} new)")
+
+    return _write_manifest_json(out_dir, started, files, incremental=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a tenant snapshot to _backups/<date>/.")
+    parser.add_argument("--root", default=BACKUP_ROOT)
+    parser.add_argument("--date", default=datetime.now().strftime(DATE_FORMAT))
+    parser.add_argument("--gzip", action="store_true", help="gzip every file")
+    parser.add_argument("--incremental", action="store_true",
+                        help="store records once in _backups/objects and write only manifests")
+    parser.add_argument("--mailbox", action="append", default=[], help="mailbox to back up (repeatable)")
+    parser.add_argument("--all-mailboxes", action="store_true", help="back up every active user's mailbox")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    mailboxes = list(args.mailbox)
+    if args.all_mailboxes:
+        mailboxes += [
+            u["primaryEmail"]
+            for u in iter_users(fields="users(primaryEmail,suspended)")
+            if not u.get("suspended")
+        ]
+    if not mailboxes:
+        mailboxes = [ADMIN_EMAIL]
+
+    out_dir = os.path.join(args.root, args.date)
+    if args.incremental:
+        manifest = export_incremental_snapshot(out_dir, mailboxes, workers=args.workers, root=args.root)
+    else:
+        manifest = export_snapshot(out_dir, mailboxes, compress=args.gzip, workers=args.workers)
+    print(f"\nSnapshot written to {out_dir} in {manifest['elapsed_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# batching.py
+"""
+Send many Directory / Gmail calls as HTTP batch requests.
+
+Each call is an unexecuted request (e.g. `service.users().insert(body=...)`)
+paired with a key of your choosing; results come back in input order with
+the key, so every response or error can be traced to the input it came from.
+"""
+import time
+from typing import Any, Iterable, List, NamedTuple, Optional, Tuple
+
+from rate_limit import backoff_delay, is_retryable, scheduler
+
+# Calls per batch request. Admin SDK allows up to 1000 and Gmail up to 100,
+# but Gmail recommends 50 or fewer to stay clear of per-user rate limits.
+DIRECTORY_BATCH_SIZE = 100
+GMAIL_BATCH_SIZE = 50
+
+
+class BatchResult(NamedTuple):
+    key: Any
+    response: Optional[dict]
+    error: Optional[Exception]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _chunks(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def execute_batch(service, calls: Iterable[Tuple[Any, Any]], batch_size: int) -> List[BatchResult]:
+    """
+    Execute (key, request) pairs batch_size at a time on service.
+
+    A failing call does not fail the batch; its error is reported in
+    its BatchResult and the rest carry on. Calls that were throttled
+    (429 / 5xx / rate-limit 403) are re-sent in a later batch after a
+    backoff, and every batch goes through the shared rate_limit scheduler.
+    """
+    calls = list(calls)
+    results: List[Optional[BatchResult]] = [None] * len(calls)
+
+    def on_response(request_id, response, exception):
+        index = int(request_id)
+        results[index] = BatchResult(calls[index][0], response, exception)
+
+    pending = list(range(len(calls)))
+    attempt = 0
+    while pending:
+        for chunk in _chunks(pending, batch_size):
+            batch = service.new_batch_http_request(callback=on_response)
+            for index in chunk:
+                batch.add(calls[index][1], request_id=str(index))
+            scheduler.execute_batch(batch, [calls[index][1] for index in chunk])
+
+        pending = [i for i in pending if results[i].error is not None and is_retryable(results[i].error)]
+        if not pending or attempt >= scheduler.max_retries:
+            break
+        scheduler.report_throttle(calls[pending[0]][1].methodId.split(".")[0])
+        delay = backoff_delay(attempt)
+        attempt += 1
+        print(f"[RETRY] {len(pending)} throttled batch call(s); attempt {attempt} in {delay:.1f}s")
+        time.sleep(delay)
+
+    return results
+
+
+def summarize(results: List[BatchResult]) -> str:
+    failed = [r for r in results if not r.ok]
+    return f"{len(results) - len(failed)} ok, {len(failed)} failed"
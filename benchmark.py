@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the toolkit's hot paths, run against the in-process fake
+tenant (fake_workspace.py) with simulated network latency.
+
+For each scenario and tenant size it records wall time, per-operation
+latency (mean / p50 / p99), API round trips and calls, OpenAI requests and
+the tracemalloc peak of one extra traced operation, and saves everything
+as JSON:
+
+    python benchmark.py                                  # 100, 1k and 10k users
+    python benchmark.py --sizes 1000 --scenarios list_users,alias_sync
+    python benchmark.py --latency 0.05 --out before.json
+    python benchmark.py --compare before.json            # deltas vs. an earlier run
+
+Scenarios go through the real client code, including rate_limit's quota
+buckets, so throttling shows up in the numbers just as it would against
+Google.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List
+
+from fake_workspace import FakeOpenAI, FakeWorkspace, grammar_planner
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_cache", "bench")
+SIZES = [100, 1000, 10000]
+ITERATIONS = 20
+LATENCY = 0.02       # seconds per round trip
+JITTER = 0.01
+LLM_LATENCY = 0.3    # seconds per chat completion
+
+EMAIL_RE = re.compile(r"[\w.%+'-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def nl_planner(text: str) -> dict:
+    """Stands in for the model: known phrasings, plus "put <user> in <group>"."""
+    plan = grammar_planner(text)
+    emails = EMAIL_RE.findall(text)
+    if not plan["steps"] and len(emails) == 2:
+        plan["steps"] = [{
+            "id": "s1", "action": "add_member_to_group", "depends_on": [],
+            "params": {"group_email": emails[1], "member_email": emails[0], "role": "MEMBER"},
+        }]
+    return plan
+
+
+class Tenant:
+    """A seeded fake tenant plus what the scenarios need from it."""
+
+    def __init__(self, size: int, latency: float, jitter: float, llm_latency: float, seed: int):
+        from brand_aliases import ALIASES
+
+        self.size = size
+        self.ws = FakeWorkspace.seeded(
+            users=size, groups=5, members_per_group=min(50, size), group_emails=ALIASES,
+            latency=latency, jitter=jitter, seed=seed,
+        )
+        self.openai = FakeOpenAI(latency=llm_latency, planner=nl_planner, seed=seed)
+        self.users = [u for u in self.ws.users if not self.ws.users[u]["suspended"]]
+        alias_groups = {a.lower() for a in ALIASES}
+        self.alias_members = sorted({m for g in alias_groups for m in self.ws.members.get(g, {})})
+        self.groups = sorted(self.ws.groups)
+
+    def __enter__(self):
+        self.ws.install()
+        self.openai.install()
+        # Scenarios register whatever else they patch here.
+        self.cleanup = contextlib.ExitStack()
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup.close()
+        self.openai.uninstall()
+        self.ws.uninstall()
+
+
+# ---------- SCENARIOS ---------- #
+# Each takes a Tenant, does any untimed setup, and returns op(i).
+
+def client_construction(t: Tenant) -> Callable[[int], None]:
+    from google_clients import clear_client_cache, get_gmail_service
+
+    def op(i):
+        clear_client_cache()
+        get_gmail_service(t.users[i % len(t.users)])
+    return op
+
+
+def client_cached(t: Tenant) -> Callable[[int], None]:
+    from google_clients import get_gmail_service
+
+    get_gmail_service(t.users[0])
+    return lambda i: get_gmail_service(t.users[0])
+
+
+def list_users(t: Tenant) -> Callable[[int], None]:
+    from workspace_actions import list_users as list_all
+
+    return lambda i: list_all(max_results=t.size + 1)
+
+
+def create_filter(t: Tenant) -> Callable[[int], None]:
+    from workspace_actions import create_filter_from_address
+
+    def op(i):
+        create_filter_from_address(t.users[i % len(t.users)], f"billing{i}@vendor.example", "Vendors")
+    return op
+
+
+def alias_sync(t: Tenant) -> Callable[[int], None]:
+    from auto_reply_as_v3 import build_membership_index, sync_user_aliases
+    from google_clients import get_directory_service
+
+    index = build_membership_index(get_directory_service())
+    return lambda i: sync_user_aliases(t.alias_members[i % len(t.alias_members)], index)
+
+
+def nl_dispatch(t: Tenant) -> Callable[[int], None]:
+    import chat_to_workspace
+    from plan_cache import PlanCache
+
+    # A private cache, so runs neither read nor pollute the real one.
+    cache = PlanCache(f"bench\n{chat_to_workspace.SYSTEM_PROMPT}", ":memory:", fixed_values=chat_to_workspace.ROLES)
+    t.cleanup.callback(setattr, chat_to_workspace, "plan_cache", chat_to_workspace.plan_cache)
+    chat_to_workspace.plan_cache = lambda: cache
+    t.sources = Counter()
+
+    def op(i):
+        user, group = t.users[i % len(t.users)], t.groups[i % len(t.groups)]
+        text = f"add {user} to {group}" if i % 2 else f"could you put {user} in the {group} group"
+        plan, source = chat_to_workspace.plan_command_with_source(text)
+        t.sources[source] += 1
+        chat_to_workspace.run_plan(plan)
+    return op
+
+
+SCENARIOS: Dict[str, Callable[[Tenant], Callable[[int], None]]] = {
+    "client_construction": client_construction,
+    "client_cached": client_cached,
+    "list_users": list_users,
+    "create_filter_from_address": create_filter,
+    "alias_sync": alias_sync,
+    "nl_plan_dispatch": nl_dispatch,
+}
+
+
+def run_scenario(name: str, tenant: Tenant, iterations: int) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        op = SCENARIOS[name](tenant)
+        tenant.ws.reset_stats()
+        openai_before = tenant.openai.stats["requests"]
+        latencies = []
+        start = time.perf_counter()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            op(i)
+            latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - start
+        stats = Counter(tenant.ws.stats)
+        openai_requests = tenant.openai.stats["requests"] - openai_before
+        sources = dict(getattr(tenant, "sources", None) or {})
+
+        tracemalloc.start()
+        op(iterations)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {
+        "scenario": name,
+        "users": tenant.size,
+        "iterations": iterations,
+        "wall_s": round(wall, 4),
+        "mean_ms": round(1000 * wall / iterations, 3),
+        "p50_ms": round(1000 * percentile(latencies, 50), 3),
+        "p99_ms": round(1000 * percentile(latencies, 99), 3),
+        "round_trips": stats["round_trips"],
+        "api_calls": stats["calls"],
+        "round_trips_per_op": round(stats["round_trips"] / iterations, 2),
+        "batches": stats["batches"],
+        "token_refreshes": stats["token_refreshes"],
+        "errors": sum(v for k, v in stats.items() if k.startswith("status_")),
+        "openai_requests": openai_requests,
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+    if sources:
+        result["plan_sources"] = sources
+        tenant.sources = None
+    return result
+
+
+# ---------- REPORTING ---------- #
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(results: List[dict]):
+    print(f"{'scenario':<28}{'users':>7}{'wall s':>9}{'p50 ms':>10}{'p99 ms':>10}{'rt/op':>8}{'peak KB':>10}")
+    for r in results:
+        print(f"{r['scenario']:<28}{r['users']:>7}{r['wall_s']:>9.2f}{r['p50_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['round_trips_per_op']:>8.2f}{r['peak_memory_kb']:>10.1f}")
+
+
+def compare(results: List[dict], baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["scenario"], r["users"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (new / old):")
+    for r in results:
+        old = baseline.get((r["scenario"], r["users"]))
+        if old is None:
+            continue
+        ratios = []
+        for key in ("p50_ms", "p99_ms", "round_trips_per_op", "peak_memory_kb"):
+            ratios.append(f"{key} {r[key] / old[key]:.2f}x" if old[key] else f"{key} {r[key]} (was 0)")
+        print(f"  {r['scenario']:<28}{r['users']:>7}  " + ", ".join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the toolkit against a fake tenant.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated user counts")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenario names")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS, help="timed operations per scenario")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds per API round trip")
+    parser.add_argument("--jitter", type=float, default=JITTER, help="extra random seconds per round trip")
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY, help="seconds per chat completion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON results path (default _cache/bench/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        started = time.perf_counter()
+        tenant = Tenant(size, args.latency, args.jitter, args.llm_latency, args.seed)
+        print(f"[BENCH] {size} users seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        with tenant:
+            for name in scenarios:
+                results.append(run_scenario(name, tenant, args.iterations))
+                print(f"[BENCH] {name} @ {size}: {results[-1]['wall_s']:.2f}s", file=sys.stderr)
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_s": args.latency,
+            "jitter_s": args.jitter,
+            "llm_latency_s": args.llm_latency,
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(BENCH_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_table(results)
+    print(f"\nResults saved to {out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# brand_aliases.py
+"""
+The brand alias groups and the send-as planning shared by
+auto_reply_as_v3.py (threaded CLI) and async_workspace.py (asyncio).
+
+A user should have a Gmail "Send mail as" alias for exactly the ALIASES
+groups they belong to; plan_alias_changes works out the difference from
+their current send-as list and a group membership index (group -> member
+set, both lowercased).
+"""
+from typing import Dict, Iterable, List, Set
+
+# All potential aliases for this user across TNT, Icon, and UWG.
+ALIASES = [
+    # ---------- tntdump.com ----------
+    "inbox@tntdump.com",
+    "accounts@tntdump.com",
+    "ap@tntdump.com",
+    "ar@tntdump.com",
+    "billing@tntdump.com",
+    "contact@tntdump.com",
+    "dev@tntdump.com",
+    "estimates@tntdump.com",
+    "hr@tntdump.com",
+    "info@tntdump.com",
+    "it@tntdump.com",
+    "jobs@tntdump.com",
+    "legal@tntdump.com",
+    "marketing@tntdump.com",
+    "media@tntdump.com",
+    "noreply@tntdump.com",
+    "payroll@tntdump.com",
+    "projects@tntdump.com",
+    "security@tntdump.com",
+    "service@tntdump.com",
+    "support@tntdump.com",
+    "vendors@tntdump.com",
+
+    # ---------- icondumpsters.com ----------
+    "inbox@icondumpsters.com",
+    "icon-dev@icondumpsters.com",
+    "accounts@icondumpsters.com",
+    "ap@icondumpsters.com",
+    "ar@icondumpsters.com",
+    "billing@icondumpsters.com",
+    "contact@icondumpsters.com",
+    "dev@icondumpsters.com",
+    "estimates@icondumpsters.com",
+    "hr@icondumpsters.com",
+    "info@icondumpsters.com",
+    "it@icondumpsters.com",
+    "jobs@icondumpsters.com",
+    "legal@icondumpsters.com",
+    "marketing@icondumpsters.com",
+    "noreply@icondumpsters.com",
+    "payroll@icondumpsters.com",
+    "projects@icondumpsters.com",
+    "sales@icondumpsters.com",
+    "security@icondumpsters.com",
+    "service@icondumpsters.com",
+    "support@icondumpsters.com",
+    "vendors@icondumpsters.com",
+
+    # ---------- utahwatergardens.com ----------
+    "inbox@utahwatergardens.com",
+    "uwg-dev@utahwatergardens.com",
+    "accounts@utahwatergardens.com",
+    "ap@utahwatergardens.com",
+    "ar@utahwatergardens.com",
+    "billing@utahwatergardens.com",
+    "contact@utahwatergardens.com",
+    "dev@utahwatergardens.com",
+    "estimates@utahwatergardens.com",
+    "hr@utahwatergardens.com",
+    "info@utahwatergardens.com",
+    "it@utahwatergardens.com",
+    "jobs@utahwatergardens.com",
+    "legal@utahwatergardens.com",
+    "marketing@utahwatergardens.com",
+    "noreply@utahwatergardens.com",
+    "payroll@utahwatergardens.com",
+    "projects@utahwatergardens.com",
+    "sales@utahwatergardens.com",
+    "security@utahwatergardens.com",
+    "service@utahwatergardens.com",
+    "support@utahwatergardens.com",
+    "vendors@utahwatergardens.com",
+]
+
+# Brand display names per domain
+DOMAIN_DISPLAY_NAME = {
+    "tntdump.com": "TNT Dumpsters",
+    "icondumpsters.com": "Icon Dumpsters",
+    "utahwatergardens.com": "Utah Water Gardens",
+}
+
+
+def is_member(index: Dict[str, Set[str]], group_email: str, user_email: str) -> bool:
+    return user_email.lower() in index.get(group_email.lower(), ())
+
+
+def get_display_name_for_alias(alias_email: str) -> str:
+    """
+    Choose a reasonable From: display name based on the alias domain.
+    E.g., "TNT Dumpsters" for any @tntdump.com alias.
+    """
+    domain = alias_email.split("@")[-1].lower()
+    return DOMAIN_DISPLAY_NAME.get(domain, alias_email)
+
+
+def alias_body(alias_email: str) -> dict:
+    return {
+        "sendAsEmail": alias_email,
+        "displayName": get_display_name_for_alias(alias_email),
+        "treatAsAlias": True,
+    }
+
+
+def plan_alias_changes(
+    user_email: str,
+    existing: Dict[str, dict],
+    index: Dict[str, Set[str]],
+    aliases: Iterable[str] = ALIASES,
+) -> Dict[str, List[str]]:
+    """
+    Work out what a sync would do without touching anything.
+
+    existing is the user's current send-as map (lowercased address -> entry) and
+    index the group membership index. Returns lists of alias addresses
+    under "add", "keep", "remove" and "skip".
+    """
+    plan = {"add": [], "keep": [], "remove": [], "skip": []}
+    for alias in aliases:
+        member = is_member(index, alias, user_email)
+        has_alias = alias.lower() in existing
+
+        if member and not has_alias:
+            plan["add"].append(alias)
+        elif member and has_alias:
+            plan["keep"].append(alias)
+        elif not member and has_alias:
+            plan["remove"].append(alias)
+        else:
+            plan["skip"].append(alias)
+    return plan
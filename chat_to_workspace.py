@@ -1,15 +1,32 @@
+import argparse
 import json
 import os
-from openai import OpenAI
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from openai import DefaultHttpxClient, OpenAI
+
+from command_grammar import parse_command, stats_summary
+from instrumentation import httpx_event_hooks
+from name_resolver import get_resolver
+from plan_cache import get_plan_cache
 from workspace_actions import (
     create_group,
+    create_groups,
     add_member_to_group,
+    add_members_to_groups,
     create_filter_from_address,
+    create_filters_from_addresses,
 )
 
 # Uses the key from your OPENAI_API_KEY environment variable
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+client = OpenAI(
+    api_key=os.environ["OPENAI_API_KEY"],
+    http_client=DefaultHttpxClient(event_hooks=httpx_event_hooks()),  # see instrumentation.py
+)
 
 SYSTEM_PROMPT = """
 You convert natural-language admin requests into JSON commands
@@ -40,18 +57,61 @@ Supported actions:
      "label_name": string      // label to apply (create if missing)
    }
 
+If the user names a person or group without a full email address (e.g.
+"dave" or "the marketing group"), put the name as given in the email
+field; it is resolved against the directory before anything runs. Never
+guess an address.
+
+A request may need several actions. Return every action as a step, and
+list in "depends_on" the ids of steps that must finish first (e.g. adding
+members to a group depends on creating that group). Steps that don't depend
+on each other will run at the same time.
+
 Return format:
 {
-  "action": "<one of the above>",
-  "params": { ... }
+  "steps": [
+    {
+      "id": "s1",
+      "action": "<one of the above>",
+      "params": { ... },
+      "depends_on": []
+    }
+  ]
 }
 """
 
+MODEL = "gpt-4o-mini"
+
+# Values the model fills in from the prompt rather than the command.
+ROLES = ("MEMBER", "MANAGER", "OWNER")
+
+# Action -> (required params, optional params), matching the SYSTEM_PROMPT.
+ACTIONS = {
+    "create_group": (("email", "name"), ("description",)),
+    "add_member_to_group": (("group_email", "member_email"), ("role",)),
+    "create_filter_from_address": (("user_email", "from_address", "label_name"), ()),
+}
+
+# Mailboxes worked on at the same time when a plan touches several.
+MAX_WORKERS = 8
+
+# Commands planned at the same time in script mode.
+PLAN_WORKERS = 8
+
+# Address params that may hold a bare name, and the kind of entry to look for.
+ADDRESS_PARAMS = {
+    "add_member_to_group": {"group_email": "group", "member_email": None},
+    "create_filter_from_address": {"user_email": "user"},
+}
+
+# How stale the directory mirror may be when resolving names (seconds).
+RESOLVER_MAX_AGE = 3600
+
 
 def plan_from_text(text: str) -> dict:
-    """Ask ChatGPT to turn a command into {action, params} JSON."""
+    """Ask ChatGPT to turn a command into a {"steps": [...]} plan (one call)."""
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=MODEL,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": text},
@@ -63,34 +123,365 @@ def plan_from_text(text: str) -> dict:
     return json.loads(raw)
 
 
+def plan_cache():
+    # Keyed on the prompt and model so either changing invalidates old plans.
+    return get_plan_cache(f"{MODEL}\n{SYSTEM_PROMPT}", fixed_values=ROLES)
+
+
+def plan_command_with_source(text: str) -> Tuple[dict, str]:
+    """
+    Plan a command: locally if it is a known phrasing ("grammar"), from the
+    plan cache if it (or a command of the same shape) was planned before
+    ("cache"), otherwise by asking ChatGPT and caching the answer ("llm").
+    """
+    plan = parse_command(text)
+    if plan is not None:
+        return plan, "grammar"
+    plan = plan_cache().get(text)
+    if plan is not None:
+        return plan, "cache"
+    plan = plan_from_text(text)
+    try:
+        validate_plan(plan)
+    except ValueError:
+        # Not cached, or it would be replayed for every command of this
+        # shape; run_plan reports what is wrong with it.
+        return plan, "llm"
+    plan_cache().put(text, plan)
+    return plan, "llm"
+
+
+def plan_command(text: str) -> dict:
+    return plan_command_with_source(text)[0]
+
+
+def plan_steps(plan: dict) -> List[dict]:
+    """
+    The steps of a plan. A single {action, params} plan (the old format) is
+    treated as one step.
+    """
+    if "steps" not in plan:
+        return [{"id": "s1", "action": plan["action"], "params": dict(plan["params"]), "depends_on": []}]
+    steps = []
+    for i, step in enumerate(plan["steps"], start=1):
+        steps.append({
+            "id": str(step.get("id") or f"s{i}"),
+            "action": step["action"],
+            "params": dict(step.get("params", {})),
+            "depends_on": [str(d) for d in step.get("depends_on", [])],
+        })
+    return steps
+
+
+def validate_plan(plan: dict) -> List[dict]:
+    """
+    The steps of a plan that can run, or ValueError: no steps, an unknown
+    action, missing or unexpected params, a dependency on a missing step, or
+    a dependency cycle.
+    """
+    try:
+        steps = plan_steps(plan)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed plan: {e!r}") from e
+    if not steps:
+        raise ValueError("no actions planned")
+    for step in steps:
+        error = step_error(step)
+        if error is not None:
+            raise error
+    plan_waves(steps)
+    return steps
+
+
+def step_error(step: dict) -> Optional[ValueError]:
+    """Why step can't run (unknown action, missing or unexpected params), or None."""
+    if step["action"] not in ACTIONS:
+        return ValueError(f"Unknown action: {step['action']}")
+    required, optional = ACTIONS[step["action"]]
+    missing = [p for p in required if not step["params"].get(p)]
+    if missing:
+        return ValueError(f"{step['action']} needs {', '.join(missing)}")
+    unexpected = sorted(set(step["params"]) - set(required) - set(optional))
+    if unexpected:
+        return ValueError(f"{step['action']} got unexpected params: {', '.join(unexpected)}")
+    return None
+
+
+def plan_waves(steps: List[dict]) -> List[List[dict]]:
+    """Group steps into waves; every step's dependencies are in earlier waves."""
+    ids = {step["id"] for step in steps}
+    for step in steps:
+        unknown = set(step["depends_on"]) - ids
+        if unknown:
+            raise ValueError(f"Step {step['id']} depends on unknown step(s): {sorted(unknown)}")
+
+    waves, placed, remaining = [], set(), list(steps)
+    while remaining:
+        wave = [s for s in remaining if set(s["depends_on"]) <= placed]
+        if not wave:
+            raise ValueError(f"Plan has a dependency cycle among: {[s['id'] for s in remaining]}")
+        waves.append(wave)
+        placed.update(s["id"] for s in wave)
+        remaining = [s for s in remaining if s["id"] not in placed]
+    return waves
+
+
+def _run_directory_steps(steps: List[dict]) -> Dict[str, dict]:
+    """Directory steps of one wave, batched by action (one client, no threads)."""
+    outcomes = {}
+    by_action = defaultdict(list)
+    for step in steps:
+        by_action[step["action"]].append(step)
+
+    for action, run_batch in (("create_group", create_groups), ("add_member_to_group", add_members_to_groups)):
+        batch = by_action.pop(action, [])
+        if len(batch) == 1:
+            outcomes.update(_run_one(batch[0]))
+        elif batch:
+            outcomes.update(_run_batch(batch, run_batch))
+    return outcomes
+
+
+def _run_batch(steps: List[dict], run_batch) -> Dict[str, dict]:
+    """One batch call for steps (already checked by step_error); a failed call fails each step."""
+    try:
+        results = run_batch([s["params"] for s in steps])
+    except Exception as e:
+        return {s["id"]: {"error": e} for s in steps}
+    return {
+        step["id"]: {"result": r.response} if r.ok else {"error": r.error}
+        for step, r in zip(steps, results)
+    }
+
+
+def _run_one(step: dict) -> Dict[str, dict]:
+    action, params = step["action"], step["params"]
+    try:
+        if action == "create_group":
+            result = create_group(**params)
+        elif action == "add_member_to_group":
+            result = add_member_to_group(**params)
+        elif action == "create_filter_from_address":
+            result = create_filter_from_address(**params)
+        else:
+            raise ValueError(f"Unknown action: {action}")
+    except Exception as e:
+        return {step["id"]: {"error": e}}
+    return {step["id"]: {"result": result}}
+
+
+def _run_mailbox_steps(steps: List[dict]) -> Dict[str, dict]:
+    """Filter steps for one mailbox: one list call each for labels and filters, then batches."""
+    if len(steps) == 1:
+        return _run_one(steps[0])
+    try:
+        rules = [(s["params"]["from_address"], s["params"]["label_name"]) for s in steps]
+        results = create_filters_from_addresses(steps[0]["params"]["user_email"], rules)
+    except Exception as e:
+        return {s["id"]: {"error": e} for s in steps}
+    return {
+        step["id"]: {"result": r.response} if r.ok else {"error": r.error}
+        for step, r in zip(steps, results)
+    }
+
+
+def resolve_names(steps: List[dict]) -> Dict[str, dict]:
+    """
+    Replace bare names in address params ("dave", "marketing") with the
+    directory address they refer to, in place. Returns step id -> {"error"}
+    for steps with a name that matches nothing or is ambiguous.
+    """
+    errors = {}
+    resolver = None
+    for step in steps:
+        for param, kind in ADDRESS_PARAMS.get(step["action"], {}).items():
+            value = step["params"].get(param)
+            if not value or "@" in value:
+                continue
+            resolver = resolver or get_resolver(RESOLVER_MAX_AGE)
+            try:
+                step["params"][param] = resolver.resolve(value, kind)
+            except LookupError as e:
+                errors[step["id"]] = {"error": e}
+    return errors
+
+
+def run_plan(plan: dict, max_workers: int = MAX_WORKERS) -> Dict[str, dict]:
+    """
+    Execute every step of a plan, wave by wave. Within a wave, directory
+    steps are batched per action and Gmail steps run in parallel per mailbox.
+    Bare names are resolved to addresses first (see resolve_names); a step
+    whose name can't be resolved, or whose dependency failed, is not run.
+    Returns step id ->
+    {"action", "params"} plus "result" or "error".
+    """
+    steps = plan_steps(plan)
+    for step in steps:
+        if step["action"] not in ACTIONS:
+            raise ValueError(f"Unknown action: {step['action']}")
+
+    outcomes = resolve_names(steps)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for wave in plan_waves(steps):
+            runnable = []
+            for step in wave:
+                if step["id"] in outcomes:
+                    continue
+                failed = [d for d in step["depends_on"] if "result" not in outcomes[d]]
+                if failed:
+                    outcomes[step["id"]] = {"error": RuntimeError(f"skipped: {', '.join(failed)} failed")}
+                elif step_error(step) is not None:
+                    outcomes[step["id"]] = {"error": step_error(step)}
+                else:
+                    runnable.append(step)
+
+            directory = [s for s in runnable if s["action"] != "create_filter_from_address"]
+            by_mailbox = defaultdict(list)
+            for s in runnable:
+                if s["action"] == "create_filter_from_address":
+                    by_mailbox[s["params"]["user_email"].lower()].append(s)
+
+            futures = [pool.submit(_run_mailbox_steps, group) for group in by_mailbox.values()]
+            if directory:
+                futures.append(pool.submit(_run_directory_steps, directory))
+            for future in futures:
+                outcomes.update(future.result())
+
+    return {
+        step["id"]: {"action": step["action"], "params": step["params"], **outcomes[step["id"]]}
+        for step in steps
+    }
+
+
 def dispatch(plan: dict):
-    """Call the right Workspace function based on the plan."""
-    action = plan["action"]
-    params = plan["params"]
-
-    if action == "create_group":
-        return create_group(**params)
-    elif action == "add_member_to_group":
-        return add_member_to_group(**params)
-    elif action == "create_filter_from_address":
-        return create_filter_from_address(**params)
+    """
+    Call the right Workspace function(s) based on the plan. A single-action
+    plan returns the raw API response (and raises on error), as before; a
+    multi-step plan returns run_plan's per-step outcomes.
+    """
+    outcomes = run_plan(plan)
+    if "steps" not in plan:
+        outcome = outcomes["s1"]
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+    return outcomes
+
+
+def _outcome_json(outcome: dict) -> dict:
+    entry = {"action": outcome["action"], "params": outcome["params"], "ok": "error" not in outcome}
+    if "error" in outcome:
+        entry["error"] = str(outcome["error"])
     else:
-        raise ValueError(f"Unknown action: {action}")
+        entry["result"] = outcome["result"]
+    return entry
+
+
+def _plan_timed(text: str):
+    started = time.monotonic()
+    try:
+        plan, source = plan_command_with_source(text)
+    except Exception as e:
+        return None, "error", e, time.monotonic() - started
+    return plan, source, None, time.monotonic() - started
+
+
+def run_script(lines: Iterable[str], workers: int = PLAN_WORKERS) -> Iterator[dict]:
+    """
+    Plan and run many commands (one per line; blank lines and # comments are
+    skipped). Up to `workers` commands are planned at once while earlier
+    ones execute; execution itself stays in input order, so a command may
+    rely on the ones before it. Yields one result per command, in order.
+    """
+    commands = (
+        (n, line.strip()) for n, line in enumerate(lines, start=1)
+        if line.strip() and not line.lstrip().startswith("#")
+    )
+
+    def run(n, text, planned):
+        plan, source, error, plan_seconds = planned
+        result = {"line": n, "command": text, "planned_by": source, "plan_seconds": round(plan_seconds, 3)}
+        if error is not None:
+            return {**result, "ok": False, "error": f"planning failed: {error}"}
+        started = time.monotonic()
+        try:
+            outcomes = run_plan(plan)
+        except Exception as e:
+            return {**result, "plan": plan, "ok": False, "error": str(e)}
+        steps = {step_id: _outcome_json(o) for step_id, o in outcomes.items()}
+        if not steps:
+            return {**result, "plan": plan, "ok": False, "error": "no actions planned"}
+        return {
+            **result,
+            "plan": plan,
+            "ok": all(step["ok"] for step in steps.values()),
+            "run_seconds": round(time.monotonic() - started, 3),
+            "steps": steps,
+        }
+
+    # Plans are requested ahead of execution, at most 2 * workers at a time.
+    window = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for n, text in commands:
+            window.append((n, text, pool.submit(_plan_timed, text)))
+            if len(window) >= 2 * workers:
+                n, text, future = window.pop(0)
+                yield run(n, text, future.result())
+        for n, text, future in window:
+            yield run(n, text, future.result())
+
+
+def script_main(path: str, out_path: str = "-", workers: int = PLAN_WORKERS):
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    out = sys.stdout if out_path == "-" else open(out_path, "w", encoding="utf-8")
+    started = time.monotonic()
+    counts = defaultdict(int)
+    try:
+        for result in run_script(source, workers):
+            counts["ok" if result["ok"] else "failed"] += 1
+            out.write(json.dumps(result, default=str) + "\n")
+            out.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.monotonic() - started
+    total = counts["ok"] + counts["failed"]
+    print(
+        f"{total} commands ({counts['failed']} failed) in {elapsed:.1f}s"
+        f" ({total / elapsed if elapsed else 0:.1f}/s); {stats_summary()}; {plan_cache().stats_summary()}",
+        file=sys.stderr,
+    )
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Run Google Workspace admin tasks described in plain English.")
+    parser.add_argument("--script", metavar="FILE",
+                        help="run every command in FILE (one per line, '-' for stdin) and write JSONL results")
+    parser.add_argument("--out", default="-", help="where script results go (default: stdout)")
+    parser.add_argument("--workers", type=int, default=PLAN_WORKERS, help="commands planned at the same time")
+    args = parser.parse_args()
+
+    if args.script:
+        script_main(args.script, args.out, args.workers)
+        return
+
     print("Describe what you want to do in Google Workspace.")
     command_text = input("> ")
 
-    print("\nAsking ChatGPT to plan that action...\n")
-    plan = plan_from_text(command_text)
-    print("Model plan:", plan, "\n")
+    plan, source = plan_command_with_source(command_text)
+    label = {"grammar": "Parsed locally", "cache": "Cached plan", "llm": "Model plan"}[source]
+    print(f"\n{label}:", plan, "\n")
 
     print("Calling Google Workspace APIs...")
-    result = dispatch(plan)
+    outcomes = run_plan(plan)
 
-    print("\nDone. Raw API response:")
-    print(result)
+    print("\nDone. Raw API responses:")
+    for step_id, outcome in outcomes.items():
+        status = "ERROR" if "error" in outcome else "OK"
+        print(f"[{status}] {step_id} {outcome['action']}: {outcome.get('result', outcome.get('error'))}")
+    print(f"\n{stats_summary()}; {plan_cache().stats_summary()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+# command_grammar.py
+"""
+Local fast path for chat_to_workspace.py: fixed phrasings of the supported
+actions are parsed with regexes into the same {"steps": [...]} plans the LLM
+returns, so only ambiguous commands pay for an OpenAI round trip.
+
+    add alex@x.com to marketing@x.com as manager
+    add alex@x.com, sam@x.com and kim@x.com to marketing@x.com
+    create group marketing@x.com called "Marketing Team"
+    create group marketing@x.com and add alex@x.com, sam@x.com
+    label mail from billing@vendor.com as Billing for dave@x.com
+
+A command either matches one pattern completely or is left to the LLM.
+`stats` counts hits per pattern and misses; `recent_misses` keeps the last
+few unmatched commands, which is where new patterns come from.
+"""
+import re
+import threading
+from collections import Counter, deque
+from typing import Callable, List, Optional, Tuple
+
+EMAIL = r"[\w.%+'-]+@[\w-]+(?:\.[\w-]+)+"
+_EMAIL_LIST = rf"{EMAIL}(?:\s*(?:,\s*(?:and\s+)?|\s+and\s+)\s*{EMAIL})*"
+_QUOTED = r"[\"'“”‘’]"
+
+ROLES = {"member": "MEMBER", "manager": "MANAGER", "owner": "OWNER"}
+
+stats: Counter = Counter()
+recent_misses: deque = deque(maxlen=50)
+_stats_lock = threading.Lock()  # commands are parsed from run_script's planning threads
+
+
+def _emails(text: str) -> List[str]:
+    return re.findall(EMAIL, text)
+
+
+def _role(word: Optional[str]) -> str:
+    return ROLES[(word or "member").lower().rstrip("s")]
+
+
+def _default_name(group_email: str) -> str:
+    local = group_email.split("@")[0]
+    return " ".join(part.capitalize() for part in re.split(r"[._-]+", local) if part)
+
+
+def _create_step(step_id: str, email: str, name: Optional[str], description: Optional[str]) -> dict:
+    return {
+        "id": step_id,
+        "action": "create_group",
+        "params": {
+            "email": email,
+            "name": name or _default_name(email),
+            "description": description or "",
+        },
+        "depends_on": [],
+    }
+
+
+def _member_steps(group: str, members: List[str], role: str, depends_on: List[str]) -> List[dict]:
+    return [
+        {
+            "id": f"m{i}",
+            "action": "add_member_to_group",
+            "params": {"group_email": group, "member_email": member, "role": role},
+            "depends_on": list(depends_on),
+        }
+        for i, member in enumerate(members, start=1)
+    ]
+
+
+# ---------- PATTERNS ---------- #
+
+_ADD = re.compile(
+    rf"(?:please\s+)?add\s+(?P<members>{_EMAIL_LIST})\s+(?:to|into)\s+(?:the\s+)?(?:group\s+)?"
+    rf"(?P<group>{EMAIL})(?:\s+as\s+(?:an?\s+)?(?P<role>members?|managers?|owners?))?",
+    re.I,
+)
+
+_CREATE = re.compile(
+    rf"(?:please\s+)?(?:create|make|add)\s+(?:a\s+)?(?:new\s+)?group\s+(?:called\s+|named\s+)?(?P<group>{EMAIL})"
+    rf"(?:\s+(?:called|named)\s+{_QUOTED}(?P<name>[^\"'“”‘’]+){_QUOTED})?"
+    rf"(?:\s+(?:with\s+)?description\s+{_QUOTED}(?P<description>[^\"'“”‘’]*){_QUOTED})?"
+    rf"(?:\s*,?\s+and\s+add\s+(?P<members>{_EMAIL_LIST})(?:\s+(?:to\s+it|as\s+(?:an?\s+)?(?P<role>members?|managers?|owners?)))?)?",
+    re.I,
+)
+
+_FILTER = re.compile(
+    rf"(?:please\s+)?(?:label|tag|file)\s+(?:all\s+)?(?:mail|emails?|messages?)\s+from\s+(?P<sender>{EMAIL})\s+"
+    rf"(?:as|with|under|into)\s+(?:the\s+)?(?:label\s+)?(?:{_QUOTED}(?P<qlabel>[^\"'“”‘’]+){_QUOTED}|(?P<label>[\w/ -]+?))\s+"
+    rf"(?:for|in)\s+(?P<user>{EMAIL})(?:'s?\s+(?:mailbox|inbox))?",
+    re.I,
+)
+
+
+def _parse_add(m: re.Match) -> List[dict]:
+    return _member_steps(m["group"], _emails(m["members"]), _role(m["role"]), [])
+
+
+def _parse_create(m: re.Match) -> List[dict]:
+    steps = [_create_step("g1", m["group"], m["name"], m["description"])]
+    if m["members"]:
+        steps += _member_steps(m["group"], _emails(m["members"]), _role(m["role"]), ["g1"])
+    return steps
+
+
+def _parse_filter(m: re.Match) -> List[dict]:
+    return [{
+        "id": "f1",
+        "action": "create_filter_from_address",
+        "params": {
+            "user_email": m["user"],
+            "from_address": m["sender"],
+            "label_name": (m["qlabel"] or m["label"]).strip(),
+        },
+        "depends_on": [],
+    }]
+
+
+PATTERNS: List[Tuple[str, re.Pattern, Callable[[re.Match], List[dict]]]] = [
+    ("create_group", _CREATE, _parse_create),
+    ("add_member_to_group", _ADD, _parse_add),
+    ("create_filter_from_address", _FILTER, _parse_filter),
+]
+
+
+def parse_command(text: str) -> Optional[dict]:
+    """A {"steps": [...]} plan if text is an exact known phrasing, else None."""
+    command = text.strip().rstrip(".!")
+    for name, pattern, build in PATTERNS:
+        m = pattern.fullmatch(command)
+        if m:
+            with _stats_lock:
+                stats[name] += 1
+                stats["hits"] += 1
+            return {"steps": build(m)}
+    with _stats_lock:
+        stats["misses"] += 1
+        recent_misses.append(text.strip())
+    return None
+
+
+def stats_summary() -> str:
+    with _stats_lock:
+        counts = Counter(stats)
+    total = counts["hits"] + counts["misses"]
+    if not total:
+        return "grammar: no commands parsed"
+    per_pattern = ", ".join(f"{name}={counts[name]}" for name, _, _ in PATTERNS if counts[name])
+    return (
+        f"grammar: {counts['hits']}/{total} hits ({counts['hits'] / total:.0%})"
+        + (f" [{per_pattern}]" if per_pattern else "")
+        + f", {counts['misses']} sent to the LLM"
+    )
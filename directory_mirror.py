@@ -0,0 +1,377 @@
+# directory_mirror.py
+"""
+Local SQLite mirror of the Workspace directory (users, groups, memberships
+and org units) for read-heavy automations.
+
+The mirror is filled with the same paginated list calls as
+workspace_actions and refreshed incrementally: each page's ETag is kept and
+sent back as If-None-Match, so pages that haven't changed come back as 304
+and their rows are left alone. Readers pass a freshness bound (max_age, in
+seconds); only collections older than that are refreshed before reading.
+
+    mirror = get_mirror()
+    mirror.ensure_fresh(max_age=3600)
+    for user in mirror.users(domain="tntdump.com"):
+        ...
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from googleapiclient.errors import HttpError
+
+from google_clients import ADMIN_EMAIL, ORG_UNIT_SCOPES, get_directory_service, get_service
+from rate_limit import execute
+
+MIRROR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_cache", "directory.sqlite3")
+
+COLLECTIONS = ("org_units", "users", "groups", "members")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    org_unit_path TEXT,
+    suspended INTEGER NOT NULL DEFAULT 0,
+    page INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_domain ON users (domain);
+CREATE INDEX IF NOT EXISTS users_org_unit ON users (org_unit_path);
+
+CREATE TABLE IF NOT EXISTS groups (
+    email TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS groups_domain ON groups (domain);
+
+CREATE TABLE IF NOT EXISTS members (
+    group_email TEXT NOT NULL,
+    member_email TEXT NOT NULL,
+    role TEXT,
+    type TEXT,
+    page INTEGER NOT NULL,
+    PRIMARY KEY (group_email, member_email)
+);
+CREATE INDEX IF NOT EXISTS members_member ON members (member_email);
+
+CREATE TABLE IF NOT EXISTS org_units (
+    path TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+-- One row per fetched page: the token used to fetch it, its ETag, and the
+-- token of the page after it. scope is the group email for members.
+CREATE TABLE IF NOT EXISTS pages (
+    collection TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    page_token TEXT,
+    etag TEXT,
+    next_token TEXT,
+    PRIMARY KEY (collection, scope, page)
+);
+
+CREATE TABLE IF NOT EXISTS refreshes (
+    collection TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+);
+"""
+
+
+def _domain(email: str) -> str:
+    return email.split("@")[-1].lower()
+
+
+class DirectoryMirror:
+    def __init__(self, path: str = MIRROR_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.RLock()
+
+    # ---------- FRESHNESS ----------
+
+    def age(self, collection: str) -> Optional[float]:
+        """Seconds since collection was last refreshed (None if never)."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT refreshed_at FROM refreshes WHERE collection = ?", (collection,)
+            ).fetchone()
+        return None if row is None else time.time() - row["refreshed_at"]
+
+    def ensure_fresh(self, max_age: float, collections: Iterable[str] = COLLECTIONS):
+        """Refresh any of collections last refreshed more than max_age seconds ago."""
+        ages = {c: self.age(c) for c in collections}
+        stale = [c for c, age in ages.items() if age is None or age > max_age]
+        if stale:
+            self.refresh(stale)
+        return self
+
+    def refresh(self, collections: Iterable[str] = COLLECTIONS):
+        collections = list(collections)
+        # Members are listed per group, so groups have to be current first.
+        if "members" in collections and "groups" not in collections and self.age("groups") is None:
+            collections.insert(0, "groups")
+        for collection in COLLECTIONS:
+            if collection in collections:
+                started = time.monotonic()
+                changed = getattr(self, f"_refresh_{collection}")()
+                with self.lock, self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO refreshes (collection, refreshed_at) VALUES (?, ?)",
+                        (collection, time.time()),
+                    )
+                print(f"[MIRROR] {collection}: {changed} page(s) changed "
+                      f"({time.monotonic() - started:.1f}s)")
+
+    # ---------- REFRESH ----------
+
+    def _refresh_pages(self, collection: str, scope: str, list_page, store_page) -> int:
+        """
+        Walk every page of one list call. list_page(token) returns the
+        request for that page; store_page(page, items) replaces that page's rows.
+        Returns how many pages actually changed.
+        """
+        with self.lock:
+            known = {
+                row["page"]: row
+                for row in self.conn.execute(
+                    "SELECT * FROM pages WHERE collection = ? AND scope = ?", (collection, scope)
+                )
+            }
+
+        changed = 0
+        page, token = 0, None
+        while True:
+            request = list_page(token)
+            cached = known.get(page)
+            if cached is not None and cached["etag"] and cached["page_token"] == token:
+                request.headers["If-None-Match"] = cached["etag"]
+            try:
+                response = execute(request)
+            except HttpError as e:
+                if getattr(e.resp, "status", None) != 304:
+                    raise
+                next_token = cached["next_token"]  # unchanged page
+            else:
+                next_token = response.get("nextPageToken")
+                with self.lock, self.conn:
+                    store_page(page, response)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                        (collection, scope, page, token, response.get("etag"), next_token),
+                    )
+                changed += 1
+            if not next_token:
+                break
+            page, token = page + 1, next_token
+
+        # The collection got shorter: drop what was past the last page.
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM pages WHERE collection = ? AND scope = ? AND page > ?",
+                (collection, scope, page),
+            )
+            self._drop_pages_after(collection, scope, page)
+        return changed
+
+    def _drop_pages_after(self, collection: str, scope: str, page: int):
+        if collection == "members":
+            self.conn.execute("DELETE FROM members WHERE group_email = ? AND page > ?", (scope, page))
+        elif collection in ("users", "groups"):
+            self.conn.execute(f"DELETE FROM {collection} WHERE page > ?", (page,))
+
+    def _refresh_users(self) -> int:
+        users = get_directory_service().users()
+
+        def list_page(token):
+            return users.list(customer="my_customer", orderBy="email", maxResults=500, pageToken=token)
+
+        def store_page(page, response):
+            self.conn.execute("DELETE FROM users WHERE page = ?", (page,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (u["primaryEmail"].lower(), _domain(u["primaryEmail"]), u.get("orgUnitPath"),
+                     int(bool(u.get("suspended"))), page, json.dumps(u))
+                    for u in response.get("users", [])
+                ],
+            )
+
+        return self._refresh_pages("users", "", list_page, store_page)
+
+    def _refresh_groups(self) -> int:
+        groups = get_directory_service().groups()
+
+        def list_page(token):
+            return groups.list(customer="my_customer", maxResults=200, pageToken=token)
+
+        def store_page(page, response):
+            self.conn.execute("DELETE FROM groups WHERE page = ?", (page,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?)",
+                [
+                    (g["email"].lower(), _domain(g["email"]), page, json.dumps(g))
+                    for g in response.get("groups", [])
+                ],
+            )
+
+        changed = self._refresh_pages("groups", "", list_page, store_page)
+        with self.lock, self.conn:
+            # Forget memberships (and page ETags) of groups that no longer exist.
+            self.conn.execute("DELETE FROM members WHERE group_email NOT IN (SELECT email FROM groups)")
+            self.conn.execute(
+                "DELETE FROM pages WHERE collection = 'members' AND scope NOT IN (SELECT email FROM groups)"
+            )
+        return changed
+
+    def _refresh_members(self) -> int:
+        members = get_directory_service().members()
+        changed = 0
+        for group_email in self.group_emails():
+            def list_page(token, group_email=group_email):
+                return members.list(groupKey=group_email, maxResults=200, pageToken=token)
+
+            def store_page(page, response, group_email=group_email):
+                self.conn.execute(
+                    "DELETE FROM members WHERE group_email = ? AND page = ?", (group_email, page)
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (group_email, m["email"].lower(), m.get("role"), m.get("type"), page)
+                        for m in response.get("members", [])
+                        if "email" in m
+                    ],
+                )
+
+            changed += self._refresh_pages("members", group_email, list_page, store_page)
+        return changed
+
+    def _refresh_org_units(self) -> int:
+        # Org units come back in a single response, with no paging or ETag.
+        service = get_service("admin", "directory_v1", ORG_UNIT_SCOPES, ADMIN_EMAIL)
+        result = execute(service.orgunits().list(customerId="my_customer", type="all"))
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM org_units")
+            self.conn.executemany(
+                "INSERT INTO org_units VALUES (?, ?)",
+                [(ou["orgUnitPath"], json.dumps(ou)) for ou in result.get("organizationUnits", [])],
+            )
+        return 1
+
+    # ---------- READS ----------
+
+    def _rows(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def users(self, domain: Optional[str] = None, org_unit_path: Optional[str] = None,
+              include_suspended: bool = False) -> Iterator[dict]:
+        """Users ordered by email; org_unit_path includes child org units."""
+        sql, params = "SELECT data FROM users WHERE 1=1", []
+        if domain:
+            sql += " AND domain = ?"
+            params.append(domain.lower())
+        if org_unit_path:
+            sql += " AND (org_unit_path = ? OR org_unit_path LIKE ?)"
+            params += [org_unit_path, org_unit_path.rstrip("/") + "/%"]
+        if not include_suspended:
+            sql += " AND suspended = 0"
+        for row in self._rows(sql + " ORDER BY email", params):
+            yield json.loads(row["data"])
+
+    def user(self, email: str) -> Optional[dict]:
+        rows = self._rows("SELECT data FROM users WHERE email = ?", (email.lower(),))
+        return json.loads(rows[0]["data"]) if rows else None
+
+    def groups(self, domain: Optional[str] = None) -> Iterator[dict]:
+        sql, params = "SELECT data FROM groups", ()
+        if domain:
+            sql, params = sql + " WHERE domain = ?", (domain.lower(),)
+        for row in self._rows(sql + " ORDER BY email", params):
+            yield json.loads(row["data"])
+
+    def group_emails(self) -> List[str]:
+        return [row["email"] for row in self._rows("SELECT email FROM groups ORDER BY email")]
+
+    def group_members(self, group_email: str) -> List[dict]:
+        """Direct members of a group: dicts with email, role and type."""
+        return [
+            {"email": row["member_email"], "role": row["role"], "type": row["type"]}
+            for row in self._rows(
+                "SELECT member_email, role, type FROM members WHERE group_email = ? ORDER BY member_email",
+                (group_email.lower(),),
+            )
+        ]
+
+    def expanded_members(self, group_email: str) -> Set[str]:
+        """User emails in a group with nested groups expanded (like hasMember)."""
+        users, seen, todo = set(), set(), [group_email.lower()]
+        while todo:
+            group = todo.pop()
+            if group in seen:
+                continue
+            seen.add(group)
+            for m in self.group_members(group):
+                if m["type"] == "GROUP":
+                    todo.append(m["email"])
+                else:
+                    users.add(m["email"])
+        return users
+
+    def groups_of(self, member_email: str) -> List[str]:
+        """Groups that member_email belongs to directly."""
+        return [
+            row["group_email"]
+            for row in self._rows(
+                "SELECT group_email FROM members WHERE member_email = ? ORDER BY group_email",
+                (member_email.lower(),),
+            )
+        ]
+
+    def org_units(self) -> Iterator[dict]:
+        for row in self._rows("SELECT data FROM org_units ORDER BY path"):
+            yield json.loads(row["data"])
+
+
+_mirrors: Dict[str, DirectoryMirror] = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_mirror(path: Optional[str] = None) -> DirectoryMirror:
+    """Process-wide mirror for path (default MIRROR_PATH; one SQLite connection per file)."""
+    path = path or MIRROR_PATH
+    with _mirrors_lock:
+        if path not in _mirrors:
+            _mirrors[path] = DirectoryMirror(path)
+        return _mirrors[path]
+
+
+def reset_mirrors():
+    """Close and forget every open mirror (e.g. after switching tenants)."""
+    with _mirrors_lock:
+        for mirror in _mirrors.values():
+            mirror.conn.close()
+        _mirrors.clear()
+
+
+if __name__ == "__main__":
+    import sys
+
+    mirror = get_mirror()
+    if "--if-older-than" in sys.argv:
+        mirror.ensure_fresh(float(sys.argv[sys.argv.index("--if-older-than") + 1]))
+    else:
+        mirror.refresh()
+    for collection in COLLECTIONS:
+        print(f"{collection}: refreshed {mirror.age(collection):.0f}s ago")
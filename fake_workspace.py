@@ -0,0 +1,800 @@
+# fake_workspace.py
+"""
+In-process stand-in for the Admin SDK Directory API, the Gmail settings API
+and OpenAI chat completions, for load tests and offline runs.
+
+FakeWorkspace keeps a tenant in memory (users, groups, members, org units,
+and per-mailbox labels, filters and send-as), answers the same HTTP
+requests googleapiclient sends (including batch requests, paging, ETags /
+If-None-Match and the real error shapes), and can add latency and inject
+429 / 5xx responses. Installing it routes every client built by
+google_clients through it, so the toolkit runs unchanged:
+
+    from fake_workspace import FakeOpenAI, FakeWorkspace
+
+    with FakeWorkspace.seeded(users=1000, latency=0.05, rate_limit_rate=0.01) as ws:
+        iter_users(...)                 # served by ws
+        print(ws.stats)                 # round trips, calls, errors injected, ...
+
+    FakeOpenAI(latency=0.4).install()   # chat_to_workspace.client now plans locally
+
+Run `python fake_workspace.py` for a quick smoke test.
+"""
+import asyncio
+import email.parser
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+import httpx
+from google.auth import _helpers
+from google.auth.credentials import Credentials
+
+from google_clients import ADMIN_EMAIL, set_transport
+
+SYSTEM_LABELS = ["INBOX", "SENT", "DRAFT", "SPAM", "TRASH", "UNREAD", "STARRED", "IMPORTANT"]
+
+GIVEN_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Chris", "Pat", "Kim", "Lee", "Dana", "Robin",
+               "Casey", "Jamie", "Morgan", "Riley", "Avery", "Quinn", "Drew", "Cameron", "Dave", "Maria"]
+FAMILY_NAMES = ["Smith", "Johnson", "Lee", "Brown", "Garcia", "Miller", "Davis", "Martinez", "Call",
+                "Nguyen", "Walker", "Young", "Allen", "King", "Wright", "Scott", "Hill", "Green"]
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, reason: str, message: str, headers: Optional[dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+    def body(self) -> dict:
+        status_names = {400: "INVALID_ARGUMENT", 403: "PERMISSION_DENIED", 404: "NOT_FOUND",
+                        409: "ALREADY_EXISTS", 429: "RESOURCE_EXHAUSTED", 503: "UNAVAILABLE"}
+        return {"error": {
+            "code": self.status,
+            "message": str(self),
+            "errors": [{"reason": self.reason, "message": str(self), "domain": "global"}],
+            "status": status_names.get(self.status, "UNKNOWN"),
+        }}
+
+
+# ---------- TRANSPORT ---------- #
+
+class FakeCredentials(Credentials):
+    """Delegated credentials whose token names the impersonated user."""
+
+    def __init__(self, workspace: "FakeWorkspace", subject: str, scopes):
+        super().__init__()
+        self.workspace = workspace
+        self._subject = subject
+        self._scopes = list(scopes)
+
+    def refresh(self, request):
+        self.workspace._count("token_refreshes")
+        self.token = f"fake.{self._subject}"
+        self.expiry = _helpers.utcnow() + timedelta(seconds=self.workspace.token_lifetime)
+
+
+class FakeHttp:
+    """httplib2.Http look-alike that answers from a FakeWorkspace (thread-safe)."""
+
+    thread_safe = True
+
+    def __init__(self, workspace: "FakeWorkspace", credentials: FakeCredentials):
+        self.workspace = workspace
+        self.credentials = credentials
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if not self.credentials.valid:
+            self.credentials.refresh(None)
+        return self.workspace.handle(uri, method, body, headers or {}, self.credentials._subject)
+
+    def close(self):
+        pass
+
+
+# ---------- WORKSPACE ---------- #
+
+class Mailbox:
+    def __init__(self, email_address: str, display_name: str):
+        self.labels: Dict[str, dict] = {
+            name: {"id": name, "name": name, "type": "system"} for name in SYSTEM_LABELS
+        }
+        self.filters: Dict[str, dict] = {}
+        self.send_as: Dict[str, dict] = {
+            email_address: {
+                "sendAsEmail": email_address, "displayName": display_name, "replyToAddress": "",
+                "signature": "", "isPrimary": True, "isDefault": True, "treatAsAlias": False,
+                "verificationStatus": "accepted",
+            }
+        }
+        self.ids = itertools.count(1)
+
+
+def _reset_tenant_state():
+    """Drop process-wide caches of tenant data: mailbox indexes, the name resolver, open mirrors."""
+    import directory_mirror
+    import name_resolver
+    import workspace_actions
+
+    workspace_actions.clear_mailbox_indexes()
+    name_resolver.reset_resolver()
+    directory_mirror.reset_mirrors()
+
+
+class FakeWorkspace:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        call_latency: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        retry_after: Optional[int] = None,
+        token_lifetime: float = 3600,
+        seed: Optional[int] = None,
+    ):
+        """
+        latency + uniform(0, jitter) seconds are added to every HTTP round
+        trip, and call_latency to every call (so a batch of 50 costs more
+        than one call). rate_limit_rate / server_error_rate are the chances
+        that a call gets a 429 rateLimitExceeded / 503 backendError, sent
+        with Retry-After: retry_after when that is set.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.call_latency = call_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.random = random.Random(seed)
+
+        self.users: Dict[str, dict] = {}
+        self.aliases: Dict[str, str] = {}           # alias -> primary email
+        self.groups: Dict[str, dict] = {}
+        self.members: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        self.org_units: Dict[str, dict] = {}
+        self.mailboxes: Dict[str, Mailbox] = {}
+        self._sorted: Dict[str, List[str]] = {}     # cached sorted keys per collection
+        self.ids = itertools.count(100000000)
+        self._route_table = None
+        self._real_mirror_path: Optional[str] = None
+
+        self.stats: Counter = Counter()
+        self.lock = threading.RLock()
+
+    # ---------- transport protocol (google_clients.set_transport) ----------
+
+    def credentials(self, subject: str, scopes) -> FakeCredentials:
+        self._count("credentials")
+        return FakeCredentials(self, subject, scopes)
+
+    def http(self, credentials) -> FakeHttp:
+        return FakeHttp(self, credentials)
+
+    def install(self) -> "FakeWorkspace":
+        """
+        Route every Google client to this tenant. Its directory mirror lives
+        in memory, and state cached about the previous tenant is dropped.
+        """
+        import directory_mirror
+
+        if self._real_mirror_path is None:
+            self._real_mirror_path = directory_mirror.MIRROR_PATH
+        directory_mirror.MIRROR_PATH = ":memory:"
+        set_transport(self)
+        _reset_tenant_state()
+        return self
+
+    def uninstall(self):
+        """Back to the real tenant (and its on-disk mirror), with nothing cached from this one."""
+        import directory_mirror
+
+        if self._real_mirror_path is not None:
+            directory_mirror.MIRROR_PATH, self._real_mirror_path = self._real_mirror_path, None
+        set_transport(None)
+        _reset_tenant_state()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def _count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+
+    # ---------- seeding ----------
+
+    def _next_id(self) -> str:
+        with self.lock:
+            return str(next(self.ids))
+
+    def add_org_unit(self, path: str) -> dict:
+        with self.lock:
+            if path not in self.org_units:
+                parent = path.rsplit("/", 1)[0] or "/"
+                if path != "/" and parent not in self.org_units:
+                    self.add_org_unit(parent)
+                self.org_units[path] = {
+                    "kind": "admin#directory#orgUnit", "name": path.rsplit("/", 1)[-1] or "/",
+                    "orgUnitPath": path, "orgUnitId": f"id:{self._next_id()}", "parentOrgUnitPath": parent,
+                }
+            return self.org_units[path]
+
+    def add_user(self, primary_email: str, given_name: str = "Test", family_name: str = "User",
+                 org_unit: str = "/", aliases: Iterable[str] = (), suspended: bool = False) -> dict:
+        body = {
+            "primaryEmail": primary_email, "orgUnitPath": org_unit, "suspended": suspended,
+            "name": {"givenName": given_name, "familyName": family_name}, "aliases": list(aliases),
+        }
+        return self._insert_user(body)
+
+    def add_group(self, group_email: str, name: str = "", members: Iterable[str] = (), role: str = "MEMBER") -> dict:
+        group = self._insert_group({"email": group_email, "name": name or group_email.split("@")[0]})
+        for m in members:
+            self._insert_member(group_email, {"email": m, "role": role})
+        return group
+
+    def add_member(self, group_email: str, member_email: str, role: str = "MEMBER") -> dict:
+        return self._insert_member(group_email, {"email": member_email, "role": role})
+
+    @classmethod
+    def seeded(
+        cls,
+        users: int = 100,
+        groups: int = 10,
+        members_per_group: int = 20,
+        domains: Iterable[str] = ("tntdump.com", "icondumpsters.com", "utahwatergardens.com"),
+        group_emails: Iterable[str] = (),
+        admin: str = ADMIN_EMAIL,
+        seed: int = 0,
+        **options,
+    ) -> "FakeWorkspace":
+        """
+        A tenant with the admin, `users` users spread over domains and a few
+        org units, `groups` groups per domain plus any group_emails, each
+        with up to members_per_group random members.
+        """
+        ws = cls(seed=seed, **options)
+        rng = random.Random(seed)
+        domains = list(domains)
+        for path in ("/Staff", "/Staff/Drivers", "/Seasonal"):
+            ws.add_org_unit(path)
+        ws.add_user(admin, "Dave", "Call", "/Staff")
+        emails = []
+        for i in range(users):
+            given, family = rng.choice(GIVEN_NAMES), rng.choice(FAMILY_NAMES)
+            address = f"{given.lower()}.{family.lower()}{i}@{domains[i % len(domains)]}"
+            ws.add_user(address, given, family, rng.choice(["/", "/Staff", "/Staff/Drivers", "/Seasonal"]),
+                        suspended=rng.random() < 0.02)
+            emails.append(address)
+        group_list = [f"team{j}@{d}" for d in domains for j in range(groups)] + list(group_emails)
+        for g in group_list:
+            sample = rng.sample(emails, min(members_per_group, len(emails)))
+            ws.add_group(g, members=sample + ([admin] if rng.random() < 0.5 else []))
+        return ws
+
+    # ---------- HTTP ----------
+
+    def _delay(self, calls: int = 1) -> float:
+        delay = self.latency + self.call_latency * calls
+        if self.jitter:
+            with self.lock:
+                delay += self.random.uniform(0, self.jitter)
+        return delay
+
+    def _injected(self) -> Optional[ApiError]:
+        if not (self.rate_limit_rate or self.server_error_rate):
+            return None
+        with self.lock:
+            roll = self.random.random()
+        headers = {"retry-after": str(self.retry_after)} if self.retry_after is not None else {}
+        if roll < self.rate_limit_rate:
+            self._count("injected_429")
+            return ApiError(429, "rateLimitExceeded", "Rate Limit Exceeded", headers)
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            self._count("injected_5xx")
+            return ApiError(503, "backendError", "Backend Error", headers)
+        return None
+
+    @staticmethod
+    def _response(status: int, payload, headers: Optional[dict] = None) -> Tuple[httplib2.Response, bytes]:
+        info = {"status": str(status), "content-type": "application/json; charset=UTF-8", **(headers or {})}
+        content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        return httplib2.Response(info), content
+
+    def handle(self, uri: str, method: str, body, headers: dict, subject: str):
+        """Answer one HTTP request (a single call or a batch), after the simulated latency."""
+        delay, response, content = self.respond(uri, method, body, headers, subject)
+        if delay > 0:
+            time.sleep(delay)
+        return response, content
+
+    def respond(self, uri: str, method: str, body, headers: dict, subject: str):
+        """(simulated latency in seconds, response, content) for one HTTP request."""
+        self._count("round_trips")
+        self._count("request_bytes", len(body or b""))
+        parsed = urlparse(uri)
+        if parsed.path.startswith("/batch"):
+            delay, (response, content) = self._batch(body, headers, subject)
+        else:
+            delay = self._delay()
+            status, payload, extra = self._call(method, parsed.path, parsed.query, body, headers, subject)
+            response, content = self._response(status, payload, extra)
+        self._count("response_bytes", len(content))
+        return delay, response, content
+
+    def async_transport(self) -> "httpx.MockTransport":
+        """An httpx transport answering from this tenant, awaiting (not sleeping) the latency."""
+        async def handler(request):
+            auth = request.headers.get("authorization", "")
+            subject = auth[len("Bearer fake."):] if auth.startswith("Bearer fake.") else ""
+            delay, response, content = self.respond(
+                str(request.url), request.method, request.content or None, dict(request.headers), subject
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+            headers = {k: v for k, v in response.items() if k != "status"}
+            return httpx.Response(response.status, headers=headers, content=content)
+
+        return httpx.MockTransport(handler)
+
+    def _call(self, method: str, path: str, query: str, body, headers: dict, subject: str):
+        self._count("calls")
+        try:
+            error = self._injected()
+            if error:
+                raise error
+            if isinstance(body, bytes):
+                body = body.decode("utf-8")
+            data = json.loads(body) if body else {}
+            params = {k: v[-1] for k, v in parse_qs(query).items()}
+            lowered = {k.lower(): v for k, v in headers.items()}
+            status, payload = self._route(method.upper(), unquote(path), params, data, subject)
+            if status == 200 and isinstance(payload, dict) and "etag" in payload:
+                if lowered.get("if-none-match") == payload["etag"]:
+                    return 304, None, {"etag": payload["etag"]}
+            return status, payload, {}
+        except ApiError as e:
+            self._count(f"status_{e.status}")
+            return e.status, e.body(), e.headers
+
+    def _batch(self, body, headers: dict, subject: str):
+        lowered = {k.lower(): v for k, v in headers.items()}
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        message = email.parser.Parser().parsestr(f"content-type: {lowered['content-type']}\r\n\r\n{body}")
+        parts = message.get_payload()
+        self._count("batches")
+        delay = self._delay(len(parts))
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        out = []
+        for part in parts:
+            content_id = part["Content-ID"]
+            request_line, rest = part.get_payload().split("\n", 1)
+            method, target, _ = request_line.split(" ", 2)
+            inner = email.parser.Parser().parsestr(rest)
+            inner_headers = dict(inner.items())
+            auth = {k.lower(): v for k, v in inner_headers.items()}.get("authorization", "")
+            who = auth[len("Bearer fake."):] if auth.startswith("Bearer fake.") else subject
+            path, _, query = target.partition("?")
+            status, payload, extra = self._call(method, path, query, inner.get_payload() or None, inner_headers, who)
+            header_lines = "".join(f"{k}: {v}\r\n" for k, v in extra.items())
+            content = "" if payload is None else json.dumps(payload)
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n{header_lines}\r\n{content}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        info = {"status": "200", "content-type": f"multipart/mixed; boundary={boundary}"}
+        return delay, (httplib2.Response(info), "".join(out).encode("utf-8"))
+
+    # ---------- ROUTING ----------
+
+    def _route(self, method: str, path: str, params: dict, data: dict, subject: str):
+        with self.lock:
+            if self._route_table is None:
+                self._route_table = self._routes()
+            for route_method, pattern, handler in self._route_table:
+                if route_method == method:
+                    m = pattern.fullmatch(path)
+                    if m:
+                        return 200, handler(params, data, subject, *m.groups())
+        raise ApiError(404, "notFound", f"No fake handler for {method} {path}")
+
+    def _routes(self):
+        d, g = r"/admin/directory/v1", r"/gmail/v1/users/([^/]+)"
+        return [
+            ("GET", re.compile(rf"{d}/users"), self._list_users),
+            ("POST", re.compile(rf"{d}/users"), lambda p, body, s: self._insert_user(body)),
+            ("GET", re.compile(rf"{d}/users/([^/]+)"), lambda p, b, s, key: self._user(key)),
+            ("GET", re.compile(rf"{d}/groups"), self._list_groups),
+            ("POST", re.compile(rf"{d}/groups"), lambda p, body, s: self._insert_group(body)),
+            ("GET", re.compile(rf"{d}/groups/([^/]+)"), lambda p, b, s, key: self._group(key)),
+            ("GET", re.compile(rf"{d}/groups/([^/]+)/members"), self._list_members),
+            ("POST", re.compile(rf"{d}/groups/([^/]+)/members"),
+             lambda p, body, s, key: self._insert_member(key, body)),
+            ("DELETE", re.compile(rf"{d}/groups/([^/]+)/members/([^/]+)"), self._delete_member),
+            ("GET", re.compile(rf"{d}/groups/([^/]+)/hasMember/([^/]+)"), self._has_member),
+            ("GET", re.compile(rf"{d}/customer/([^/]+)/orgunits"), self._list_org_units),
+            ("GET", re.compile(rf"{g}/labels"), lambda p, b, s, u: {"labels": list(self._mailbox(u, s).labels.values())}),
+            ("POST", re.compile(rf"{g}/labels"), self._create_label),
+            ("DELETE", re.compile(rf"{g}/labels/([^/]+)"), self._delete_label),
+            ("GET", re.compile(rf"{g}/settings/filters"),
+             lambda p, b, s, u: {"filter": list(self._mailbox(u, s).filters.values())}),
+            ("POST", re.compile(rf"{g}/settings/filters"), self._create_filter),
+            ("DELETE", re.compile(rf"{g}/settings/filters/([^/]+)"), self._delete_filter),
+            ("GET", re.compile(rf"{g}/settings/sendAs"),
+             lambda p, b, s, u: {"sendAs": list(self._mailbox(u, s).send_as.values())}),
+            ("POST", re.compile(rf"{g}/settings/sendAs"), self._create_send_as),
+            ("PATCH", re.compile(rf"{g}/settings/sendAs/([^/]+)"), self._patch_send_as),
+            ("PUT", re.compile(rf"{g}/settings/sendAs/([^/]+)"), self._patch_send_as),
+            ("DELETE", re.compile(rf"{g}/settings/sendAs/([^/]+)"), self._delete_send_as),
+            ("GET", re.compile(rf"{g}/settings/forwardingAddresses"),
+             lambda p, b, s, u: self._mailbox(u, s) and {"forwardingAddresses": []}),
+            ("GET", re.compile(rf"{g}/settings/autoForwarding"),
+             lambda p, b, s, u: self._mailbox(u, s) and {"enabled": False}),
+            ("GET", re.compile(rf"{g}/settings/vacation"),
+             lambda p, b, s, u: self._mailbox(u, s) and {"enableAutoReply": False}),
+        ]
+
+    # ---------- DIRECTORY ----------
+
+    def _sorted_keys(self, collection: str, items: dict) -> List[str]:
+        if collection not in self._sorted:
+            self._sorted[collection] = sorted(items)
+        return self._sorted[collection]
+
+    @staticmethod
+    def _page(kind: str, key: str, items: List[dict], params: dict, default_size: int, max_size: int) -> dict:
+        size = min(int(params.get("maxResults", default_size)), max_size)
+        start = int(params.get("pageToken", "0") or 0)
+        page = items[start:start + size]
+        result = {"kind": kind, key: page}
+        result["etag"] = '"%s"' % hashlib.sha1(json.dumps(page, sort_keys=True).encode()).hexdigest()
+        if start + size < len(items):
+            result["nextPageToken"] = str(start + size)
+        return result
+
+    def _user(self, key: str) -> dict:
+        key = key.lower()
+        user = self.users.get(self.aliases.get(key, key))
+        if user is None:
+            raise ApiError(404, "notFound", "Resource Not Found: userKey")
+        return user
+
+    def _group(self, key: str) -> dict:
+        group = self.groups.get(key.lower())
+        if group is None:
+            raise ApiError(404, "notFound", "Resource Not Found: groupKey")
+        return group
+
+    def _list_users(self, params: dict, data: dict, subject: str) -> dict:
+        users = [self.users[e] for e in self._sorted_keys("users", self.users)]
+        if params.get("domain"):
+            users = [u for u in users if u["primaryEmail"].endswith("@" + params["domain"].lower())]
+        m = re.search(r"orgUnitPath='([^']*)'", params.get("query", ""))
+        if m:
+            users = [u for u in users if u["orgUnitPath"] == m.group(1)]
+        m = re.search(r"isSuspended=(true|false)", params.get("query", ""))
+        if m:
+            users = [u for u in users if u["suspended"] == (m.group(1) == "true")]
+        return self._page("admin#directory#users", "users", users, params, 100, 500)
+
+    def _insert_user(self, body: dict) -> dict:
+        with self.lock:
+            address = body.get("primaryEmail", "").lower()
+            if not address or "@" not in address or not body.get("name", {}).get("familyName"):
+                raise ApiError(400, "invalid", "Invalid Input: primary_user_email / name")
+            if address in self.users or address in self.aliases or address in self.groups:
+                raise ApiError(409, "duplicate", "Entity already exists.")
+            name = dict(body["name"])
+            name["fullName"] = f"{name.get('givenName', '')} {name['familyName']}".strip()
+            user = {
+                "kind": "admin#directory#user", "id": self._next_id(), "primaryEmail": address,
+                "name": name, "orgUnitPath": body.get("orgUnitPath", "/"),
+                "suspended": bool(body.get("suspended", False)), "isAdmin": False,
+                "changePasswordAtNextLogin": bool(body.get("changePasswordAtNextLogin", False)),
+                "aliases": [a.lower() for a in body.get("aliases", [])],
+                "creationTime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            }
+            self.add_org_unit(user["orgUnitPath"])
+            self.users[address] = user
+            for alias in user["aliases"]:
+                self.aliases[alias] = address
+            self.mailboxes[address] = Mailbox(address, name["fullName"])
+            self._sorted.pop("users", None)
+            return user
+
+    def _list_groups(self, params: dict, data: dict, subject: str) -> dict:
+        groups = [self.groups[e] for e in self._sorted_keys("groups", self.groups)]
+        if params.get("domain"):
+            groups = [g for g in groups if g["email"].endswith("@" + params["domain"].lower())]
+        if params.get("userKey"):
+            member = params["userKey"].lower()
+            groups = [g for g in groups if member in self.members.get(g["email"], {})]
+        return self._page("admin#directory#groups", "groups", groups, params, 200, 200)
+
+    def _insert_group(self, body: dict) -> dict:
+        with self.lock:
+            address = body.get("email", "").lower()
+            if not address or "@" not in address:
+                raise ApiError(400, "invalid", "Invalid Input: email")
+            if address in self.groups or address in self.users or address in self.aliases:
+                raise ApiError(409, "duplicate", "Entity already exists.")
+            group = {
+                "kind": "admin#directory#group", "id": self._next_id(), "email": address,
+                "name": body.get("name", ""), "description": body.get("description", ""),
+                "directMembersCount": "0", "aliases": [],
+            }
+            self.groups[address] = group
+            self._sorted.pop("groups", None)
+            return group
+
+    def _expanded(self, group_email: str, seen=None) -> Dict[str, dict]:
+        seen = seen if seen is not None else set()
+        seen.add(group_email)
+        users = {}
+        for address, member in self.members.get(group_email, {}).items():
+            if member["type"] == "GROUP":
+                if address not in seen:
+                    users.update(self._expanded(address, seen))
+            else:
+                users.setdefault(address, member)
+        return users
+
+    def _list_members(self, params: dict, data: dict, subject: str, group_key: str) -> dict:
+        group = self._group(group_key)
+        if params.get("includeDerivedMembership") in ("true", "True", True):
+            members = self._expanded(group["email"])
+        else:
+            members = self.members.get(group["email"], {})
+        items = [members[k] for k in sorted(members)]
+        if params.get("roles"):
+            roles = set(params["roles"].upper().split(","))
+            items = [m for m in items if m["role"] in roles]
+        return self._page("admin#directory#members", "members", items, params, 200, 200)
+
+    def _insert_member(self, group_key: str, body: dict) -> dict:
+        with self.lock:
+            group = self._group(group_key)
+            address = body.get("email", "").lower()
+            address = self.aliases.get(address, address)
+            if address in self.members[group["email"]]:
+                raise ApiError(409, "duplicate", "Member already exists.")
+            is_group = address in self.groups
+            member = {
+                "kind": "admin#directory#member", "email": address,
+                "id": (self.groups if is_group else self.users).get(address, {}).get("id") or self._next_id(),
+                "role": body.get("role", "MEMBER").upper(), "type": "GROUP" if is_group else "USER",
+                "status": "ACTIVE",
+            }
+            self.members[group["email"]][address] = member
+            group["directMembersCount"] = str(len(self.members[group["email"]]))
+            return member
+
+    def _delete_member(self, params: dict, data: dict, subject: str, group_key: str, member_key: str):
+        group = self._group(group_key)
+        if self.members[group["email"]].pop(member_key.lower(), None) is None:
+            raise ApiError(404, "notFound", "Resource Not Found: memberKey")
+        group["directMembersCount"] = str(len(self.members[group["email"]]))
+        return None
+
+    def _has_member(self, params: dict, data: dict, subject: str, group_key: str, member_key: str) -> dict:
+        group = self._group(group_key)
+        return {"isMember": member_key.lower() in self._expanded(group["email"])}
+
+    def _list_org_units(self, params: dict, data: dict, subject: str, customer: str) -> dict:
+        base = params.get("orgUnitPath", "/")
+        units = [
+            ou for path, ou in sorted(self.org_units.items())
+            if path != "/" and (base == "/" or path == base or path.startswith(base.rstrip("/") + "/"))
+        ]
+        if params.get("type", "children") == "children":
+            units = [ou for ou in units if ou["parentOrgUnitPath"] == base]
+        etag = '"%s"' % hashlib.sha1(json.dumps(units, sort_keys=True).encode()).hexdigest()
+        return {"kind": "admin#directory#orgUnits", "etag": etag, "organizationUnits": units}
+
+    # ---------- GMAIL ----------
+
+    def _mailbox(self, user_id: str, subject: str) -> Mailbox:
+        address = subject.lower() if user_id == "me" else user_id.lower()
+        address = self.aliases.get(address, address)
+        mailbox = self.mailboxes.get(address)
+        if mailbox is None:
+            raise ApiError(400, "failedPrecondition", "Mail service not enabled")
+        return mailbox
+
+    def _create_label(self, params: dict, body: dict, subject: str, user_id: str) -> dict:
+        mailbox = self._mailbox(user_id, subject)
+        name = body.get("name", "")
+        if not name:
+            raise ApiError(400, "invalidArgument", "Invalid label name")
+        if any(l["name"].casefold() == name.casefold() for l in mailbox.labels.values()):
+            raise ApiError(409, "failedPrecondition", "Label name exists or conflicts")
+        label = {**body, "id": f"Label_{next(mailbox.ids)}", "type": "user"}
+        mailbox.labels[label["id"]] = label
+        return label
+
+    def _delete_label(self, params: dict, body: dict, subject: str, user_id: str, label_id: str):
+        if self._mailbox(user_id, subject).labels.pop(label_id, None) is None:
+            raise ApiError(404, "notFound", "Requested entity was not found.")
+        return None
+
+    def _create_filter(self, params: dict, body: dict, subject: str, user_id: str) -> dict:
+        mailbox = self._mailbox(user_id, subject)
+        if not body.get("criteria") or not body.get("action"):
+            raise ApiError(400, "invalidArgument", "Filter doesn't have any criteria or actions")
+        action = body["action"]
+        for label_id in action.get("addLabelIds", []) + action.get("removeLabelIds", []):
+            if label_id not in mailbox.labels:
+                raise ApiError(400, "invalidArgument", f"Invalid label {label_id} in AddLabelIds")
+        key = json.dumps({"criteria": body["criteria"], "action": action}, sort_keys=True)
+        for f in mailbox.filters.values():
+            if json.dumps({"criteria": f["criteria"], "action": f["action"]}, sort_keys=True) == key:
+                raise ApiError(400, "failedPrecondition", "Filter already exists")
+        gmail_filter = {"id": f"ANe1Bm{next(mailbox.ids)}", "criteria": body["criteria"], "action": action}
+        mailbox.filters[gmail_filter["id"]] = gmail_filter
+        return gmail_filter
+
+    def _delete_filter(self, params: dict, body: dict, subject: str, user_id: str, filter_id: str):
+        if self._mailbox(user_id, subject).filters.pop(filter_id, None) is None:
+            raise ApiError(404, "notFound", "Requested entity was not found.")
+        return None
+
+    def _create_send_as(self, params: dict, body: dict, subject: str, user_id: str) -> dict:
+        mailbox = self._mailbox(user_id, subject)
+        address = body.get("sendAsEmail", "").lower()
+        if not address:
+            raise ApiError(400, "invalidArgument", "sendAsEmail is required")
+        if address in mailbox.send_as:
+            raise ApiError(409, "alreadyExists", "Requested entity already exists")
+        entry = {"displayName": "", "replyToAddress": "", "signature": "", "treatAsAlias": False, **body,
+                 "sendAsEmail": address, "isPrimary": False, "verificationStatus": "accepted"}
+        mailbox.send_as[address] = entry
+        return entry
+
+    def _patch_send_as(self, params: dict, body: dict, subject: str, user_id: str, address: str) -> dict:
+        entry = self._mailbox(user_id, subject).send_as.get(address.lower())
+        if entry is None:
+            raise ApiError(404, "notFound", "Requested entity was not found.")
+        entry.update({k: v for k, v in body.items() if k not in ("sendAsEmail", "isPrimary")})
+        return entry
+
+    def _delete_send_as(self, params: dict, body: dict, subject: str, user_id: str, address: str):
+        mailbox = self._mailbox(user_id, subject)
+        entry = mailbox.send_as.get(address.lower())
+        if entry is None:
+            raise ApiError(404, "notFound", "Requested entity was not found.")
+        if entry.get("isPrimary"):
+            raise ApiError(400, "failedPrecondition", "Cannot delete the primary send-as alias")
+        del mailbox.send_as[address.lower()]
+        return None
+
+
+# ---------- OPENAI ---------- #
+
+def grammar_planner(text: str) -> dict:
+    """Plans for the phrasings command_grammar knows (without touching its stats); else no steps."""
+    from command_grammar import PATTERNS
+
+    command = text.strip().rstrip(".!")
+    for _, pattern, build in PATTERNS:
+        m = pattern.fullmatch(command)
+        if m:
+            return {"steps": build(m)}
+    return {"steps": []}
+
+
+class FakeOpenAI:
+    """Chat completions (and responses) answered locally through an httpx MockTransport."""
+
+    def __init__(self, latency: float = 0.0, planner: Callable[[str], dict] = grammar_planner,
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.planner = planner
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def handler(self, request: "httpx.Request") -> "httpx.Response":
+        with self.lock:
+            self.stats["requests"] += 1
+            fail = self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            with self.lock:
+                self.stats["injected_429"] += 1
+            return httpx.Response(429, json={"error": {"message": "Rate limit reached", "type": "requests"}})
+
+        body = json.loads(request.content or b"{}")
+        if request.url.path.endswith("/chat/completions"):
+            text = next((m["content"] for m in reversed(body.get("messages", [])) if m["role"] == "user"), "")
+            content = json.dumps(self.planner(text))
+            return httpx.Response(200, json={
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(str(body)) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(str(body)) + len(content)) // 4},
+            })
+        if request.url.path.endswith("/responses"):
+            return httpx.Response(200, json={
+                "id": f"resp_{uuid.uuid4().hex}", "object": "response", "created_at": int(time.time()),
+                "model": body.get("model", "fake"), "status": "completed",
+                "output": [{"type": "message", "id": f"msg_{uuid.uuid4().hex}", "role": "assistant",
+                            "status": "completed",
+                            "content": [{"type": "output_text", "text": "Hello from the fake OpenAI!",
+                                         "annotations": []}]}],
+            })
+        return httpx.Response(404, json={"error": {"message": f"No fake handler for {request.url.path}"}})
+
+    def client(self, **http_options):
+        from openai import OpenAI
+
+        from instrumentation import httpx_event_hooks
+
+        http_options.setdefault("event_hooks", httpx_event_hooks())
+        return OpenAI(
+            api_key="fake",
+            base_url="https://openai.fake/v1",
+            max_retries=0,
+            http_client=httpx.Client(transport=httpx.MockTransport(self.handler), **http_options),
+        )
+
+    def install(self) -> "FakeOpenAI":
+        """Point chat_to_workspace at this fake (importing it if needed)."""
+        os.environ.setdefault("OPENAI_API_KEY", "fake")
+        import chat_to_workspace
+
+        self._replaced = chat_to_workspace.client
+        chat_to_workspace.client = self.client()
+        return self
+
+    def uninstall(self):
+        """Give chat_to_workspace back the client install() replaced."""
+        import chat_to_workspace
+
+        if getattr(self, "_replaced", None) is not None:
+            chat_to_workspace.client, self._replaced = self._replaced, None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+if __name__ == "__main__":
+    from workspace_actions import create_filter_from_address, iter_users
+
+    with FakeWorkspace.seeded(users=250, latency=0.002) as ws:
+        users = list(iter_users(fields="users(primaryEmail)"))
+        print(f"{len(users)} users listed in {ws.stats['round_trips']} round trips")
+        create_filter_from_address(ADMIN_EMAIL, "billing@vendor.com", "Vendors")
+        create_filter_from_address(ADMIN_EMAIL, "billing@vendor.com", "Vendors")
+        print(f"filters: {len(ws.mailboxes[ADMIN_EMAIL].filters)}; stats: {dict(ws.stats)}")
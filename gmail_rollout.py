@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Roll out a declarative set of Gmail labels, filters and send-as addresses
+to many mailboxes at once.
+
+The spec is a JSON file describing what every target mailbox must have:
+
+    {
+      "labels": ["Vendors", "Vendors/Billing"],
+      "filters": [
+        {"from": "billing@vendor.com", "label": "Vendors/Billing"},
+        {"criteria": {"subject": "invoice"},
+         "addLabels": ["Vendors"], "removeLabels": ["INBOX"]}
+      ],
+      "sendAs": [
+        {"sendAsEmail": "support@tntdump.com", "displayName": "TNT Dumpsters"}
+      ]
+    }
+
+Label names in filters (including system labels such as INBOX) are mapped
+to each mailbox's label ids; labels a filter needs are created with it.
+Rollouts are additive: anything a mailbox has beyond the spec is left alone.
+
+Each mailbox's drift is computed from one list call each for labels,
+filters and send-as, then only the missing or different entries are
+applied in batch requests. Mailboxes are processed in parallel.
+
+Usage:
+    python gmail_rollout.py spec.json --domain tntdump.com --domain icondumpsters.com
+    python gmail_rollout.py spec.json --ou /Staff --dry-run
+    python gmail_rollout.py spec.json --group billing@tntdump.com --workers 16
+"""
+
+import argparse
+import json
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from backup import bounded_map
+from batching import BatchResult, GMAIL_BATCH_SIZE, execute_batch
+from directory_mirror import get_mirror
+from google_clients import get_gmail_service, get_directory_service, thread_http
+from rate_limit import execute
+from workspace_actions import (
+    canonical_filter,
+    create_labels,
+    iter_group_members,
+    iter_users,
+    mailbox_index,
+)
+
+MAX_WORKERS = 16        # mailboxes rolled out in parallel
+PROGRESS_EVERY = 25     # mailboxes between progress lines
+
+SEND_AS_FIELDS = ("displayName", "replyToAddress", "signature", "treatAsAlias")
+
+
+# ---------- SPEC ---------- #
+
+def load_spec(path: str) -> dict:
+    """Read a spec file and normalize filters to criteria / addLabels / removeLabels."""
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+
+    filters = []
+    for entry in spec.get("filters", []):
+        if "from" in entry:
+            entry = {"criteria": {"from": entry["from"]}, "addLabels": [entry["label"]]}
+        if not entry.get("criteria"):
+            raise ValueError(f"Filter without criteria in {path}: {entry}")
+        filters.append({
+            "criteria": entry["criteria"],
+            "addLabels": list(entry.get("addLabels", [])),
+            "removeLabels": list(entry.get("removeLabels", [])),
+            **({"forward": entry["forward"]} if entry.get("forward") else {}),
+        })
+
+    labels = list(spec.get("labels", []))
+    for f in filters:
+        labels += f["addLabels"] + f["removeLabels"]
+    return {
+        "labels": list(dict.fromkeys(labels)),
+        "filters": filters,
+        "sendAs": list(spec.get("sendAs", [])),
+    }
+
+
+def _filter_body(spec_filter: dict, label_ids: Dict[str, str]) -> dict:
+    action = {}
+    if spec_filter["addLabels"]:
+        action["addLabelIds"] = [label_ids[n.casefold()] for n in spec_filter["addLabels"]]
+    if spec_filter["removeLabels"]:
+        action["removeLabelIds"] = [label_ids[n.casefold()] for n in spec_filter["removeLabels"]]
+    if spec_filter.get("forward"):
+        action["forward"] = spec_filter["forward"]
+    return {"criteria": spec_filter["criteria"], "action": action}
+
+
+# ---------- TARGETS ---------- #
+
+def target_mailboxes(
+    domains: Iterable[str] = (),
+    org_units: Iterable[str] = (),
+    groups: Iterable[str] = (),
+    users: Iterable[str] = (),
+    max_age: Optional[float] = None,
+) -> List[str]:
+    """Active user mailboxes in any of the domains, org units or groups, plus users."""
+    mailboxes = [u.lower() for u in users]
+    mirror = get_mirror().ensure_fresh(max_age) if max_age is not None else None
+
+    for domain in domains:
+        if mirror:
+            mailboxes += [u["primaryEmail"] for u in mirror.users(domain=domain)]
+        else:
+            mailboxes += [
+                u["primaryEmail"]
+                for u in iter_users(domain=domain, fields="users(primaryEmail,suspended)", prefetch=True)
+                if not u.get("suspended")
+            ]
+    for org_unit in org_units:
+        if mirror:
+            mailboxes += [u["primaryEmail"] for u in mirror.users(org_unit_path=org_unit)]
+        else:
+            mailboxes += [
+                u["primaryEmail"]
+                for u in iter_users(query=f"orgUnitPath='{org_unit}'", fields="users(primaryEmail,suspended)")
+                if not u.get("suspended")
+            ]
+    for group in groups:
+        if mirror:
+            mailboxes += sorted(mirror.expanded_members(group))
+        else:
+            http = thread_http(get_directory_service())
+            mailboxes += [
+                m["email"]
+                for m in iter_group_members(group, include_derived=True, http=http)
+                if m.get("type") == "USER" and m.get("status", "ACTIVE") == "ACTIVE"
+            ]
+    return list(dict.fromkeys(m.lower() for m in mailboxes))
+
+
+# ---------- PER MAILBOX ---------- #
+
+def mailbox_drift(user_email: str, spec: dict, index=None) -> dict:
+    """What user_email is missing from spec: labels, filters, new and changed send-as."""
+    index = index or mailbox_index(user_email)
+    with index.lock:
+        index.load_labels()
+        index.load_filters()
+        labels = [n for n in spec["labels"] if n.casefold() not in index.labels]
+
+        # Filters that need a label still to be created can't exist yet.
+        filters = [
+            f for f in spec["filters"]
+            if any(n.casefold() not in index.labels for n in f["addLabels"] + f["removeLabels"])
+            or index.filters.get(canonical_filter(_filter_body(f, index.labels))) is None
+        ]
+
+    gmail = get_gmail_service(user_email)
+    live = {
+        s["sendAsEmail"].lower(): s
+        for s in execute(gmail.users().settings().sendAs().list(userId="me")).get("sendAs", [])
+    }
+    send_as_new, send_as_changed = [], []
+    for entry in spec["sendAs"]:
+        current = live.get(entry["sendAsEmail"].lower())
+        if current is None:
+            send_as_new.append(entry)
+        elif any(k in entry and current.get(k) != entry[k] for k in SEND_AS_FIELDS):
+            send_as_changed.append(entry)
+
+    return {"labels": labels, "filters": filters, "sendAs": send_as_new, "sendAsChanged": send_as_changed}
+
+
+def _tally(results: List[BatchResult], counts: Counter, ok_key: str, errors: List[str]) -> List[BatchResult]:
+    for r in results:
+        if r.ok:
+            counts[ok_key] += 1
+        else:
+            counts["failed"] += 1
+            errors.append(f"{r.key}: {r.error}")
+    return results
+
+
+def rollout_mailbox(user_email: str, spec: dict, dry_run: bool = False) -> dict:
+    """Bring one mailbox up to spec. Returns {"user", "counts", "errors"}."""
+    counts, errors = Counter(), []
+    index = mailbox_index(user_email)
+    try:
+        drift = mailbox_drift(user_email, spec, index)
+    except Exception as e:
+        return {"user": user_email, "counts": Counter(failed=1), "errors": [f"drift: {e}"]}
+
+    if dry_run:
+        for kind in ("labels", "filters", "sendAs", "sendAsChanged"):
+            counts[f"would_{kind}"] = len(drift[kind])
+        counts["unchanged"] = int(not any(drift.values()))
+        return {"user": user_email, "counts": counts, "errors": errors, "drift": drift}
+
+    try:
+        _apply_drift(user_email, drift, index, counts, errors)
+    except Exception as e:  # retries exhausted, RefreshError for a suspended user, 403...
+        # One mailbox must not stop the rollout; what was done so far stays counted.
+        counts["failed"] += 1
+        errors.append(f"apply: {e.__class__.__name__}: {e}")
+    counts["unchanged"] = int(not any(drift.values()))
+    return {"user": user_email, "counts": counts, "errors": errors}
+
+
+def _apply_drift(user_email: str, drift: dict, index, counts: Counter, errors: List[str]):
+    """Create and patch what drift lists, tallying results into counts / errors."""
+    gmail = get_gmail_service(user_email)
+    users = gmail.users()
+
+    if drift["labels"]:  # create_labels adds them to the index
+        _tally(create_labels(user_email, drift["labels"]), counts, "labels_created", errors)
+
+    filter_calls = []
+    for f in drift["filters"]:
+        try:
+            body = _filter_body(f, index.labels)
+        except KeyError:
+            counts["failed"] += 1
+            errors.append(f"filter {f['criteria']}: label was not created")
+            continue
+        filter_calls.append((json.dumps(f["criteria"]), users.settings().filters().create(userId="me", body=body)))
+    for r in _tally(execute_batch(gmail, filter_calls, GMAIL_BATCH_SIZE), counts, "filters_created", errors):
+        if r.ok:
+            index.add_filter(r.response)
+
+    send_as = users.settings().sendAs()
+    send_as_calls = [(s["sendAsEmail"], send_as.create(userId="me", body=s)) for s in drift["sendAs"]]
+    _tally(execute_batch(gmail, send_as_calls, GMAIL_BATCH_SIZE), counts, "send_as_created", errors)
+    patch_calls = [
+        (s["sendAsEmail"], send_as.patch(userId="me", sendAsEmail=s["sendAsEmail"], body=s))
+        for s in drift["sendAsChanged"]
+    ]
+    _tally(execute_batch(gmail, patch_calls, GMAIL_BATCH_SIZE), counts, "send_as_updated", errors)
+
+
+# ---------- ROLLOUT ---------- #
+
+def rollout(spec: dict, mailboxes: List[str], workers: int = MAX_WORKERS, dry_run: bool = False) -> Counter:
+    """Roll spec out to every mailbox in parallel, printing progress; returns totals."""
+    started = time.monotonic()
+    totals = Counter()
+    for done, result in enumerate(
+        bounded_map(lambda u: rollout_mailbox(u, spec, dry_run), mailboxes, workers), start=1
+    ):
+        totals.update(result["counts"])
+        totals["mailboxes"] += 1
+        totals["failed_mailboxes"] += bool(result["errors"])
+        for error in result["errors"]:
+            print(f"[ERROR] {result['user']}: {error}")
+        if dry_run and "drift" in result and not result["counts"]["unchanged"]:
+            drift = result["drift"]
+            print(f"[DRIFT] {result['user']}: {len(drift['labels'])} labels, {len(drift['filters'])} filters, "
+                  f"{len(drift['sendAs'])} new / {len(drift['sendAsChanged'])} changed send-as")
+        if done % PROGRESS_EVERY == 0 or done == len(mailboxes):
+            elapsed = time.monotonic() - started
+            print(f"[ROLLOUT] {done}/{len(mailboxes)} mailboxes in {elapsed:.1f}s "
+                  f"({done / elapsed if elapsed else 0:.1f}/s), {done - totals['unchanged']} drifted, "
+                  f"{totals['failed_mailboxes']} with errors")
+    totals["elapsed_seconds"] = round(time.monotonic() - started, 1)
+    return totals
+
+
+def print_summary(totals: Counter, dry_run: bool):
+    print("\n========== SUMMARY ==========")
+    elapsed = totals["elapsed_seconds"]
+    print(f"Mailboxes: {totals['mailboxes']} in {elapsed}s "
+          f"({totals['mailboxes'] / elapsed if elapsed else 0:.1f}/s), already up to date: {totals['unchanged']}")
+    if dry_run:
+        print(f"Dry run: would create {totals['would_labels']} labels, {totals['would_filters']} filters, "
+              f"{totals['would_sendAs']} send-as; would update {totals['would_sendAsChanged']} send-as")
+    else:
+        changes = (totals["labels_created"] + totals["filters_created"]
+                   + totals["send_as_created"] + totals["send_as_updated"])
+        print(f"Created {totals['labels_created']} labels, {totals['filters_created']} filters, "
+              f"{totals['send_as_created']} send-as; updated {totals['send_as_updated']} send-as "
+              f"({changes / elapsed if elapsed else 0:.1f} changes/s)")
+    print(f"Failed calls: {totals['failed']}, mailboxes with errors: {totals['failed_mailboxes']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll out Gmail labels, filters and send-as to many mailboxes.")
+    parser.add_argument("spec", help="JSON spec file")
+    parser.add_argument("--domain", action="append", default=[], help="every active user in a domain (repeatable)")
+    parser.add_argument("--ou", action="append", default=[], help="every active user in an org unit (repeatable)")
+    parser.add_argument("--group", action="append", default=[], help="every user in a group, nested (repeatable)")
+    parser.add_argument("--user", action="append", default=[], help="one mailbox (repeatable)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--dry-run", action="store_true", help="report drift, change nothing")
+    parser.add_argument("--max-age", type=float,
+                        help="pick targets from the local directory mirror if it is at most this many seconds old")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    mailboxes = target_mailboxes(args.domain, args.ou, args.group, args.user, max_age=args.max_age)
+    if not mailboxes:
+        parser.error("no target mailboxes; pass --domain, --ou, --group or --user")
+
+    print(f"Rolling out {len(spec['labels'])} labels, {len(spec['filters'])} filters and "
+          f"{len(spec['sendAs'])} send-as to {len(mailboxes)} mailbox(es)")
+    totals = rollout(spec, mailboxes, workers=args.workers, dry_run=args.dry_run)
+    print_summary(totals, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
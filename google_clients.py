@@ -1,8 +1,22 @@
 # google_clients.py
+import json
+import threading
+import time
+import urllib.request
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import build_http
+import google_auth_httplib2
 import os
 
+import instrumentation
+from http_pool import PooledHttp
+
 # ---- CONFIG ----
 SERVICE_ACCOUNT_FILE = r"C:\Users\DCALL\Desktop\utahmmc\google-cloud-console\workspace-automation-sa.json"
 ADMIN_EMAIL = "dcall@utahmmc.com"  # super admin or admin user in your domain
@@ -13,6 +27,12 @@ DIRECTORY_SCOPES = [
     "https://www.googleapis.com/auth/admin.directory.group",
 ]
 
+# Read-only org unit listing; kept separate so it only needs granting (in the
+# Admin Console) if you use the org-unit helpers.
+ORG_UNIT_SCOPES = [
+    "https://www.googleapis.com/auth/admin.directory.orgunit.readonly",
+]
+
 # For Gmail “settings” stuff (labels, filters, send-as)
 GMAIL_SCOPES = [
     "https://www.googleapis.com/auth/gmail.settings.basic",
@@ -20,22 +40,227 @@ GMAIL_SCOPES = [
     "https://www.googleapis.com/auth/gmail.labels",
 ]
 
+# How many built clients (one per api + scopes + impersonated user) to keep.
+# Per-mailbox jobs can touch thousands of users; the least recently used
+# clients are dropped once the cache is full.
+CLIENT_CACHE_SIZE = 256
+
+# Share keep-alive connections between all clients (http_pool.py). False
+# gives every client and worker thread its own httplib2 connection instead.
+CONNECTION_POOL = True
+
+# Vendored discovery documents (see refresh_discovery_documents below), so
+# building a client never touches the network.
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery")
+DISCOVERY_APIS = [("admin", "directory_v1"), ("gmail", "v1")]
+DISCOVERY_URL = "https://{api}.googleapis.com/$discovery/rest?version={version}"
+
+_client_cache = OrderedDict()  # (api, version, scopes, subject) -> (creds, service)
+_transport = None  # see set_transport
+_client_cache_lock = threading.Lock()
+_discovery_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def _discovery_path(api: str, version: str) -> str:
+    return os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")
+
+
+def _resolve_resources(resource, desc):
+    for name, sub_desc in desc.get("resources", {}).items():
+        _resolve_resources(getattr(resource, name)(), sub_desc)
+
+
+@lru_cache(maxsize=None)
+def _parsed_discovery(api: str, version: str) -> dict:
+    path = _discovery_path(api, version)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No vendored discovery document at {path}; "
+            f"run `python google_clients.py --refresh-discovery`."
+        )
+    with instrumentation.span("client.discovery", api=api, version=version):
+        with open(path, encoding="utf-8") as f:
+            doc = json.load(f)
+
+        # googleapiclient fills in each method's parameters lazily, in place, the
+        # first time a resource is touched. Do it once here so clients built from
+        # this shared dict never race on that from worker threads.
+        _resolve_resources(build_from_document(doc, credentials=AnonymousCredentials()), doc)
+    return doc
+
+
+def load_discovery_document(api: str, version: str) -> dict:
+    """Parsed discovery document for api/version, loaded once per process."""
+    with _discovery_lock:
+        return _parsed_discovery(api, version)
+
+
+def refresh_discovery_documents():
+    """Re-download the vendored discovery documents (needs network)."""
+    os.makedirs(DISCOVERY_DIR, exist_ok=True)
+    for api, version in DISCOVERY_APIS:
+        url = DISCOVERY_URL.format(api=api, version=version)
+        with urllib.request.urlopen(url) as resp:
+            doc = json.load(resp)
+        with open(_discovery_path(api, version), "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        print(f"{api} {version}: revision {doc.get('revision')}")
+    with _discovery_lock:
+        _parsed_discovery.cache_clear()
+
+
+def set_transport(transport):
+    """
+    Send every client's requests to `transport` instead of Google, or back
+    to Google with None. A transport provides credentials(subject, scopes)
+    and http(credentials) (an httplib2.Http look-alike); fake_workspace.py
+    is one. Cached clients are dropped so the switch applies everywhere.
+    """
+    global _transport
+    _transport = transport
+    clear_client_cache()
+
+
+def current_transport():
+    """The transport set with set_transport, or None when talking to Google."""
+    return _transport
+
+
+def delegated_credentials(scopes, subject: str):
+    """New (instrumented) credentials for scopes, impersonating subject."""
+    if _transport is not None:
+        creds = _transport.credentials(subject, scopes)
+    else:
+        creds = _base_creds(scopes).with_subject(subject)
+    return instrumentation.instrument_credentials(creds, subject)
+
+
+def authorized_http(creds):
+    """A new authorized connection for creds (or the transport's equivalent), instrumented."""
+    if _transport is not None:
+        return instrumentation.InstrumentedHttp(_transport.http(creds))
+    if CONNECTION_POOL:
+        return instrumentation.InstrumentedHttp(PooledHttp(creds))
+    return instrumentation.InstrumentedHttp(google_auth_httplib2.AuthorizedHttp(creds, http=build_http()))
+
+
+@lru_cache(maxsize=None)
+def _load_key_file(scopes: tuple):
+    with instrumentation.span("client.key_file"):
+        return service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE,
+            scopes=list(scopes),
+        )
+
 
 def _base_creds(scopes):
-    """Create base service-account creds (no user impersonation yet)."""
-    return service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE,
-        scopes=scopes,
-    )
+    """Create base service-account creds (no user impersonation yet).
+
+    The key file is only read once per scope set for the life of the process.
+    """
+    return _load_key_file(tuple(scopes))
+
+
+def _token_expired(creds) -> bool:
+    # Creds that never minted a token are not expired, just unused.
+    return creds.token is not None and creds.expired
+
+
+def _evict_expired():
+    for key in [k for k, (creds, _) in _client_cache.items() if _token_expired(creds)]:
+        del _client_cache[key]
+
+
+def get_service(api: str, version: str, scopes, subject: str):
+    """
+    Cached API client for (api, version, scopes, subject).
+
+    The delegated credentials live alongside the client, so the access token
+    minted on the first call is reused by every later call for that subject
+    until it expires; expired entries are dropped and rebuilt on next use.
+    """
+    key = (api, version, tuple(sorted(scopes)), subject.lower())
+
+    with _client_cache_lock:
+        entry = _client_cache.get(key)
+        if entry is not None:
+            creds, service = entry
+            if not _token_expired(creds):
+                _client_cache.move_to_end(key)
+                instrumentation.metrics.inc("workspace_client_cache_total", api=api, result="hit")
+                return service
+            del _client_cache[key]
+    instrumentation.metrics.inc("workspace_client_cache_total", api=api, result="miss")
+
+    creds = delegated_credentials(scopes, subject)
+    document = load_discovery_document(api, version)
+    with instrumentation.span("client.build", api=api, subject=subject):
+        service = build_from_document(document, http=authorized_http(creds))
+
+    with _client_cache_lock:
+        _evict_expired()
+        _client_cache[key] = (creds, service)
+        while len(_client_cache) > CLIENT_CACHE_SIZE:
+            _client_cache.popitem(last=False)
+    return service
+
+
+def clear_client_cache():
+    """Drop every cached client (and re-read the key file on next use)."""
+    with _client_cache_lock:
+        _client_cache.clear()
+    _load_key_file.cache_clear()
+
+
+def thread_http(service):
+    """
+    An authorized connection for service's credentials that is safe to use
+    from the calling thread. Cached clients are shared process-wide, but
+    httplib2 connections are not thread-safe, so worker threads pass this as
+    `execute(request, http=thread_http(service))`. A pooled (thread-safe)
+    connection is simply shared.
+    """
+    if getattr(service._http, "thread_safe", False):
+        return service._http
+    conns = getattr(_thread_local, "conns", None)
+    if conns is None:
+        conns = _thread_local.conns = weakref.WeakKeyDictionary()
+    creds = service._http.credentials
+    if creds not in conns:
+        conns[creds] = authorized_http(creds)
+    return conns[creds]
 
 
 def get_directory_service(impersonate_email: str = ADMIN_EMAIL):
     """Admin SDK Directory API client (for users + groups)."""
-    creds = _base_creds(DIRECTORY_SCOPES).with_subject(impersonate_email)
-    return build("admin", "directory_v1", credentials=creds)
+    return get_service("admin", "directory_v1", DIRECTORY_SCOPES, impersonate_email)
 
 
 def get_gmail_service(user_email: str):
     """Gmail API client, impersonating the given user."""
-    creds = _base_creds(GMAIL_SCOPES).with_subject(user_email)
-    return build("gmail", "v1", credentials=creds)
+    return get_service("gmail", "v1", GMAIL_SCOPES, user_email)
+
+
+def _time_client_construction():
+    """Print offline client construction timings (no key file or network)."""
+    creds = AnonymousCredentials()
+    for api, version in DISCOVERY_APIS:
+        start = time.perf_counter()
+        load_discovery_document(api, version)
+        loaded = time.perf_counter()
+        build_from_document(load_discovery_document(api, version), credentials=creds)
+        built = time.perf_counter()
+        print(
+            f"{api} {version}: load+parse {(loaded - start) * 1000:.1f} ms, "
+            f"build {(built - loaded) * 1000:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--refresh-discovery" in sys.argv:
+        refresh_discovery_documents()
+    else:
+        _time_client_construction()
@@ -0,0 +1,102 @@
+# http_pool.py
+"""
+Keep-alive connection pool shared by every Google API client.
+
+With httplib2 (googleapiclient's default) each client, and each
+per-thread connection from google_clients.thread_http, owns its own
+socket: every new impersonated user pays a fresh TCP + TLS handshake, and
+none of it can be shared between threads. PooledHttp is a drop-in for
+google_auth_httplib2.AuthorizedHttp built on requests instead:
+
+- each instance keeps its own credentials (one impersonated user) in a
+  google.auth AuthorizedSession, which adds the token, refreshes it when
+  it expires and retries once on a 401;
+- every session mounts the same HTTPAdapter, so connections to
+  admin/gmail/oauth2.googleapis.com are kept alive and reused across
+  users and threads (up to POOL_MAXSIZE per host);
+- responses are gzip-compressed on the wire and decompressed by requests;
+- dropped connections and timeouts are raised as the builtin
+  ConnectionError / TimeoutError (as with httplib2), so rate_limit retries
+  them.
+
+It is thread-safe, so one connection can serve a client from any thread.
+"""
+import threading
+from typing import Dict, Optional
+
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from requests.adapters import HTTPAdapter
+
+POOL_CONNECTIONS = 8    # hosts kept in the pool
+POOL_MAXSIZE = 64       # open connections kept per host
+TIMEOUT = 120           # seconds per request
+
+_adapter: Optional[HTTPAdapter] = None
+_adapter_lock = threading.Lock()
+
+
+def shared_adapter() -> HTTPAdapter:
+    """The process-wide pooled adapter (retries are left to rate_limit)."""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        return _adapter
+
+
+def _mount(session: requests.Session) -> requests.Session:
+    adapter = shared_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip"
+    return session
+
+
+class PooledHttp:
+    """httplib2.Http look-alike authorized as one user, over the shared pool."""
+
+    thread_safe = True
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        # Token refreshes go through the pool too.
+        self.session = _mount(AuthorizedSession(credentials, auth_request=Request(_mount(requests.Session()))))
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None, **kwargs):
+        try:
+            response = self.session.request(
+                method, uri, data=body, headers=headers, timeout=TIMEOUT, allow_redirects=redirections > 0
+            )
+        except requests.exceptions.Timeout as e:  # before ConnectionError: ConnectTimeout is both
+            raise TimeoutError(f"{method} {uri}: {e}") from e
+        except requests.exceptions.ConnectionError as e:
+            raise ConnectionError(f"{method} {uri}: {e}") from e
+        info = {k.lower(): v for k, v in response.headers.items()}
+        if "content-encoding" in info:
+            # requests already decoded the body; say so the way httplib2 does.
+            info["-content-encoding"] = info.pop("content-encoding")
+            info.pop("content-length", None)
+        info["status"] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        # The adapter is shared; closing the session would close every
+        # pooled connection, so there is nothing to do per instance.
+        pass
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """Per host: connections opened and requests sent through the pool."""
+    stats = {}
+    for key in list(shared_adapter().poolmanager.pools.keys()):
+        pool = shared_adapter().poolmanager.pools.get(key)
+        if pool is not None:
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+    return stats
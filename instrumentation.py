@@ -0,0 +1,414 @@
+# instrumentation.py
+"""
+Timing and size instrumentation for every Directory, Gmail and OpenAI call.
+
+The toolkit reports what it does as spans, each a name, start time,
+duration, status and attributes:
+
+- api.call            one rate_limit.execute call: retries, quota wait
+- http.request        one HTTP round trip (Google or OpenAI): bytes, status
+- auth.token_refresh  minting an access token for an impersonated user
+- client.key_file / client.discovery / client.build   client construction
+
+Every span updates the in-process `metrics` (latency histograms and
+counters) and is then passed to the registered hooks:
+
+    import instrumentation
+
+    instrumentation.add_hook(instrumentation.log_hook())    # JSON log line per span
+    instrumentation.add_hook(instrumentation.otel_hook())   # OpenTelemetry spans
+    instrumentation.serve_prometheus(9464)                  # /metrics for Prometheus
+    print(instrumentation.summary())                        # per-method table
+
+OpenAI calls are covered by passing httpx_event_hooks() to the httpx
+client the OpenAI SDK uses (chat_to_workspace.py does).
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger("workspace.instrumentation")
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Span(NamedTuple):
+    name: str
+    start_time: float     # epoch seconds
+    duration: float       # seconds
+    status: str           # "ok" or "error"
+    attributes: dict
+
+
+# ---------- METRICS ---------- #
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf past the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Counters and histograms keyed by name and labels (thread-safe)."""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels: dict) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def prometheus_text(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        def fmt(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            escaped = (v.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{fmt(labels)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(h.buckets + (float("inf"),), h.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{fmt(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{fmt(labels)} {h.sum:.6f}")
+                    lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.help.update({
+    "workspace_api_call_seconds": "Directory/Gmail calls through rate_limit, including retries and quota waits.",
+    "workspace_api_retries_total": "Retries of throttled or failed Directory/Gmail calls.",
+    "workspace_quota_wait_seconds": "Time calls spent waiting on client-side quota buckets.",
+    "http_client_request_seconds": "HTTP round trips to Google and OpenAI.",
+    "http_client_request_bytes_total": "Request body bytes sent.",
+    "http_client_response_bytes_total": "Response body bytes received.",
+    "http_client_retries_total": "HTTP requests that were retries (OpenAI SDK).",
+    "workspace_token_refreshes_total": "Access tokens minted for impersonated users.",
+    "workspace_token_refresh_seconds": "Time spent minting access tokens.",
+    "workspace_client_setup_seconds": "Key file reads, discovery parsing and client builds.",
+    "workspace_client_cache_total": "Client cache lookups by result.",
+})
+
+
+def _record_metrics(span: Span):
+    a = span.attributes
+    if span.name == "api.call":
+        metrics.observe("workspace_api_call_seconds", span.duration,
+                        api=a.get("api", ""), method=a.get("method", ""), status=span.status)
+        if a.get("retries"):
+            metrics.inc("workspace_api_retries_total", a["retries"], api=a.get("api", ""), method=a.get("method", ""))
+        if "quota_wait" in a:
+            metrics.observe("workspace_quota_wait_seconds", a["quota_wait"], api=a.get("api", ""))
+    elif span.name == "http.request":
+        host = a.get("host", "")
+        metrics.observe("http_client_request_seconds", span.duration,
+                        host=host, method=a.get("http_method", ""), code=a.get("http_status", "error"))
+        metrics.inc("http_client_request_bytes_total", a.get("request_bytes", 0), host=host)
+        metrics.inc("http_client_response_bytes_total", a.get("response_bytes", 0), host=host)
+        if a.get("retry_attempt"):
+            metrics.inc("http_client_retries_total", host=host)
+    elif span.name == "auth.token_refresh":
+        metrics.inc("workspace_token_refreshes_total", status=span.status)
+        metrics.observe("workspace_token_refresh_seconds", span.duration)
+    elif span.name.startswith("client."):
+        metrics.observe("workspace_client_setup_seconds", span.duration, stage=span.name[len("client."):])
+
+
+# ---------- SPANS & HOOKS ---------- #
+
+_hooks: List[Callable[[Span], None]] = []
+
+
+def add_hook(hook: Callable[[Span], None]) -> Callable[[Span], None]:
+    """Call hook(span) for every finished span (from whichever thread ran it)."""
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook: Callable[[Span], None]):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def _error_name(error: BaseException) -> str:
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return f"{error.__class__.__name__} {status}" if status else error.__class__.__name__
+
+
+def finish(name: str, start_time: float, duration: float, attributes: dict, status: str = "ok"):
+    """Record a span measured elsewhere."""
+    span = Span(name, start_time, duration, status, attributes)
+    _record_metrics(span)
+    for hook in list(_hooks):
+        try:
+            hook(span)
+        except Exception:  # a broken exporter must not break API calls
+            logger.exception("instrumentation hook %r failed", hook)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the block as a span. Yields its attributes dict, so the block can
+    add to it; an exception marks the span as an error and is re-raised.
+    """
+    start_time, started = time.time(), time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except BaseException as e:
+        status = "error"
+        attributes.setdefault("error", _error_name(e))
+        raise
+    finally:
+        finish(name, start_time, time.perf_counter() - started, attributes, status)
+
+
+# ---------- TRANSPORT & CREDENTIALS ---------- #
+
+def _size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    try:
+        return len(body)
+    except TypeError:  # a stream; its size isn't known up front
+        return 0
+
+
+class InstrumentedHttp:
+    """Wraps an httplib2.Http look-alike, timing every request through it."""
+
+    def __init__(self, http):
+        self.http = http
+
+    def __getattr__(self, name):
+        # credentials, timeout, close, ... come from the wrapped connection.
+        return getattr(self.http, name)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        with span("http.request", host=urlparse(uri).hostname or "", http_method=method,
+                  request_bytes=_size(body)) as attributes:
+            response, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+            attributes["http_status"] = getattr(response, "status", 0)
+            attributes["response_bytes"] = _size(content)
+        return response, content
+
+
+def instrument_credentials(creds, subject: str = ""):
+    """Time creds' token refreshes (in place); returns creds."""
+    refresh = creds.refresh
+
+    def timed_refresh(request):
+        with span("auth.token_refresh", subject=subject):
+            refresh(request)
+
+    creds.refresh = timed_refresh
+    return creds
+
+
+def httpx_event_hooks(asynchronous: bool = False) -> Dict[str, list]:
+    """
+    event_hooks for an httpx.Client (e.g. the OpenAI SDK's) timing each
+    request; asynchronous=True for an httpx.AsyncClient.
+    """
+    def on_request(request):
+        request.extensions["instrumentation_start"] = (time.time(), time.perf_counter())
+
+    def on_response(response):
+        request = response.request
+        start_time, started = request.extensions.get("instrumentation_start", (time.time(), time.perf_counter()))
+        try:
+            request_bytes = len(request.content)
+        except Exception:  # streamed body not read yet
+            request_bytes = 0
+        finish("http.request", start_time, time.perf_counter() - started, {
+            "host": request.url.host,
+            "http_method": request.method,
+            "http_status": response.status_code,
+            "request_bytes": request_bytes,
+            "response_bytes": int(response.headers.get("content-length") or 0),
+            "retry_attempt": int(request.headers.get("x-stainless-retry-count") or 0),
+        }, "ok" if response.status_code < 500 else "error")
+
+    if asynchronous:
+        async def on_request_async(request):
+            on_request(request)
+
+        async def on_response_async(response):
+            on_response(response)
+
+        return {"request": [on_request_async], "response": [on_response_async]}
+    return {"request": [on_request], "response": [on_response]}
+
+
+# ---------- EXPORTERS ---------- #
+
+def log_hook(log: Optional[logging.Logger] = None, level: int = logging.INFO) -> Callable[[Span], None]:
+    """A hook writing one JSON line per span to log (default: this module's logger)."""
+    log = log or logger
+
+    def hook(s: Span):
+        if log.isEnabledFor(level):
+            log.log(level, json.dumps({
+                "span": s.name, "start": round(s.start_time, 6), "duration_ms": round(s.duration * 1000, 3),
+                "status": s.status, **s.attributes,
+            }, default=str))
+    return hook
+
+
+class SpanRecorder:
+    """A hook keeping the last max_spans spans in memory (for tests and benchmarks)."""
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans: deque = deque(maxlen=max_spans)
+
+    def __call__(self, s: Span):
+        self.spans.append(s)
+
+    def by_name(self, name: str) -> List[Span]:
+        return [s for s in list(self.spans) if s.name == name]
+
+
+def otel_hook(tracer=None) -> Callable[[Span], None]:
+    """
+    A hook re-emitting spans through OpenTelemetry (needs opentelemetry-api;
+    spans go wherever the application's tracer provider sends them).
+    """
+    from opentelemetry import trace
+    from opentelemetry.trace import Status, StatusCode
+
+    tracer = tracer or trace.get_tracer("workspace-toolkit")
+
+    def hook(s: Span):
+        attributes = {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in s.attributes.items()}
+        otel_span = tracer.start_span(s.name, start_time=int(s.start_time * 1e9), attributes=attributes)
+        if s.status == "error":
+            otel_span.set_status(Status(StatusCode.ERROR, attributes.get("error")))
+        otel_span.end(end_time=int((s.start_time + s.duration) * 1e9))
+    return hook
+
+
+def serve_prometheus(port: int = 9464, addr: str = "") -> ThreadingHTTPServer:
+    """Serve metrics at http://addr:port/metrics from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200 if self.path in ("/", "/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="prometheus-metrics").start()
+    return server
+
+
+def summary() -> str:
+    """Per-method call counts, latency (bucket bounds) and retries, plus transport and quota totals."""
+    with metrics.lock:
+        calls = {k: (h.count, h.quantile(0.5), h.quantile(0.99), h.sum)
+                 for k, h in metrics.histograms.get("workspace_api_call_seconds", {}).items()}
+        retries = dict(metrics.counters.get("workspace_api_retries_total", {}))
+        sent = sum(metrics.counters.get("http_client_request_bytes_total", {}).values())
+        received = sum(metrics.counters.get("http_client_response_bytes_total", {}).values())
+        round_trips = sum(h.count for h in metrics.histograms.get("http_client_request_seconds", {}).values())
+        refreshes = sum(metrics.counters.get("workspace_token_refreshes_total", {}).values())
+        setup = {dict(k)["stage"]: h.sum for k, h in metrics.histograms.get("workspace_client_setup_seconds", {}).items()}
+        waits = {dict(k)["api"]: h.sum for k, h in metrics.histograms.get("workspace_quota_wait_seconds", {}).items()}
+
+    per_method: Dict[str, list] = {}
+    for labels, (count, p50, p99, total) in calls.items():
+        method = dict(labels)["method"]
+        row = per_method.setdefault(method, [0, 0.0, 0.0, 0.0, 0])
+        row[0] += count
+        row[1] = max(row[1], p50)
+        row[2] = max(row[2], p99)
+        row[3] += total
+    for labels, n in retries.items():
+        per_method.setdefault(dict(labels)["method"], [0, 0.0, 0.0, 0.0, 0])[4] += int(n)
+
+    lines = [f"{'method':<44}{'calls':>7}{'p50 <=':>9}{'p99 <=':>9}{'total s':>9}{'retries':>9}"]
+    for method, (count, p50, p99, total, n_retries) in sorted(per_method.items(), key=lambda kv: -kv[1][3]):
+        lines.append(f"{method:<44}{count:>7}{p50:>9g}{p99:>9g}{total:>9.2f}{n_retries:>9}")
+    lines.append(
+        f"{round_trips} HTTP round trips, {sent / 1024:.1f} KB sent, {received / 1024:.1f} KB received, "
+        f"{int(refreshes)} token refreshes; client setup "
+        + (", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in sorted(setup.items())) or "none")
+    )
+    if any(waits.values()):
+        lines.append("waiting on quota: " + ", ".join(f"{api} {s:.2f}s" for api, s in sorted(waits.items())))
+    return "\n".join(lines)
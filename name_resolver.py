@@ -0,0 +1,251 @@
+# name_resolver.py
+"""
+Resolve short names ("dave", "Dave Call", "marketing") to directory
+addresses locally, so the NL dispatcher never has to guess an email.
+
+The index is built from the users and groups in the local directory
+mirror. Every entry is indexed under its email, local part, aliases and
+names:
+
+- exact terms: a dict of casefolded term -> addresses;
+- prefixes: the same terms kept in one sorted list, so a prefix lookup is
+  a bisect (a flattened trie, at a fraction of the memory of a node per
+  character);
+- fuzzy matches: a trigram index over the terms, with the best few
+  candidates scored by difflib.
+
+    resolver = get_resolver(max_age=3600)
+    resolver.resolve("dave")            # -> "dcall@utahmmc.com" (or LookupError)
+    resolver.lookup("marketing", kind="group")
+
+reload() only touches the entries that changed since the last load.
+"""
+import bisect
+import difflib
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from directory_mirror import get_mirror
+
+FUZZY_CANDIDATES = 20
+FUZZY_CUTOFF = 0.6
+
+# Above this many changed terms, reload() re-sorts instead of inserting.
+RESORT_THRESHOLD = 1000
+
+
+class Entry(NamedTuple):
+    address: str
+    kind: str          # "user" or "group"
+    names: Tuple[str, ...]
+
+
+class Match(NamedTuple):
+    address: str
+    kind: str
+    term: str          # the indexed term that matched
+    score: float       # 1.0 exact, 0.9 prefix, otherwise fuzzy ratio
+
+
+def _norm(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _terms(names: Iterable[str]) -> Set[str]:
+    terms = set()
+    for name in names:
+        term = _norm(name)
+        if term:
+            terms.add(term)
+            if "@" in term:
+                terms.add(term.split("@")[0])
+    return terms
+
+
+def user_entry(user: dict) -> Entry:
+    name = user.get("name") or {}
+    names = [user["primaryEmail"], *user.get("aliases", []),
+             name.get("fullName", ""), name.get("givenName", ""), name.get("familyName", "")]
+    return Entry(user["primaryEmail"].lower(), "user", tuple(n for n in names if n))
+
+
+def group_entry(group: dict) -> Entry:
+    names = [group["email"], *group.get("aliases", []), group.get("name", "")]
+    return Entry(group["email"].lower(), "group", tuple(n for n in names if n))
+
+
+class NameResolver:
+    def __init__(self, entries: Iterable[Entry] = ()):
+        self.entries: Dict[str, Entry] = {}
+        self.terms: Dict[str, Set[str]] = defaultdict(set)      # term -> addresses
+        self.sorted_terms: List[str] = []
+        self.trigrams: Dict[str, Set[str]] = defaultdict(set)   # trigram -> terms
+        self.lock = threading.RLock()
+        self.load(entries)
+
+    # ---------- INDEXING ----------
+
+    def _add_term(self, term: str, address: str, resort: bool):
+        addresses = self.terms[term]
+        if not addresses:
+            if not resort:
+                bisect.insort(self.sorted_terms, term)
+            if "@" not in term:  # full addresses are matched exactly or by prefix only
+                for gram in _trigrams(term):
+                    self.trigrams[gram].add(term)
+        addresses.add(address)
+
+    def _remove_term(self, term: str, address: str, resort: bool):
+        addresses = self.terms.get(term)
+        if not addresses:
+            return
+        addresses.discard(address)
+        if not addresses:
+            del self.terms[term]
+            if not resort:
+                i = bisect.bisect_left(self.sorted_terms, term)
+                if i < len(self.sorted_terms) and self.sorted_terms[i] == term:
+                    del self.sorted_terms[i]
+            if "@" not in term:
+                for gram in _trigrams(term):
+                    self.trigrams[gram].discard(term)
+
+    def load(self, entries: Iterable[Entry]) -> Dict[str, int]:
+        """
+        Make the index hold exactly `entries`, touching only what changed.
+        Returns counts of added, removed and changed entries.
+        """
+        entries = {e.address: e for e in entries}
+        with self.lock:
+            removed = [a for a in self.entries if a not in entries]
+            added = [a for a in entries if a not in self.entries]
+            changed = [a for a in entries if a in self.entries and self.entries[a] != entries[a]]
+
+            old_terms = {a: _terms(self.entries[a].names) for a in removed + changed}
+            new_terms = {a: _terms(entries[a].names) for a in added + changed}
+            resort = sum(map(len, old_terms.values())) + sum(map(len, new_terms.values())) > RESORT_THRESHOLD
+
+            for address, terms in old_terms.items():
+                for term in terms:
+                    self._remove_term(term, address, resort)
+                del self.entries[address]
+            for address, terms in new_terms.items():
+                for term in terms:
+                    self._add_term(term, address, resort)
+                self.entries[address] = entries[address]
+            if resort:
+                self.sorted_terms = sorted(self.terms)
+        return {"added": len(added), "removed": len(removed), "changed": len(changed)}
+
+    # ---------- LOOKUPS ----------
+
+    def _matches(self, term: str, score: float, kind: Optional[str]) -> List[Match]:
+        return [
+            Match(a, self.entries[a].kind, term, score)
+            for a in sorted(self.terms.get(term, ()))
+            if kind is None or self.entries[a].kind == kind
+        ]
+
+    def lookup(self, query: str, kind: Optional[str] = None, limit: int = 5) -> List[Match]:
+        """Best matches for query, best first: exact terms, then prefixes, then fuzzy."""
+        q = _norm(query)
+        if not q:
+            return []
+        with self.lock:
+            matches = self._matches(q, 1.0, kind)
+
+            i = bisect.bisect_left(self.sorted_terms, q)
+            while len(matches) < limit * 4 and i < len(self.sorted_terms) and self.sorted_terms[i].startswith(q):
+                if self.sorted_terms[i] != q:
+                    matches += self._matches(self.sorted_terms[i], 0.9, kind)
+                i += 1
+
+            if not matches:
+                counts = Counter()
+                for gram in _trigrams(q):
+                    counts.update(self.trigrams.get(gram, ()))
+                for term, _ in counts.most_common(FUZZY_CANDIDATES):
+                    ratio = difflib.SequenceMatcher(None, q, term).ratio()
+                    if ratio >= FUZZY_CUTOFF:
+                        matches += self._matches(term, round(ratio, 3), kind)
+
+        best: Dict[str, Match] = {}
+        for m in sorted(matches, key=lambda m: -m.score):
+            best.setdefault(m.address, m)
+        return list(best.values())[:limit]
+
+    def resolve(self, query: str, kind: Optional[str] = None) -> str:
+        """
+        The one address query refers to. Raises LookupError if nothing
+        matches or the best matches are tied.
+        """
+        if "@" in query and query.lower() in self.entries:
+            return query.lower()
+        matches = self.lookup(query, kind)
+        if not matches:
+            raise LookupError(f"No {kind or 'user or group'} matches {query!r}")
+        top = [m for m in matches if m.score == matches[0].score]
+        if len(top) > 1:
+            raise LookupError(f"{query!r} is ambiguous: {', '.join(m.address for m in top)}")
+        return top[0].address
+
+
+# ---------- DIRECTORY-BACKED RESOLVER ---------- #
+
+class DirectoryResolver(NameResolver):
+    """A NameResolver kept in step with the directory mirror."""
+
+    def __init__(self, mirror=None):
+        super().__init__()
+        self.mirror = mirror or get_mirror()
+        self.loaded_at: Dict[str, float] = {}  # mirror refresh time per collection at last load
+
+    def _refreshed_at(self) -> Dict[str, float]:
+        now = time.time()
+        return {c: now - (self.mirror.age(c) or 0.0) for c in ("users", "groups")}
+
+    def reload(self, max_age: Optional[float] = None) -> Dict[str, int]:
+        """Refresh the mirror if older than max_age, then apply what changed."""
+        with self.lock:
+            if max_age is not None:
+                self.mirror.ensure_fresh(max_age, ["users", "groups"])
+            self.loaded_at = self._refreshed_at()
+            entries = [user_entry(u) for u in self.mirror.users()]
+            entries += [group_entry(g) for g in self.mirror.groups()]
+            return self.load(entries)
+
+    def reload_if_stale(self, max_age: float):
+        """Reload if the mirror was refreshed (here or elsewhere) since the last load."""
+        with self.lock:
+            self.mirror.ensure_fresh(max_age, ["users", "groups"])
+            refreshed = self._refreshed_at()
+            if not self.loaded_at or any(refreshed[c] - self.loaded_at[c] > 1.0 for c in refreshed):
+                self.reload()
+
+
+_resolver: Optional[DirectoryResolver] = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver(max_age: float = 3600) -> DirectoryResolver:
+    """Process-wide resolver over the directory mirror, no older than max_age seconds."""
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = DirectoryResolver()
+    _resolver.reload_if_stale(max_age)
+    return _resolver
+
+
+def reset_resolver():
+    """Forget the process-wide resolver (e.g. after switching tenants)."""
+    global _resolver
+    with _resolver_lock:
+        _resolver = None
@@ -0,0 +1,217 @@
+# plan_cache.py
+"""
+Persistent cache of LLM plans for chat_to_workspace.py.
+
+Plans are stored in SQLite under two keys:
+
+- the normalized command text (whitespace, trailing punctuation and the
+  case of email addresses ignored), for repeats of the same command. Other
+  text keeps its case: it may be a label or display name the plan copies;
+- its template, with every email address replaced by a placeholder, so
+  "add a@x.com to sales@x.com" also answers "add b@x.com to ops@x.com".
+  A template entry is only written when every param value of the plan is
+  an address, one of the caller's fixed values (such as roles), or text
+  copied word for word from the command; a group name the model derived
+  from an address ("HR" from hr@x.com) would be wrong for other addresses.
+
+Every key includes a hash of the system prompt and model, so changing
+either invalidates old plans. Entries expire after `ttl` seconds, and the
+least recently used ones are evicted past `max_entries`.
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+PLAN_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_cache", "plans.sqlite3")
+PLAN_TTL = 7 * 24 * 3600  # seconds
+PLAN_CACHE_SIZE = 2000
+
+EMAIL_RE = re.compile(r"[\w.%+'-]+@[\w-]+(?:\.[\w-]+)+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    key TEXT PRIMARY KEY,
+    plan TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plans_used_at ON plans (used_at);
+"""
+
+
+def normalize(text: str) -> str:
+    # Only addresses are casefolded: "as Vendors" and "as vendors" must not
+    # share a plan, since the plan copies the label name as written.
+    text = EMAIL_RE.sub(lambda m: m.group(0).casefold(), text)
+    return " ".join(text.split()).rstrip(".!?")
+
+
+def template(text: str) -> Tuple[str, List[str]]:
+    """(normalized text with emails as <email0>, <email1>..., the emails in order)."""
+    emails: List[str] = []
+
+    def placeholder(m: re.Match) -> str:
+        email = m.group(0)
+        if email not in emails:
+            emails.append(email)
+        return f"<email{emails.index(email)}>"
+
+    return EMAIL_RE.sub(placeholder, normalize(text)), emails
+
+
+def _map_strings(value, fn):
+    if isinstance(value, dict):
+        return {k: _map_strings(v, fn) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_map_strings(v, fn) for v in value]
+    if isinstance(value, str):
+        return fn(value)
+    return value
+
+
+def _param_values(value, in_params: bool = False) -> Iterator[str]:
+    """Every string inside a "params" dict of a plan."""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _param_values(v, in_params or k == "params")
+    elif isinstance(value, list):
+        for v in value:
+            yield from _param_values(v, in_params)
+    elif isinstance(value, str) and in_params:
+        yield value
+
+
+def _generalize(plan: dict, emails: List[str], shape: str, fixed_values: Set[str] = frozenset()) -> Optional[dict]:
+    """
+    plan with the command's emails as placeholders, or None if it can't be
+    reused: a param value is neither an address, a fixed value, nor text
+    that appears word for word in the command's template (shape).
+    """
+    index = {email: i for i, email in enumerate(emails)}
+    generic = _map_strings(
+        plan,
+        lambda s: EMAIL_RE.sub(
+            lambda m: f"<email{index[m.group(0).casefold()]}>" if m.group(0).casefold() in index else m.group(0),
+            s,
+        ),
+    )
+    for value in _param_values(generic):
+        if not value or value in fixed_values:
+            continue
+        if not re.search(rf"(?<!\w){re.escape(value)}(?!\w)", shape):
+            return None
+    return generic
+
+
+def _fill(plan: dict, emails: List[str]) -> dict:
+    return _map_strings(
+        plan,
+        lambda s: re.sub(r"<email(\d+)>", lambda m: emails[int(m.group(1))], s),
+    )
+
+
+class PlanCache:
+    def __init__(
+        self,
+        prompt: str,
+        path: str = PLAN_CACHE_PATH,
+        ttl: float = PLAN_TTL,
+        max_entries: int = PLAN_CACHE_SIZE,
+        fixed_values: Iterable[str] = (),
+    ):
+        """fixed_values: param values the model may use without them being in the command (e.g. roles)."""
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.prefix = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.fixed_values = frozenset(fixed_values)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.stats: Counter = Counter()
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT plan, created_at FROM plans WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+                return None
+            self.conn.execute("UPDATE plans SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _store(self, key: str, plan: dict):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO plans (key, plan, created_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(plan), now, now),
+            )
+            self.conn.execute(
+                "DELETE FROM plans WHERE key IN ("
+                " SELECT key FROM plans ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def get(self, text: str) -> Optional[dict]:
+        """The cached plan for text (exact, then by template), or None."""
+        plan = self._lookup(f"{self.prefix}:text:{normalize(text)}")
+        if plan is not None:
+            self._count("exact")
+            return plan
+        shape, emails = template(text)
+        if emails:
+            plan = self._lookup(f"{self.prefix}:template:{shape}")
+            if plan is not None:
+                self._count("template")
+                return _fill(plan, emails)
+        self._count("misses")
+        return None
+
+    def _count(self, key: str):
+        # get() is called from run_script's planning threads.
+        with self.lock:
+            self.stats[key] += 1
+
+    def put(self, text: str, plan: dict):
+        self._store(f"{self.prefix}:text:{normalize(text)}", plan)
+        shape, emails = template(text)
+        if emails:
+            generic = _generalize(copy.deepcopy(plan), emails, shape, self.fixed_values)
+            if generic is not None:
+                self._store(f"{self.prefix}:template:{shape}", generic)
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM plans")
+
+    def stats_summary(self) -> str:
+        with self.lock:
+            stats = Counter(self.stats)
+        hits = stats["exact"] + stats["template"]
+        return (f"plan cache: {hits} hits ({stats['exact']} exact, "
+                f"{stats['template']} template), {stats['misses']} misses")
+
+
+_caches: Dict[Tuple[str, str], PlanCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_plan_cache(prompt: str, path: str = PLAN_CACHE_PATH, fixed_values: Iterable[str] = ()) -> PlanCache:
+    """Process-wide cache for (prompt, path)."""
+    with _caches_lock:
+        if (prompt, path) not in _caches:
+            _caches[(prompt, path)] = PlanCache(prompt, path, fixed_values=fixed_values)
+        return _caches[(prompt, path)]
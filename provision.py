@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Provision users in bulk from a CSV or JSON Lines file.
+
+Each record is one user:
+
+    email,given_name,family_name,password,org_unit,groups,labels
+    kim@tntdump.com,Kim,Lee,,/Seasonal,crew@tntdump.com;leads@tntdump.com:MANAGER,Dispatch
+
+(JSONL records use the same keys; groups and labels may be lists). A blank
+password gets a random one that must be changed at first login; groups are
+"group[:ROLE]"; labels are created in the new mailbox, as is everything in
+an optional Gmail spec (see gmail_rollout.py).
+
+Records are validated locally and checked against the directory (existing
+users are not created again, but still get their groups and mailbox
+settings), then processed in chunks through three batched, rate-limited
+stages: users, group memberships, mailbox settings. Completed operations
+are appended to a checkpoint file, so a re-run after a crash or a failed
+call picks up where it stopped without re-creating anyone. New mailboxes
+can take a few minutes before Gmail accepts calls; re-run to finish those.
+
+Usage:
+    python provision.py seasonal.csv --dry-run
+    python provision.py seasonal.csv --gmail-spec crew_spec.json
+    python provision.py seasonal.jsonl --max-age 3600 --chunk-size 500
+"""
+
+import argparse
+import csv
+import json
+import re
+import secrets
+import time
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from backup import bounded_map
+from batching import DIRECTORY_BATCH_SIZE
+from directory_mirror import get_mirror
+from gmail_rollout import load_spec, rollout_mailbox
+from google_clients import get_directory_service
+from restore import Checkpoint, run_ops
+from workspace_actions import iter_users
+
+CHUNK_SIZE = 500        # records per pass through the stages
+MAX_WORKERS = 8         # mailboxes set up in parallel
+ROLES = ("MEMBER", "MANAGER", "OWNER")
+MIN_PASSWORD_LENGTH = 8
+
+EMAIL_RE = re.compile(r"^[\w.%+'-]+@[\w-]+(?:\.[\w-]+)+$")
+
+
+# ---------- INPUT ---------- #
+
+def _split(value) -> List[str]:
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in re.split(r"[;|]", value or "") if v.strip()]
+
+
+def read_records(path: str) -> Iterator[Tuple[int, Union[dict, ValueError]]]:
+    """
+    (line number, raw record) from a .csv or .jsonl file, streamed. A JSONL
+    line that doesn't parse comes through as the ValueError describing it,
+    so it is reported with the other invalid records.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            for n, row in enumerate(csv.DictReader(f), start=2):
+                yield n, row
+        else:
+            for n, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield n, json.loads(line.rstrip("\r\n"))
+                    except json.JSONDecodeError as e:
+                        yield n, ValueError(f"invalid JSON: {e.msg} (column {e.colno})")
+
+
+def normalize(raw: dict) -> dict:
+    """A record with canonical keys; raises ValueError describing what is wrong."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"expected an object, got {type(raw).__name__}")
+    get = lambda *keys: next((str(raw[k]).strip() for k in keys if raw.get(k) not in (None, "")), "")
+    record = {
+        "email": get("email", "primaryEmail").lower(),
+        "given_name": get("given_name", "givenName", "first_name"),
+        "family_name": get("family_name", "familyName", "last_name"),
+        "password": get("password"),
+        "org_unit": get("org_unit", "orgUnitPath") or "/",
+        "groups": [],
+        "labels": _split(raw.get("labels")),
+    }
+
+    problems = []
+    if not EMAIL_RE.match(record["email"]):
+        problems.append(f"invalid email {record['email']!r}")
+    if not record["given_name"] or not record["family_name"]:
+        problems.append("given_name and family_name are required")
+    if record["password"] and len(record["password"]) < MIN_PASSWORD_LENGTH:
+        problems.append(f"password shorter than {MIN_PASSWORD_LENGTH} characters")
+    if not record["org_unit"].startswith("/"):
+        problems.append(f"org_unit must start with '/': {record['org_unit']!r}")
+    for entry in _split(raw.get("groups")):
+        group, _, role = entry.partition(":")
+        role = (role or "MEMBER").upper()
+        if not EMAIL_RE.match(group):
+            problems.append(f"invalid group {group!r}")
+        elif role not in ROLES:
+            problems.append(f"invalid role {role!r} for {group}")
+        else:
+            record["groups"].append((group.lower(), role))
+    if problems:
+        raise ValueError("; ".join(problems))
+    return record
+
+
+def validated(records: Iterable[Tuple[int, dict]], rejected: Counter) -> Iterator[dict]:
+    """Valid, de-duplicated records; problems are printed and counted."""
+    seen: Set[str] = set()
+    for n, raw in records:
+        try:
+            if isinstance(raw, ValueError):
+                raise raw
+            record = normalize(raw)
+        except ValueError as e:
+            print(f"[INVALID] line {n}: {e}")
+            rejected["invalid"] += 1
+            continue
+        if record["email"] in seen:
+            print(f"[DUPLICATE] line {n}: {record['email']} appears earlier in the file")
+            rejected["duplicate"] += 1
+            continue
+        seen.add(record["email"])
+        yield record
+
+
+def existing_addresses(max_age: Optional[float] = None) -> Set[str]:
+    """Every primary email and alias in the directory (from the mirror if max_age is given)."""
+    if max_age is not None:
+        users = get_mirror().ensure_fresh(max_age, ["users"]).users(include_suspended=True)
+    else:
+        users = iter_users(fields="users(primaryEmail,aliases)", prefetch=True)
+    addresses = set()
+    for u in users:
+        addresses.add(u["primaryEmail"].lower())
+        addresses.update(a.lower() for a in u.get("aliases", []))
+    return addresses
+
+
+# ---------- STAGES ---------- #
+
+def _user_body(record: dict) -> dict:
+    body = {
+        "primaryEmail": record["email"],
+        "name": {"givenName": record["given_name"], "familyName": record["family_name"]},
+        "orgUnitPath": record["org_unit"],
+        "password": record["password"] or secrets.token_urlsafe(24),
+    }
+    if not record["password"]:
+        body["changePasswordAtNextLogin"] = True
+    return body
+
+
+def create_users_stage(records: List[dict], existing: Set[str], checkpoint: Checkpoint, dry_run: bool) -> Counter:
+    service = get_directory_service()
+    counts = Counter(existing=sum(r["email"] in existing for r in records))
+    ops = [
+        (f"user:{r['email']}", service.users().insert(body=_user_body(r)))
+        for r in records
+        if r["email"] not in existing and f"user:{r['email']}" not in checkpoint
+    ]
+    counts.update(run_ops(service, ops, DIRECTORY_BATCH_SIZE, checkpoint, dry_run))
+    return counts
+
+
+def memberships_stage(records: List[dict], checkpoint: Checkpoint, dry_run: bool) -> Counter:
+    service = get_directory_service()
+    ops = [
+        (
+            f"member:{group}:{r['email']}",
+            service.members().insert(groupKey=group, body={"email": r["email"], "role": role}),
+        )
+        for r in records
+        for group, role in r["groups"]
+        if f"member:{group}:{r['email']}" not in checkpoint
+    ]
+    return run_ops(service, ops, DIRECTORY_BATCH_SIZE, checkpoint, dry_run)
+
+
+def mailboxes_stage(records: List[dict], spec: dict, checkpoint: Checkpoint, dry_run: bool,
+                    workers: int = MAX_WORKERS) -> Counter:
+    todo = [
+        r for r in records
+        if (spec["labels"] or spec["filters"] or spec["sendAs"] or r["labels"])
+        and f"gmail:{r['email']}" not in checkpoint
+    ]
+    counts = Counter(planned=len(todo))
+    if dry_run:
+        for r in todo:
+            print(f"[PLAN]  gmail:{r['email']}")
+        return counts
+
+    def one(record):
+        user_spec = dict(spec, labels=list(dict.fromkeys(spec["labels"] + record["labels"])))
+        return rollout_mailbox(record["email"], user_spec)
+
+    for result in bounded_map(one, todo, workers):
+        if result["errors"]:
+            counts["failed"] += 1
+            for error in result["errors"]:
+                print(f"[ERROR] gmail:{result['user']}: {error}")
+        else:
+            counts["done"] += 1
+            checkpoint.record([f"gmail:{result['user']}"])
+    return counts
+
+
+# ---------- PIPELINE ---------- #
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def provision(
+    path: str,
+    checkpoint_path: Optional[str] = None,
+    spec: Optional[dict] = None,
+    dry_run: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = MAX_WORKERS,
+    max_age: Optional[float] = None,
+) -> Dict[str, Counter]:
+    """Run every record in path through the stages, chunk by chunk; returns counts per stage."""
+    spec = spec or {"labels": [], "filters": [], "sendAs": []}
+    checkpoint = Checkpoint(checkpoint_path or f"{path}.checkpoint")
+    existing = existing_addresses(max_age)
+    totals = {"records": Counter(), "users": Counter(), "memberships": Counter(), "mailboxes": Counter()}
+    started = time.monotonic()
+
+    for chunk in _chunks(validated(read_records(path), totals["records"]), chunk_size):
+        totals["records"]["valid"] += len(chunk)
+        totals["users"].update(create_users_stage(chunk, existing, checkpoint, dry_run))
+        totals["memberships"].update(memberships_stage(chunk, checkpoint, dry_run))
+        totals["mailboxes"].update(mailboxes_stage(chunk, spec, checkpoint, dry_run, workers))
+        elapsed = time.monotonic() - started
+        print(f"[PROVISION] {totals['records']['valid']} records in {elapsed:.1f}s "
+              f"({totals['records']['valid'] / elapsed if elapsed else 0:.1f}/s); "
+              f"users created {totals['users']['done']}, memberships {totals['memberships']['done']}, "
+              f"mailboxes {totals['mailboxes']['done']}")
+    return totals
+
+
+def print_summary(totals: Dict[str, Counter], dry_run: bool):
+    print("\n========== SUMMARY ==========")
+    records = totals["records"]
+    print(f"Records: {records['valid']} valid, {records['invalid']} invalid, {records['duplicate']} duplicate")
+    print(f"Users already in the directory: {totals['users']['existing']}")
+    for stage in ("users", "memberships", "mailboxes"):
+        c = totals[stage]
+        if dry_run:
+            print(f"{stage}: {c['planned']} to do")
+        else:
+            print(f"{stage}: {c['done']} done, {c['failed']} failed (of {c['planned']} to do)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision users from a CSV or JSONL file.")
+    parser.add_argument("path", help=".csv or .jsonl file of users")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <path>.checkpoint)")
+    parser.add_argument("--gmail-spec", help="gmail_rollout.py spec applied to every mailbox")
+    parser.add_argument("--dry-run", action="store_true", help="validate and print the plan, change nothing")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--max-age", type=float,
+                        help="check for existing users in the local directory mirror if it is "
+                             "at most this many seconds old")
+    args = parser.parse_args()
+
+    spec = load_spec(args.gmail_spec) if args.gmail_spec else None
+    totals = provision(args.path, args.checkpoint, spec, args.dry_run, args.chunk_size, args.workers, args.max_age)
+    print_summary(totals, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# rate_limit.py
+"""
+Quota-aware execution for every Directory / Gmail call in the toolkit.
+
+`execute(request)` replaces `request.execute()`:
+
+- waits on token buckets per API (project quota) and per impersonated
+  user (per-user quota), charging Gmail calls their quota-unit cost;
+- retries 429, 5xx and 403 rate-limit errors with jittered exponential
+  backoff (honouring Retry-After);
+- adapts how many calls may be in flight at once: each throttle halves
+  the limit, and a run of successes raises it again by one.
+"""
+import json
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+import instrumentation
+
+# (per-API rate, per-user rate) in quota units per second.
+# Admin SDK Directory: 2,400 queries per minute per user (the admin we
+# impersonate), so both limits are effectively the same.
+# Gmail: 1,200,000 units per minute per project, 250 units per second per user.
+QUOTAS: Dict[str, Tuple[float, float]] = {
+    "directory": (40.0, 40.0),
+    "gmail": (20000.0, 250.0),
+}
+
+# Gmail quota units per method; anything not listed costs 1 (Directory
+# calls all cost 1).
+METHOD_COSTS = {
+    "gmail.users.labels.create": 5,
+    "gmail.users.labels.delete": 5,
+    "gmail.users.labels.patch": 5,
+    "gmail.users.labels.update": 5,
+    "gmail.users.settings.filters.create": 5,
+    "gmail.users.settings.filters.delete": 5,
+    "gmail.users.settings.sendAs.create": 100,
+    "gmail.users.settings.sendAs.delete": 5,
+    "gmail.users.settings.sendAs.patch": 100,
+    "gmail.users.settings.sendAs.update": 100,
+}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError"}
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0   # seconds
+BACKOFF_CAP = 64.0   # seconds
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost: float = 1):
+        # A call costing more than the bucket holds (e.g. a batch of 50
+        # sendAs.create) waits for a full bucket and then runs into debt,
+        # which later callers pay back.
+        needed = min(cost, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= cost
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """A concurrency limit that halves on throttling and creeps back up."""
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 64, increase_after: int = 20):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify()
+
+    def on_success(self):
+        with self.cond:
+            self.successes += 1
+            if self.successes >= self.increase_after and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                self.cond.notify()
+
+    def on_throttle(self):
+        with self.cond:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.successes = 0
+
+
+def _error_reasons(error: HttpError):
+    try:
+        body = json.loads(error.content)
+    except (TypeError, ValueError):
+        return set()
+    err = body.get("error", {}) if isinstance(body, dict) else {}
+    reasons = {e.get("reason") for e in err.get("errors", []) if isinstance(e, dict)}
+    if isinstance(err.get("status"), str):
+        reasons.add(err["status"])
+    return reasons
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        status = getattr(error.resp, "status", None)
+        if status in RETRYABLE_STATUSES:
+            return True
+        return status == 403 and bool(_error_reasons(error) & RATE_LIMIT_REASONS)
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff; a Retry-After header wins if present."""
+    if isinstance(error, HttpError):
+        retry_after = error.resp.get("retry-after")
+        if retry_after and str(retry_after).isdigit():
+            return float(retry_after)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _api_of(request) -> str:
+    return (getattr(request, "methodId", None) or "directory").split(".")[0]
+
+
+def _subject_of(request) -> str:
+    creds = getattr(getattr(request, "http", None), "credentials", None)
+    return getattr(creds, "_subject", None) or ""
+
+
+def request_cost(request) -> int:
+    return METHOD_COSTS.get(getattr(request, "methodId", None), 1)
+
+
+class Scheduler:
+    """Shared buckets and concurrency limits; see the module docstring."""
+
+    def __init__(self, quotas: Dict[str, Tuple[float, float]] = QUOTAS, max_retries: int = MAX_RETRIES):
+        self.quotas = quotas
+        self.max_retries = max_retries
+        self.api_buckets: Dict[str, TokenBucket] = {}
+        self.user_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.limits: Dict[str, AdaptiveLimit] = {}
+        self.lock = threading.Lock()
+
+    def _buckets(self, api: str, user: str):
+        api_rate, user_rate = self.quotas.get(api, QUOTAS["directory"])
+        with self.lock:
+            if api not in self.api_buckets:
+                self.api_buckets[api] = TokenBucket(api_rate)
+                self.limits[api] = AdaptiveLimit()
+            key = (api, user.lower())
+            if key not in self.user_buckets:
+                self.user_buckets[key] = TokenBucket(user_rate)
+            return self.api_buckets[api], self.user_buckets[key], self.limits[api]
+
+    def run(self, fn, api: str, user: str, cost: int = 1, method: Optional[str] = None):
+        """
+        Call fn() under the api/user quotas, retrying throttled calls. The
+        whole call is reported as an api.call span (see instrumentation.py).
+        """
+        api_bucket, user_bucket, limit = self._buckets(api, user)
+        attempt = 0
+        with instrumentation.span("api.call", api=api, method=method or api, subject=user,
+                                  retries=0, quota_wait=0.0) as attributes:
+            while True:
+                waiting = time.perf_counter()
+                api_bucket.acquire(cost)
+                user_bucket.acquire(cost)
+                attributes["quota_wait"] += time.perf_counter() - waiting
+                try:
+                    with limit.slot():
+                        result = fn()
+                except Exception as e:
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        raise
+                    limit.on_throttle()
+                    delay = backoff_delay(attempt, e)
+                    attempt += 1
+                    attributes["retries"] = attempt
+                    print(f"[RETRY] {api} call for {user or '?'} throttled ({e.__class__.__name__}); "
+                          f"attempt {attempt}/{self.max_retries} in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+                limit.on_success()
+                return result
+
+    def execute(self, request, user: Optional[str] = None, http=None):
+        kwargs = {"http": http} if http is not None else {}
+        return self.run(
+            lambda: request.execute(**kwargs),
+            _api_of(request),
+            user if user is not None else _subject_of(request),
+            request_cost(request),
+            getattr(request, "methodId", None),
+        )
+
+    def execute_batch(self, batch, requests: Iterable, user: Optional[str] = None):
+        """Execute a BatchHttpRequest, charging the quota of every call in it."""
+        requests = list(requests)
+        first = requests[0] if requests else None
+        return self.run(
+            batch.execute,
+            _api_of(first),
+            user if user is not None else _subject_of(first),
+            sum(request_cost(r) for r in requests) or 1,
+            f"{_api_of(first)}.batch",
+        )
+
+    def report_throttle(self, api: str):
+        """Feed back throttling seen inside a batch (the batch itself succeeded)."""
+        with self.lock:
+            limit = self.limits.get(api)
+        if limit is not None:
+            limit.on_throttle()
+
+
+# Process-wide scheduler used by the helpers in this repo.
+scheduler = Scheduler()
+
+
+def execute(request, user: Optional[str] = None, http=None):
+    """Drop-in for request.execute() that respects quotas and retries throttling."""
+    return scheduler.execute(request, user=user, http=http)
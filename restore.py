@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Restore a _backups/<date>/ snapshot back into the tenant.
+
+The restore compares the snapshot with the live tenant and only performs
+what is missing, in dependency order:
+
+    1. users               (created with a random password, reset at next login)
+    2. groups
+    3. group memberships
+    4. per-mailbox labels, filters and send-as addresses
+
+Directory writes go out as HTTP batches; memberships are compared and
+mailboxes restored on a thread pool. Every completed operation is appended
+to <snapshot>/restore.checkpoint, so an interrupted restore picks up where
+it stopped when run again. Nothing is ever deleted.
+
+Usage:
+    python restore.py 12-03-25 --dry-run
+    python restore.py 12-03-25
+    python restore.py 12-03-25 --only groups --only group_memberships
+"""
+
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from backup import BACKUP_ROOT, MAX_WORKERS, bounded_map
+from batching import DIRECTORY_BATCH_SIZE, GMAIL_BATCH_SIZE, execute_batch
+from google_clients import get_directory_service, get_gmail_service, thread_http
+from rate_limit import execute
+from snapshots import read_records
+from workspace_actions import canonical_filter, iter_group_members, iter_groups, iter_users
+
+CHECKPOINT_FILE = "restore.checkpoint"
+STAGES = ["users", "groups", "group_memberships", "mailboxes"]
+
+# Fields copied from a backed-up user when it is re-created.
+USER_FIELDS = ["primaryEmail", "name", "orgUnitPath", "recoveryEmail", "recoveryPhone", "phones",
+               "addresses", "organizations", "relations", "externalIds", "includeInGlobalAddressList"]
+LABEL_FIELDS = ["name", "labelListVisibility", "messageListVisibility", "color"]
+SEND_AS_FIELDS = ["sendAsEmail", "displayName", "replyToAddress", "signature", "treatAsAlias"]
+
+
+class Checkpoint:
+    """Append-only log of completed operation ids."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self.lock = threading.Lock()
+
+    def __contains__(self, op_id: str) -> bool:
+        return op_id in self.done
+
+    def record(self, op_ids: Iterable[str]):
+        op_ids = list(op_ids)
+        if not op_ids:
+            return
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(f"{op_id}\n" for op_id in op_ids)
+            self.done.update(op_ids)
+
+
+def _already_exists(error: Optional[Exception]) -> bool:
+    return isinstance(error, HttpError) and getattr(error.resp, "status", None) == 409
+
+
+def run_ops(service, ops: List[Tuple[str, object]], batch_size: int, checkpoint: Checkpoint,
+             dry_run: bool) -> Counter:
+    """Execute (op_id, request) pairs in batches and checkpoint what succeeded."""
+    counts = Counter(planned=len(ops))
+    if dry_run:
+        for op_id, _ in ops:
+            print(f"[PLAN]  {op_id}")
+        return counts
+    if not ops:
+        return counts
+
+    results = execute_batch(service, ops, batch_size)
+    done = []
+    for r in results:
+        # 409 means someone (or an earlier, unrecorded run) already did it.
+        if r.ok or _already_exists(r.error):
+            done.append(r.key)
+            counts["done"] += 1
+        else:
+            print(f"[ERROR] {r.key}: {r.error}")
+            counts["failed"] += 1
+    checkpoint.record(done)
+    return counts
+
+
+# ---------- DIRECTORY ---------- #
+
+def _restore_user_body(user: dict) -> dict:
+    body = {k: user[k] for k in USER_FIELDS if k in user}
+    body["name"] = {k: v for k, v in user.get("name", {}).items() if k in ("givenName", "familyName")}
+    body["password"] = secrets.token_urlsafe(24)
+    body["changePasswordAtNextLogin"] = True
+    return body
+
+
+def restore_users(snapshot_dir: str, checkpoint: Checkpoint, dry_run: bool, root: str) -> Counter:
+    live = {u["primaryEmail"].lower() for u in iter_users(fields="users(primaryEmail)")}
+    service = get_directory_service()
+    ops = []
+    for user in read_records(snapshot_dir, "users", root):
+        op_id = f"user:{user['primaryEmail'].lower()}"
+        if user["primaryEmail"].lower() not in live and op_id not in checkpoint:
+            ops.append((op_id, service.users().insert(body=_restore_user_body(user))))
+    return run_ops(service, ops, DIRECTORY_BATCH_SIZE, checkpoint, dry_run)
+
+
+def restore_groups(snapshot_dir: str, checkpoint: Checkpoint, dry_run: bool, root: str) -> Counter:
+    live = {g["email"].lower() for g in iter_groups(fields="groups(email)")}
+    service = get_directory_service()
+    ops = []
+    for group in read_records(snapshot_dir, "groups", root):
+        op_id = f"group:{group['email'].lower()}"
+        if group["email"].lower() not in live and op_id not in checkpoint:
+            body = {k: group[k] for k in ("email", "name", "description") if k in group}
+            ops.append((op_id, service.groups().insert(body=body)))
+    return run_ops(service, ops, DIRECTORY_BATCH_SIZE, checkpoint, dry_run)
+
+
+def _missing_members(group_and_rows) -> List[Tuple[str, dict]]:
+    group_email, rows = group_and_rows
+    try:
+        live = {
+            m.get("email", "").lower()
+            for m in iter_group_members(
+                group_email, fields="members(email)", http=thread_http(get_directory_service())
+            )
+        }
+    except HttpError as e:
+        if getattr(e.resp, "status", None) != 404:
+            raise
+        live = set()  # group not created yet (dry run) or still propagating
+    return [
+        (group_email, member)
+        for member in rows
+        if member.get("email") and member["email"].lower() not in live
+    ]
+
+
+def restore_memberships(snapshot_dir: str, checkpoint: Checkpoint, dry_run: bool, root: str,
+                        workers: int) -> Counter:
+    # Records are grouped by group in both snapshot formats.
+    by_group = (
+        (group_email, [r["member"] for r in rows])
+        for group_email, rows in groupby(
+            read_records(snapshot_dir, "group_memberships", root), key=lambda r: r["group"].lower()
+        )
+    )
+    service = get_directory_service()
+    ops = []
+    for missing in bounded_map(_missing_members, by_group, workers):
+        for group_email, member in missing:
+            op_id = f"member:{group_email} {member['email'].lower()}"
+            if op_id not in checkpoint:
+                body = {"email": member["email"], "role": member.get("role", "MEMBER")}
+                ops.append((op_id, service.members().insert(groupKey=group_email, body=body)))
+    return run_ops(service, ops, DIRECTORY_BATCH_SIZE, checkpoint, dry_run)
+
+
+# ---------- MAILBOXES ---------- #
+
+def restore_mailbox(settings: dict, checkpoint: Checkpoint, dry_run: bool) -> Counter:
+    user_email = settings["user"].lower()
+    gmail = get_gmail_service(user_email)
+    users = gmail.users()
+    counts = Counter()
+
+    # Labels first: filters refer to them by id.
+    live_labels = execute(users.labels().list(userId="me")).get("labels", [])
+    live_ids = {l["name"].casefold(): l["id"] for l in live_labels}
+    snapshot_labels = [l for l in settings.get("labels", []) if l.get("type") == "user"]
+    label_ops = [
+        (
+            f"label:{user_email}:{l['name']}",
+            users.labels().create(userId="me", body={k: l[k] for k in LABEL_FIELDS if k in l}),
+        )
+        for l in snapshot_labels
+        if l["name"].casefold() not in live_ids and f"label:{user_email}:{l['name']}" not in checkpoint
+    ]
+    counts.update(run_ops(gmail, label_ops, GMAIL_BATCH_SIZE, checkpoint, dry_run))
+    if label_ops and not dry_run:
+        live_labels = execute(users.labels().list(userId="me")).get("labels", [])
+        live_ids = {l["name"].casefold(): l["id"] for l in live_labels}
+
+    # Snapshot label id -> live label id (system labels keep their ids).
+    id_map = {l["id"]: live_ids.get(l["name"].casefold(), l["id"]) for l in snapshot_labels}
+
+    filters = users.settings().filters()
+    live_filters = {
+        canonical_filter(f)
+        for f in execute(filters.list(userId="me")).get("filter", [])
+    }
+    filter_ops = []
+    for f in settings.get("filters", []):
+        canonical = canonical_filter(f, id_map)
+        op_id = f"filter:{user_email}:{canonical}"
+        if canonical not in live_filters and op_id not in checkpoint:
+            body = json.loads(canonical)
+            filter_ops.append((op_id, filters.create(userId="me", body=body)))
+    counts.update(run_ops(gmail, filter_ops, GMAIL_BATCH_SIZE, checkpoint, dry_run))
+
+    send_as = users.settings().sendAs()
+    live_send_as = {s["sendAsEmail"].lower() for s in execute(send_as.list(userId="me")).get("sendAs", [])}
+    send_as_ops = [
+        (
+            f"sendas:{user_email}:{s['sendAsEmail'].lower()}",
+            send_as.create(userId="me", body={k: s[k] for k in SEND_AS_FIELDS if k in s}),
+        )
+        for s in settings.get("sendAs", [])
+        if not s.get("isPrimary")
+        and s["sendAsEmail"].lower() not in live_send_as
+        and f"sendas:{user_email}:{s['sendAsEmail'].lower()}" not in checkpoint
+    ]
+    counts.update(run_ops(gmail, send_as_ops, GMAIL_BATCH_SIZE, checkpoint, dry_run))
+    return counts
+
+
+def restore_mailboxes(snapshot_dir: str, checkpoint: Checkpoint, dry_run: bool, root: str,
+                      workers: int) -> Counter:
+    def one(settings):
+        try:
+            return restore_mailbox(settings, checkpoint, dry_run)
+        except HttpError as e:  # e.g. a mailbox that was just re-created
+            print(f"[ERROR] mailbox {settings['user']}: {e}")
+            return Counter(failed=1)
+
+    counts = Counter()
+    for mailbox_counts in bounded_map(one, read_records(snapshot_dir, "mailboxes", root), workers):
+        counts.update(mailbox_counts)
+    return counts
+
+
+# ---------- MAIN ---------- #
+
+def restore_snapshot(
+    snapshot_dir: str,
+    stages: Iterable[str] = STAGES,
+    dry_run: bool = False,
+    workers: int = MAX_WORKERS,
+    root: str = BACKUP_ROOT,
+) -> Dict[str, Counter]:
+    checkpoint = Checkpoint(os.path.join(snapshot_dir, CHECKPOINT_FILE))
+    if checkpoint.done:
+        print(f"Resuming: {len(checkpoint.done)} operation(s) already done.")
+
+    results = {}
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        started = time.monotonic()
+        if stage == "users":
+            results[stage] = restore_users(snapshot_dir, checkpoint, dry_run, root)
+        elif stage == "groups":
+            results[stage] = restore_groups(snapshot_dir, checkpoint, dry_run, root)
+        elif stage == "group_memberships":
+            results[stage] = restore_memberships(snapshot_dir, checkpoint, dry_run, root, workers)
+        else:
+            results[stage] = restore_mailboxes(snapshot_dir, checkpoint, dry_run, root, workers)
+        c = results[stage]
+        print(f"[RESTORE] {stage}: {c['planned']} needed, {c['done']} done, {c['failed']} failed "
+              f"({time.monotonic() - started:.1f}s)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore a _backups/<date>/ snapshot.")
+    parser.add_argument("date", help="snapshot directory name, e.g. 12-03-25")
+    parser.add_argument("--root", default=BACKUP_ROOT)
+    parser.add_argument("--only", action="append", choices=STAGES, help="restore only these stages")
+    parser.add_argument("--dry-run", action="store_true", help="print what would be done")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    snapshot_dir = os.path.join(args.root, args.date)
+    restore_snapshot(snapshot_dir, args.only or STAGES, args.dry_run, args.workers, args.root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Content-addressed, incremental snapshots and snapshot diffing.
+
+Every record (user, group, membership, org unit, mailbox settings) is
+stored once under _backups/objects/<aa>/<sha256>.json, keyed by the hash of
+its canonical JSON. A dated snapshot is then just one sorted manifest per
+collection, `<collection>.manifest`, with a "key<TAB>hash" line per record,
+so a day where little changed costs a few new objects plus the manifests.
+
+Because manifests are sorted by key, diffing two snapshots is a single
+streaming merge over both files; neither snapshot is loaded into memory.
+A full snapshot from backup.py (no manifests) can be diffed too: its
+records are hashed and sorted as they are read.
+
+Usage:
+    python snapshots.py diff 12-03-25 12-10-25
+    python snapshots.py diff 12-03-25 12-10-25 --collection users
+    python snapshots.py diff 12-03-25 --group billing@tntdump.com   # who joined / left since
+    python snapshots.py show 12-10-25 users dcall@utahmmc.com
+"""
+
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+BACKUP_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_backups")
+OBJECTS_DIR = "objects"
+DATE_FORMAT = "%m-%d-%y"  # snapshot directory names; matches the existing _backups/12-03-25/
+
+COLLECTIONS: List[str] = ["users", "groups", "group_memberships", "org_units", "mailboxes"]
+
+# Fields that change without anything meaningful changing; they are left
+# out of stored records so they don't create a new object every day.
+VOLATILE_FIELDS = {"etag", "lastLoginTime", "thumbnailPhotoEtag"}
+
+# Manifest lines sorted in memory before spilling to a temp file.
+SORT_CHUNK_LINES = 100_000
+
+
+def record_key(collection: str, record: dict) -> str:
+    """The key a record is listed under in its collection's manifest."""
+    if collection == "users":
+        return record["primaryEmail"].lower()
+    if collection == "groups":
+        return record["email"].lower()
+    if collection == "group_memberships":
+        member = record["member"]
+        return f"{record['group'].lower()} {(member.get('email') or member.get('id', '')).lower()}"
+    if collection == "org_units":
+        return record["orgUnitPath"]
+    if collection == "mailboxes":
+        return record["user"].lower()
+    raise ValueError(f"Unknown collection: {collection}")
+
+
+def _strip_volatile(value):
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+# ---------- OBJECT STORE ---------- #
+
+def _canonical(record: dict) -> bytes:
+    return json.dumps(_strip_volatile(record), sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def record_digest(record: dict) -> str:
+    """The hash a record is stored (and listed in manifests) under."""
+    return hashlib.sha256(_canonical(record)).hexdigest()
+
+
+class ObjectStore:
+    def __init__(self, root: str = BACKUP_ROOT):
+        self.dir = os.path.join(root, OBJECTS_DIR)
+        self.new_objects = 0  # objects actually written by this store
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.dir, digest[:2], f"{digest}.json")
+
+    def put(self, record: dict) -> str:
+        """Store record (if not already stored) and return its hash."""
+        data = _canonical(record)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self.new_objects += 1
+        return digest
+
+    def get(self, digest: str) -> dict:
+        with open(self._path(digest), encoding="utf-8") as f:
+            return json.load(f)
+
+
+# ---------- MANIFESTS ---------- #
+
+def _sorted_lines(lines: Iterable[str], chunk_lines: int = SORT_CHUNK_LINES) -> Iterator[str]:
+    """Sort lines with bounded memory: sorted chunks spill to temp files, then merge."""
+    chunk, spills = [], []
+    try:
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                chunk.sort()
+                spill = tempfile.TemporaryFile("w+", encoding="utf-8")
+                spill.writelines(chunk)
+                spill.seek(0)
+                spills.append(spill)
+                chunk = []
+        chunk.sort()
+        yield from heapq.merge(chunk, *spills)
+    finally:
+        for spill in spills:
+            spill.close()
+
+
+def manifest_path(snapshot_dir: str, collection: str) -> str:
+    return os.path.join(snapshot_dir, f"{collection}.manifest")
+
+
+def write_manifest(
+    snapshot_dir: str,
+    collection: str,
+    records: Iterable[dict],
+    store: ObjectStore,
+    key: Callable[[dict], str] = None,
+) -> dict:
+    """Store each record and write the sorted manifest; returns counts."""
+    key = key or (lambda r: record_key(collection, r))
+    stats = {"count": 0}
+    new_before = store.new_objects
+
+    def lines():
+        for record in records:
+            digest = store.put(record)
+            stats["count"] += 1
+            yield f"{key(record)}\t{digest}\n"
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = manifest_path(snapshot_dir, collection)
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(_sorted_lines(lines()))
+    stats["new_objects"] = store.new_objects - new_before
+    stats["file"] = os.path.basename(path)
+    return stats
+
+
+def read_manifest(snapshot_dir: str, collection: str, prefix: str = "") -> Iterator[Tuple[str, str]]:
+    """(key, hash) pairs in key order, optionally only keys starting with prefix."""
+    path = manifest_path(snapshot_dir, collection)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {collection} manifest in snapshot {snapshot_dir}")
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key, digest = line.rstrip("\n").split("\t")
+            if key.startswith(prefix):
+                yield key, digest
+            elif prefix and key > prefix:
+                break  # sorted: nothing further can match
+
+
+def read_records(snapshot_dir: str, collection: str, root: str = BACKUP_ROOT) -> Iterator[dict]:
+    """
+    Stream a collection's records from either kind of snapshot: an
+    incremental one (manifest + object store) or a full one written by
+    backup.py (<collection>.jsonl[.gz], one <mailbox>.json[.gz] per mailbox).
+    """
+    if os.path.exists(manifest_path(snapshot_dir, collection)):
+        store = ObjectStore(root)
+        for _, digest in read_manifest(snapshot_dir, collection):
+            yield store.get(digest)
+        return
+
+    if collection == "mailboxes":
+        names = sorted(n for n in os.listdir(snapshot_dir) if "@" in n and ".json" in n)
+    else:
+        names = [
+            n for n in (f"{collection}.jsonl", f"{collection}.jsonl.gz")
+            if os.path.exists(os.path.join(snapshot_dir, n))
+        ]
+    for name in names:
+        path = os.path.join(snapshot_dir, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def snapshot_entries(snapshot_dir: str, collection: str, prefix: str = "") -> Iterator[Tuple[str, str]]:
+    """
+    read_manifest for either kind of snapshot: a full one (no manifests)
+    has its records hashed and sorted on the fly, with bounded memory.
+    """
+    if os.path.exists(manifest_path(snapshot_dir, collection)):
+        yield from read_manifest(snapshot_dir, collection, prefix)
+        return
+    if not os.path.exists(os.path.join(snapshot_dir, "manifest.json")):
+        raise FileNotFoundError(f"No snapshot at {snapshot_dir}")
+
+    def lines():
+        for record in read_records(snapshot_dir, collection):
+            key = record_key(collection, record)
+            if key.startswith(prefix):
+                yield f"{key}\t{record_digest(record)}\n"
+
+    for line in _sorted_lines(lines()):
+        key, digest = line.rstrip("\n").split("\t")
+        yield key, digest
+
+
+# ---------- DIFF ---------- #
+
+def diff_manifests(old: Iterator[Tuple[str, str]], new: Iterator[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """Merge two sorted manifests into ("+" | "-" | "~", key) changes."""
+    old_item, new_item = next(old, None), next(new, None)
+    while old_item is not None or new_item is not None:
+        if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+            yield "-", old_item[0]
+            old_item = next(old, None)
+        elif old_item is None or new_item[0] < old_item[0]:
+            yield "+", new_item[0]
+            new_item = next(new, None)
+        else:
+            if old_item[1] != new_item[1]:
+                yield "~", new_item[0]
+            old_item, new_item = next(old, None), next(new, None)
+
+
+def diff_snapshots(
+    old_dir: str,
+    new_dir: str,
+    collections: Iterable[str],
+    prefix: str = "",
+) -> Iterator[Tuple[str, str, str]]:
+    """(collection, change, key) for everything that differs between two snapshots."""
+    for collection in collections:
+        changes = diff_manifests(
+            snapshot_entries(old_dir, collection, prefix),
+            snapshot_entries(new_dir, collection, prefix),
+        )
+        for change, key in changes:
+            yield collection, change, key
+
+
+def latest_snapshot(root: str = BACKUP_ROOT) -> str:
+    """Most recent dated snapshot directory (by MM-DD-YY) that has manifests."""
+    dated = []
+    for name in os.listdir(root):
+        if not os.path.exists(manifest_path(os.path.join(root, name), "users")):
+            continue
+        try:
+            date = datetime.strptime(name, DATE_FORMAT)
+        except ValueError:
+            continue  # not a dated snapshot (e.g. a copy or a scratch directory)
+        dated.append((date, name))
+    if not dated:
+        raise FileNotFoundError(f"No incremental snapshots under {root}")
+    return max(dated)[-1]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect and diff incremental snapshots.")
+    parser.add_argument("--root", default=BACKUP_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    diff = sub.add_parser("diff", help="what changed between two snapshot dates")
+    diff.add_argument("old")
+    diff.add_argument("new", nargs="?", help="defaults to the latest snapshot")
+    diff.add_argument("--collection", action="append", choices=COLLECTIONS)
+    diff.add_argument("--prefix", default="", help='only keys starting with this, e.g. "billing@tntdump.com "')
+    diff.add_argument("--group", help="only membership changes of this group")
+
+    show = sub.add_parser("show", help="print one record from a snapshot")
+    show.add_argument("date")
+    show.add_argument("collection", choices=COLLECTIONS)
+    show.add_argument("key")
+
+    args = parser.parse_args(argv)
+    try:
+        _run(args)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+
+def _run(args):
+    if args.command == "diff":
+        new = args.new or latest_snapshot(args.root)
+        collections, prefix = args.collection or COLLECTIONS, args.prefix
+        if args.group:
+            collections, prefix = ["group_memberships"], f"{args.group.lower()} "
+        print(f"Changes from {args.old} to {new}:")
+        counts = {"+": 0, "-": 0, "~": 0}
+        for collection, change, key in diff_snapshots(
+            os.path.join(args.root, args.old),
+            os.path.join(args.root, new),
+            collections,
+            prefix,
+        ):
+            counts[change] += 1
+            print(f"{change} {collection}: {key}")
+        print(f"\n{counts['+']} added, {counts['-']} removed, {counts['~']} changed")
+    else:
+        store = ObjectStore(args.root)
+        snapshot_dir = os.path.join(args.root, args.date)
+        wanted = args.key if args.collection == "org_units" else args.key.lower()
+        for key, digest in read_manifest(snapshot_dir, args.collection, wanted):
+            if key == wanted:
+                print(json.dumps(store.get(digest), indent=2))
+                return
+        print(f"{args.key} not found in {args.collection} on {args.date}")
+
+
+if __name__ == "__main__":
+    main()
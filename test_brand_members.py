@@ -0,0 +1,44 @@
+"""
+--brand-members must skip suspended users, like --ou and the directory
+mirror do, so they never get send-as aliases pushed to them. Runs offline
+against the fake tenant (fake_workspace.FakeWorkspace).
+
+    python -m pytest test_brand_members.py     (or: python test_brand_members.py)
+"""
+from auto_reply_as_v3 import brand_group_members, build_membership_index, sync_many_users
+from brand_aliases import ALIASES
+from fake_workspace import FakeWorkspace
+from google_clients import get_directory_service
+
+ACTIVE = "active.member@tntdump.com"
+SUSPENDED = "suspended.member@tntdump.com"
+
+
+def tenant() -> FakeWorkspace:
+    ws = FakeWorkspace()
+    ws.add_user(ACTIVE)
+    ws.add_user(SUSPENDED, suspended=True)
+    ws.add_group(ALIASES[0], members=[ACTIVE, SUSPENDED])
+    return ws
+
+
+def test_brand_members_skip_suspended_users():
+    with tenant():
+        index = build_membership_index(get_directory_service(), [ALIASES[0]])
+        assert SUSPENDED in index[ALIASES[0].lower()]
+        assert brand_group_members(index) == [ACTIVE]
+
+
+def test_suspended_members_get_no_aliases():
+    with tenant() as ws:
+        index = build_membership_index(get_directory_service(), [ALIASES[0]])
+        results = sync_many_users(brand_group_members(index), index)
+        assert set(results) == {ACTIVE}
+        assert ALIASES[0].lower() in ws.mailboxes[ACTIVE].send_as
+        assert ALIASES[0].lower() not in ws.mailboxes[SUSPENDED].send_as
+
+
+if __name__ == "__main__":
+    test_brand_members_skip_suspended_users()
+    test_suspended_members_get_no_aliases()
+    print("OK")
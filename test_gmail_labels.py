@@ -1,5 +1,7 @@
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+
+from google_clients import load_discovery_document
 
 # Re-use the same key file path that worked before
 SERVICE_ACCOUNT_FILE = r"C:\Users\DCALL\Desktop\utahmmc\google-cloud-console\workspace-automation-sa.json"
@@ -22,7 +24,10 @@ def main():
     delegated_creds = creds.with_subject(USER_EMAIL)
 
     # Build Gmail API client
-    gmail = build("gmail", "v1", credentials=delegated_creds)
+    gmail = build_from_document(
+        load_discovery_document("gmail", "v1"),
+        credentials=delegated_creds,
+    )
 
     # List labels
     result = gmail.users().labels().list(userId="me").execute()
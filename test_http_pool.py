@@ -0,0 +1,89 @@
+"""
+Dropped connections and timeouts on the pooled transport must reach
+rate_limit as retryable errors, as they did with httplib2. Runs against
+throwaway local sockets; no Google credentials needed.
+
+    python -m pytest test_http_pool.py     (or: python test_http_pool.py)
+"""
+import socket
+import threading
+
+import http_pool
+from fake_workspace import FakeCredentials, FakeWorkspace
+from http_pool import PooledHttp
+from rate_limit import Scheduler, is_retryable
+
+
+def _pooled() -> PooledHttp:
+    return PooledHttp(FakeCredentials(FakeWorkspace(), "user@x.com", []))
+
+
+def _server(handle) -> str:
+    """URL of a one-thread TCP server calling handle(conn) for each connection."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            handle(conn)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f"http://127.0.0.1:{listener.getsockname()[1]}/"
+
+
+def _raised(uri: str) -> Exception:
+    try:
+        _pooled().request(uri)
+    except Exception as e:
+        return e
+    raise AssertionError("request did not fail")
+
+
+def test_dropped_connection_is_retryable():
+    uri = _server(lambda conn: (conn.recv(65536), conn.close()))
+    error = _raised(uri)
+    assert isinstance(error, ConnectionError)
+    assert is_retryable(error)
+
+
+def test_refused_connection_is_retryable():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    assert is_retryable(_raised(f"http://127.0.0.1:{port}/"))
+
+
+def test_timeout_is_retryable():
+    hung = []
+    uri = _server(hung.append)  # accepts, never answers
+    timeout, http_pool.TIMEOUT = http_pool.TIMEOUT, 0.2
+    try:
+        error = _raised(uri)
+    finally:
+        http_pool.TIMEOUT = timeout
+    assert isinstance(error, TimeoutError)
+    assert is_retryable(error)
+
+
+def test_scheduler_retries_a_dropped_connection():
+    answers = iter([b"", b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{}"])
+
+    def handle(conn):
+        conn.recv(65536)
+        conn.sendall(next(answers))
+        conn.close()
+
+    uri = _server(handle)
+    scheduler = Scheduler(max_retries=2)
+    resp, content = scheduler.run(lambda: _pooled().request(uri), "directory", "user@x.com")
+    assert resp.status == 200 and content == b"{}"
+
+
+if __name__ == "__main__":
+    test_dropped_connection_is_retryable()
+    test_refused_connection_is_retryable()
+    test_timeout_is_retryable()
+    test_scheduler_retries_a_dropped_connection()
+    print("OK")
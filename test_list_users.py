@@ -1,5 +1,7 @@
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+
+from google_clients import load_discovery_document
 
 # 1) Path to your downloaded service account JSON key
 SERVICE_ACCOUNT_FILE = r"C:\Users\DCALL\Desktop\utahmmc\google-cloud-console\workspace-automation-sa.json"  # <- change this
@@ -23,7 +25,10 @@ def main():
     delegated_creds = creds.with_subject(DELEGATED_ADMIN)
 
     # Build the Admin SDK Directory API client
-    service = build("admin", "directory_v1", credentials=delegated_creds)
+    service = build_from_document(
+        load_discovery_document("admin", "directory_v1"),
+        credentials=delegated_creds,
+    )
 
     # Call the API: list first 10 users
     results = service.users().list(
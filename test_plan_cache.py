@@ -0,0 +1,91 @@
+"""
+Plans the model gets wrong must not be cached: they would be replayed for
+the full TTL, and through the template key for every command of the same
+shape. Runs offline against the fake OpenAI (fake_workspace.FakeOpenAI).
+
+    python -m pytest test_plan_cache.py     (or: python test_plan_cache.py)
+"""
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+import chat_to_workspace
+from fake_workspace import FakeOpenAI
+from plan_cache import PlanCache
+
+BAD_PLANS = {
+    "empty": {"steps": []},
+    "unknown action": {"steps": [{"id": "s1", "action": "delete_everything", "params": {}}]},
+    "unknown dependency": {"steps": [
+        {"id": "s1", "action": "create_group", "params": {"email": "a@x.com", "name": "A"}, "depends_on": ["s9"]},
+    ]},
+    "missing param": {"steps": [
+        {"id": "s1", "action": "create_group", "params": {"email": "a@x.com"}},
+        {"id": "s2", "action": "create_group", "params": {"email": "b@x.com", "name": "B"}},
+    ]},
+    "cycle": {"steps": [
+        {"id": "s1", "action": "create_group", "params": {"email": "a@x.com", "name": "A"}, "depends_on": ["s2"]},
+        {"id": "s2", "action": "create_group", "params": {"email": "b@x.com", "name": "B"}, "depends_on": ["s1"]},
+    ]},
+}
+
+GOOD_PLAN = {"steps": [
+    {"id": "s1", "action": "create_group", "params": {"email": "a@x.com", "name": "A"}, "depends_on": []},
+]}
+
+
+def plan_twice(llm_plan: dict, text: str):
+    """Plan text twice with the model answering llm_plan; returns (sources, cache, model requests)."""
+    cache = PlanCache("test", ":memory:")
+    original = chat_to_workspace.plan_cache
+    chat_to_workspace.plan_cache = lambda: cache
+    try:
+        with FakeOpenAI(planner=lambda _: llm_plan) as llm:
+            sources = [chat_to_workspace.plan_command_with_source(text)[1] for _ in range(2)]
+    finally:
+        chat_to_workspace.plan_cache = original
+    return sources, cache, llm.stats["requests"]
+
+
+def test_bad_llm_plans_are_not_cached():
+    for problem, plan in BAD_PLANS.items():
+        sources, cache, requests = plan_twice(plan, "bogus command for a@x.com")
+        assert sources == ["llm", "llm"], problem
+        assert requests == 2, problem
+        assert cache.get("bogus command for a@x.com") is None, problem
+        assert cache.get("bogus command for b@x.com") is None, problem
+
+
+def test_good_llm_plan_is_cached():
+    sources, cache, requests = plan_twice(GOOD_PLAN, "make a group for a@x.com")
+    assert sources == ["llm", "cache"]
+    assert requests == 1
+    assert cache.get("make a group for a@x.com") == GOOD_PLAN
+
+
+def _one_step(action: str, **params) -> dict:
+    return {"steps": [{"id": "s1", "action": action, "params": params, "depends_on": []}]}
+
+
+def test_values_derived_from_addresses_are_not_templated():
+    cache = PlanCache("test", ":memory:", fixed_values=chat_to_workspace.ROLES)
+    cache.put("make group hr@x.com", _one_step("create_group", email="hr@x.com", name="HR", description=""))
+    cache.put("make group tnt-sales@x.com", _one_step("create_group", email="tnt-sales@x.com", name="TNT Sales"))
+    assert cache.get("make group it@x.com") is None
+    assert cache.get("make group ops@x.com") is None
+
+    cache.put("add a@x.com to b@x.com",
+              _one_step("add_member_to_group", group_email="b@x.com", member_email="a@x.com", role="MEMBER"))
+    cache.put("label mail from a@v.com as Vendors for d@x.com",
+              _one_step("create_filter_from_address", from_address="a@v.com", label_name="Vendors", user_email="d@x.com"))
+    assert cache.get("add c@x.com to d@x.com")["steps"][0]["params"]["member_email"] == "c@x.com"
+    assert cache.get("label mail from z@v.com as Vendors for q@x.com")["steps"][0]["params"] == {
+        "from_address": "z@v.com", "label_name": "Vendors", "user_email": "q@x.com",
+    }
+
+
+if __name__ == "__main__":
+    test_bad_llm_plans_are_not_cached()
+    test_good_llm_plan_is_cached()
+    test_values_derived_from_addresses_are_not_templated()
+    print("OK")
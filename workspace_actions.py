@@ -1,24 +1,178 @@
 # workspace_actions.py
-from typing import List
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
 from googleapiclient.errors import HttpError
 
-from google_clients import get_directory_service, get_gmail_service, ADMIN_EMAIL
+from batching import BatchResult, DIRECTORY_BATCH_SIZE, GMAIL_BATCH_SIZE, execute_batch
+from directory_mirror import get_mirror
+from google_clients import (
+    authorized_http,
+    get_directory_service,
+    get_gmail_service,
+    get_service,
+    ADMIN_EMAIL,
+    ORG_UNIT_SCOPES,
+)
+from rate_limit import execute
+
+# How long a mailbox's label/filter index is trusted before it is reloaded
+# (seconds); changes made through this module are applied to it directly.
+MAILBOX_INDEX_MAX_AGE = 300
+
+# ---------- PAGINATED LISTING ----------
+
+def _with_page_token(fields: Optional[str]) -> Optional[str]:
+    # A fields= projection has to keep nextPageToken or paging stops silently.
+    if fields and "nextPageToken" not in fields:
+        return f"nextPageToken,{fields}"
+    return fields
+
+
+def _private_http(request):
+    """A separate connection (same credentials) for a background thread.
+
+    httplib2 connections are not thread-safe, and the cached client may be in
+    use by the caller while the next page is being fetched. Pooled
+    connections are thread-safe and are shared as they are.
+    """
+    if getattr(request.http, "thread_safe", False):
+        return request.http
+    return authorized_http(request.http.credentials)
+
+
+def _iter_pages(collection, request, items_key: str, prefetch: bool = False, http=None) -> Iterator[dict]:
+    """
+    Yield every item of a list call, following nextPageToken lazily.
+
+    Only the current page is held in memory (plus the next one when
+    prefetch=True, which fetches it on a worker thread while the caller
+    is still consuming the current page). http overrides the connection
+    used (see google_clients.thread_http).
+    """
+    if not prefetch:
+        while request is not None:
+            response = execute(request, http=http)
+            request = collection.list_next(request, response)
+            yield from response.get(items_key, [])
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        http = _private_http(request)
+        future = pool.submit(execute, request, http=http)
+        while future is not None:
+            response = future.result()
+            request = collection.list_next(request, response)
+            future = pool.submit(execute, request, http=http) if request is not None else None
+            yield from response.get(items_key, [])
 
-# ---------- USER & GROUP MANAGEMENT ----------
 
-def list_users(max_results: int = 20):
+def iter_users(
+    domain: Optional[str] = None,
+    query: Optional[str] = None,
+    fields: Optional[str] = None,
+    page_size: int = 500,
+    prefetch: bool = False,
+) -> Iterator[dict]:
+    """
+    Every user in the account (or one domain), ordered by email.
+
+    query uses the Directory search syntax, e.g. "orgUnitPath='/Sales'".
+    fields is a partial-response projection such as "users(primaryEmail,name)".
+    """
     service = get_directory_service()
-    result = service.users().list(
-        customer="my_customer",
-        maxResults=max_results,
-        orderBy="email"
-    ).execute()
-    return result.get("users", [])
+    users = service.users()
+    params = {"orderBy": "email", "maxResults": page_size}
+    if domain:
+        params["domain"] = domain
+    else:
+        params["customer"] = "my_customer"
+    if query:
+        params["query"] = query
+    if fields:
+        params["fields"] = _with_page_token(fields)
+    return _iter_pages(users, users.list(**params), "users", prefetch)
 
 
-def create_user(primary_email: str, given_name: str, family_name: str, password: str):
+def iter_groups(
+    domain: Optional[str] = None,
+    user_key: Optional[str] = None,
+    fields: Optional[str] = None,
+    page_size: int = 200,
+    prefetch: bool = False,
+) -> Iterator[dict]:
+    """Every group in the account, in one domain, or that user_key belongs to."""
+    service = get_directory_service()
+    groups = service.groups()
+    params = {"maxResults": page_size}
+    if user_key:
+        params["userKey"] = user_key
+    elif domain:
+        params["domain"] = domain
+    else:
+        params["customer"] = "my_customer"
+    if fields:
+        params["fields"] = _with_page_token(fields)
+    return _iter_pages(groups, groups.list(**params), "groups", prefetch)
+
+
+def iter_group_members(
+    group_email: str,
+    roles: Optional[str] = None,
+    include_derived: bool = False,
+    fields: Optional[str] = None,
+    page_size: int = 200,
+    prefetch: bool = False,
+    http=None,
+) -> Iterator[dict]:
+    """
+    Members of one group. roles is e.g. "OWNER,MANAGER"; include_derived
+    expands nested groups into their (user) members. Pass
+    http=thread_http(get_directory_service()) when calling from worker threads.
+    """
     service = get_directory_service()
-    body = {
+    members = service.members()
+    params = {"groupKey": group_email, "maxResults": page_size}
+    if roles:
+        params["roles"] = roles
+    if include_derived:
+        params["includeDerivedMembership"] = True
+    if fields:
+        params["fields"] = _with_page_token(fields)
+    return _iter_pages(members, members.list(**params), "members", prefetch, http)
+
+
+def iter_org_units(org_unit_path: str = "/", fields: Optional[str] = None) -> Iterator[dict]:
+    """Every org unit under org_unit_path (the API returns them in one response)."""
+    service = get_service("admin", "directory_v1", ORG_UNIT_SCOPES, ADMIN_EMAIL)
+    params = {"customerId": "my_customer", "orgUnitPath": org_unit_path, "type": "all"}
+    if fields:
+        params["fields"] = fields
+    result = execute(service.orgunits().list(**params))
+    yield from result.get("organizationUnits", [])
+
+
+# ---------- USER & GROUP MANAGEMENT ----------
+
+def list_users(max_results: int = 20, max_age: Optional[float] = None):
+    """
+    First max_results users by email, suspended ones included. With max_age
+    (seconds), read them from the local directory mirror instead, refreshing
+    it first only if it is older.
+    """
+    if max_age is not None:
+        users = get_mirror().ensure_fresh(max_age, ["users"]).users(include_suspended=True)
+    else:
+        users = iter_users(page_size=min(max_results, 500))
+    return list(islice(users, max_results))
+
+
+def user_body(primary_email: str, given_name: str, family_name: str, password: str) -> dict:
+    return {
         "primaryEmail": primary_email,
         "name": {
             "givenName": given_name,
@@ -27,71 +181,263 @@ def create_user(primary_email: str, given_name: str, family_name: str, password:
         "password": password,
     }
 
-    user = service.users().insert(body=body).execute()
-    return user
-
 
-def create_group(email: str, name: str, description: str = ""):
-    service = get_directory_service()
-    body = {
+def group_body(email: str, name: str, description: str = "") -> dict:
+    return {
         "email": email,
         "name": name,
         "description": description,
     }
-    group = service.groups().insert(body=body).execute()
-    return group
 
 
-def add_member_to_group(group_email: str, member_email: str, role: str = "MEMBER"):
-    service = get_directory_service()
-    body = {
+def member_body(member_email: str, role: str = "MEMBER") -> dict:
+    return {
         "email": member_email,
         "role": role,  # MEMBER, MANAGER, OWNER
     }
-    member = service.members().insert(groupKey=group_email, body=body).execute()
+
+
+def create_user(primary_email: str, given_name: str, family_name: str, password: str):
+    service = get_directory_service()
+    body = user_body(primary_email, given_name, family_name, password)
+
+    user = execute(service.users().insert(body=body))
+    return user
+
+
+def create_group(email: str, name: str, description: str = ""):
+    service = get_directory_service()
+    body = group_body(email, name, description)
+    group = execute(service.groups().insert(body=body))
+    return group
+
+
+def add_member_to_group(group_email: str, member_email: str, role: str = "MEMBER"):
+    service = get_directory_service()
+    body = member_body(member_email, role)
+    member = execute(service.members().insert(groupKey=group_email, body=body))
     return member
 
 
+# ---------- BULK (HTTP BATCH) ----------
+# Each helper takes a list of the same fields as its single-call version and
+# returns one BatchResult per input, keyed by the address it was about.
+
+def create_users(users: List[dict]) -> List[BatchResult]:
+    """users: dicts with primary_email, given_name, family_name, password."""
+    service = get_directory_service()
+    calls = [
+        (u["primary_email"], service.users().insert(body=user_body(**u)))
+        for u in users
+    ]
+    return execute_batch(service, calls, DIRECTORY_BATCH_SIZE)
+
+
+def create_groups(groups: List[dict]) -> List[BatchResult]:
+    """groups: dicts with email, name and optional description."""
+    service = get_directory_service()
+    calls = [
+        (g["email"], service.groups().insert(body=group_body(**g)))
+        for g in groups
+    ]
+    return execute_batch(service, calls, DIRECTORY_BATCH_SIZE)
+
+
+def add_members_to_groups(memberships: List[dict]) -> List[BatchResult]:
+    """
+    memberships: dicts with group_email, member_email and optional role.
+    Keys are (group_email, member_email).
+    """
+    service = get_directory_service()
+    calls = [
+        (
+            (m["group_email"], m["member_email"]),
+            service.members().insert(
+                groupKey=m["group_email"],
+                body=member_body(m["member_email"], m.get("role", "MEMBER")),
+            ),
+        )
+        for m in memberships
+    ]
+    return execute_batch(service, calls, DIRECTORY_BATCH_SIZE)
+
+
+def add_members_to_group(group_email: str, member_emails: List[str], role: str = "MEMBER") -> List[BatchResult]:
+    return add_members_to_groups(
+        [{"group_email": group_email, "member_email": m, "role": role} for m in member_emails]
+    )
+
+
 # ---------- GMAIL: LABELS & FILTERS ----------
 
-def create_label(user_email: str, label_name: str):
-    gmail = get_gmail_service(user_email)
-    label_body = {
+def label_body(label_name: str) -> dict:
+    return {
         "name": label_name,
         "labelListVisibility": "labelShow",
         "messageListVisibility": "show",
     }
-    label = gmail.users().labels().create(userId="me", body=label_body).execute()
+
+
+def create_label(user_email: str, label_name: str):
+    gmail = get_gmail_service(user_email)
+    body = label_body(label_name)
+    label = execute(gmail.users().labels().create(userId="me", body=body))
+    _known_mailbox_index(user_email, lambda index: index.add_label(label))
     return label
 
 
+def create_labels(user_email: str, label_names: List[str]) -> List[BatchResult]:
+    """Create several labels in one mailbox; keys are the label names."""
+    gmail = get_gmail_service(user_email)
+    calls = [
+        (name, gmail.users().labels().create(userId="me", body=label_body(name)))
+        for name in label_names
+    ]
+    results = execute_batch(gmail, calls, GMAIL_BATCH_SIZE)
+    for r in results:
+        if r.ok:
+            _known_mailbox_index(user_email, lambda index: index.add_label(r.response))
+    return results
+
+
 def list_labels(user_email: str):
     gmail = get_gmail_service(user_email)
-    result = gmail.users().labels().list(userId="me").execute()
+    result = execute(gmail.users().labels().list(userId="me"))
     return result.get("labels", [])
 
 
-def create_filter_from_address(user_email: str, from_address: str, label_name: str):
+def canonical_filter(gmail_filter: dict, label_ids: Optional[Dict[str, str]] = None) -> str:
+    """A filter's criteria+action as a key, with label ids mapped through label_ids."""
+    label_ids = label_ids or {}
+    action = dict(gmail_filter.get("action", {}))
+    for field in ("addLabelIds", "removeLabelIds"):
+        if field in action:
+            action[field] = sorted(label_ids.get(i, i) for i in action[field])
+    return json.dumps({"criteria": gmail_filter.get("criteria", {}), "action": action}, sort_keys=True)
+
+
+class MailboxIndex:
     """
-    If label doesn't exist, creates it.
-    Then creates a filter: if From == from_address, apply label.
+    One mailbox's labels (casefolded name -> id) and filters (criteria+action
+    -> filter), each loaded with a single list call and then kept up to date
+    by the helpers here. A label name that isn't found triggers one reload
+    before it is created, in case it was added elsewhere.
     """
-    gmail = get_gmail_service(user_email)
 
-    # 1) Ensure label exists
-    labels = list_labels(user_email)
-    label_id = None
-    for l in labels:
-        if l["name"].lower() == label_name.lower():
-            label_id = l["id"]
-            break
+    def __init__(self, user_email: str):
+        self.user_email = user_email
+        self.labels: Optional[Dict[str, str]] = None
+        self.filters: Optional[Dict[str, dict]] = None
+        self.created_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def _gmail(self):
+        return get_gmail_service(self.user_email)
+
+    def load_labels(self):
+        with self.lock:
+            labels = execute(self._gmail().users().labels().list(userId="me")).get("labels", [])
+            self.labels = {l["name"].casefold(): l["id"] for l in labels}
 
-    if not label_id:
-        label = create_label(user_email, label_name)
-        label_id = label["id"]
+    def load_filters(self):
+        with self.lock:
+            filters = execute(self._gmail().users().settings().filters().list(userId="me")).get("filter", [])
+            self.filters = {canonical_filter(f): f for f in filters}
 
-    # 2) Create filter
-    filter_body = {
+    def add_label(self, label: dict):
+        with self.lock:
+            if self.labels is not None:
+                self.labels[label["name"].casefold()] = label["id"]
+
+    def find_label(self, label_name: str) -> Optional[str]:
+        """Label id for label_name, reloading the labels once on a miss."""
+        with self.lock:
+            if self.labels is None:
+                self.load_labels()
+            elif label_name.casefold() not in self.labels:
+                self.load_labels()
+            return self.labels.get(label_name.casefold())
+
+    def label_id(self, label_name: str) -> str:
+        """Label id for label_name, creating the label if the mailbox has none."""
+        with self.lock:
+            label_id = self.find_label(label_name)
+            if label_id is None:
+                try:
+                    label = execute(self._gmail().users().labels().create(
+                        userId="me", body=label_body(label_name)
+                    ))
+                except HttpError as e:
+                    if getattr(e.resp, "status", None) != 409:
+                        raise
+                    self.load_labels()  # created concurrently elsewhere
+                    return self.labels[label_name.casefold()]
+                self.add_label(label)
+                label_id = label["id"]
+            return label_id
+
+    def existing_filter(self, body: dict) -> Optional[dict]:
+        with self.lock:
+            if self.filters is None:
+                self.load_filters()
+            return self.filters.get(canonical_filter(body))
+
+    def add_filter(self, gmail_filter: dict):
+        with self.lock:
+            if self.filters is not None:
+                self.filters[canonical_filter(gmail_filter)] = gmail_filter
+
+    def ensure_filter(self, body: dict) -> dict:
+        """The mailbox's filter with body's criteria+action, created if missing."""
+        with self.lock:
+            existing = self.existing_filter(body)
+            if existing is not None:
+                return existing
+            try:
+                gmail_filter = execute(self._gmail().users().settings().filters().create(userId="me", body=body))
+            except HttpError as e:
+                # Gmail refuses duplicates it normalized differently from us.
+                if getattr(e.resp, "status", None) != 400 or "exists" not in str(e).lower():
+                    raise
+                self.load_filters()
+                existing = self.filters.get(canonical_filter(body))
+                if existing is None:
+                    raise
+                return existing
+            self.add_filter(gmail_filter)
+            return gmail_filter
+
+
+_mailbox_indexes: Dict[str, MailboxIndex] = {}
+_mailbox_indexes_lock = threading.Lock()
+
+
+def mailbox_index(user_email: str, max_age: float = MAILBOX_INDEX_MAX_AGE) -> MailboxIndex:
+    """Process-wide label/filter index for a mailbox, reloaded after max_age seconds."""
+    key = user_email.lower()
+    with _mailbox_indexes_lock:
+        index = _mailbox_indexes.get(key)
+        if index is None or time.monotonic() - index.created_at > max_age:
+            index = _mailbox_indexes[key] = MailboxIndex(user_email)
+    return index
+
+
+def clear_mailbox_indexes():
+    """Forget every mailbox index (e.g. after switching tenants or transports)."""
+    with _mailbox_indexes_lock:
+        _mailbox_indexes.clear()
+
+
+def _known_mailbox_index(user_email: str, update):
+    # Keep an already-loaded index in step with changes made outside it.
+    with _mailbox_indexes_lock:
+        index = _mailbox_indexes.get(user_email.lower())
+    if index is not None:
+        update(index)
+
+
+def filter_body(from_address: str, label_id: str) -> dict:
+    return {
         "criteria": {
             "from": from_address,
         },
@@ -102,9 +448,70 @@ def create_filter_from_address(user_email: str, from_address: str, label_name: s
         }
     }
 
-    gmail_filter = gmail.users().settings().filters().create(
-        userId="me",
-        body=filter_body
-    ).execute()
 
-    return gmail_filter
+def create_filter_from_address(user_email: str, from_address: str, label_name: str):
+    """
+    If label doesn't exist, creates it.
+    Then creates a filter: if From == from_address, apply label.
+    If the mailbox already has exactly that filter, it is returned instead.
+    """
+    index = mailbox_index(user_email)
+    label_id = index.label_id(label_name)
+    return index.ensure_filter(filter_body(from_address, label_id))
+
+
+def create_filters_from_addresses(user_email: str, rules: List[Tuple[str, str]]) -> List[BatchResult]:
+    """
+    create_filter_from_address for many (from_address, label_name) rules in
+    one mailbox: one list call each for labels and filters, then missing
+    labels and missing filters are created in batches. Keys are the rules;
+    rules whose filter already exists return it without a call.
+    """
+    index = mailbox_index(user_email)
+    gmail = get_gmail_service(user_email)
+    with index.lock:
+        if index.labels is None:
+            index.load_labels()
+        if index.filters is None:
+            index.load_filters()
+
+        # One create per label, in the first spelling used ("Vendors" and
+        # "vendors" are the same label).
+        missing: Dict[str, str] = {}
+        for _, label in rules:
+            if label.casefold() not in index.labels:
+                missing.setdefault(label.casefold(), label)
+        label_errors = {}
+        if missing:
+            for r in create_labels(user_email, list(missing.values())):  # adds them to the index
+                if not r.ok:
+                    label_errors[r.key.casefold()] = r.error
+        conflicts = [
+            name for name, e in label_errors.items()
+            if isinstance(e, HttpError) and getattr(e.resp, "status", None) == 409
+        ]
+        if conflicts:
+            index.load_labels()  # created concurrently elsewhere
+            for name in conflicts:
+                if name in index.labels:
+                    del label_errors[name]
+
+        results: Dict[Tuple[str, str], BatchResult] = {}
+        calls = []
+        for rule in dict.fromkeys(rules):
+            from_address, label = rule
+            if label.casefold() in label_errors:
+                results[rule] = BatchResult(rule, None, label_errors[label.casefold()])
+                continue
+            body = filter_body(from_address, index.labels[label.casefold()])
+            existing = index.existing_filter(body)
+            if existing is not None:
+                results[rule] = BatchResult(rule, existing, None)
+            else:
+                calls.append((rule, gmail.users().settings().filters().create(userId="me", body=body)))
+
+        for r in execute_batch(gmail, calls, GMAIL_BATCH_SIZE):
+            if r.ok:
+                index.add_filter(r.response)
+            results[r.key] = r
+    return [results[rule] for rule in rules]